@@ -0,0 +1,329 @@
+import argparse
+import contextlib
+import copy
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from binance import Client
+from scipy.signal import lfilter
+
+from klines import KLINE_DTYPE
+from robot import (Robot, CONFIG_FILE_NAME, PAIRS_FILE_NAME, KLINES_WARMUP_LIMIT, EWM_SPREAD_STATS,
+                   ROLLING_SPREAD_STATS, MEAN_STRATEGY, PT_STRATEGY, TENDENCY_STRATEGY, sma_warmup_limit)
+
+FILLS_COLUMNS = ['time', 'symbol', 'side', 'quantity', 'price']
+
+
+def load_klines(file_name: str) -> np.ndarray:
+    """
+    Load open times and close prices from a Binance klines CSV dump or a kline cache file (.bin).
+    """
+    if file_name.endswith('.bin'):
+        return np.fromfile(file_name, dtype=KLINE_DTYPE)
+    df = pd.read_csv(file_name, header=None, usecols=[0, 4]).apply(pd.to_numeric, errors='coerce').dropna()
+    klines = np.empty(len(df), dtype=KLINE_DTYPE)
+    klines['open_time'] = df[0].to_numpy()
+    klines['close'] = df[4].to_numpy()
+    return klines
+
+
+def align_klines(klines: dict) -> dict:
+    """
+    Keep only candles with open times present for every symbol, so all symbols step together.
+    """
+    open_times = None
+    for symbol_klines in klines.values():
+        open_times = symbol_klines['open_time'] if open_times is None else \
+            np.intersect1d(open_times, symbol_klines['open_time'])
+    return {symbol: symbol_klines[np.isin(symbol_klines['open_time'], open_times)]
+            for symbol, symbol_klines in klines.items()}
+
+
+def prefix_sums(values: np.ndarray) -> np.ndarray:
+    return np.concatenate(([0.0], np.cumsum(values)))
+
+
+def rolling_mean(prefix: np.ndarray, window: int) -> np.ndarray:
+    """
+    Means of every full window from prefix sums, item i is the mean of values i..i + window - 1.
+    """
+    return (prefix[window:] - prefix[:-window]) / window
+
+
+def forward_fill(target: np.ndarray, start: float) -> np.ndarray:
+    # NaN means keep previous holding
+    index = np.where(np.isnan(target), 0, np.arange(len(target)))
+    np.maximum.accumulate(index, out=index)
+    filled = target[index]
+    filled[np.isnan(filled)] = start
+    return filled
+
+
+def sma_holdings(prefix: np.ndarray, long_term: int, short_term: int, band: float, warmup: int,
+                 start_holding: float) -> np.ndarray:
+    """
+    Holding (1 - asset bought, 0 - not) after every candle from `warmup` on, by the MEAN_SMA rule:
+    buy when short SMA is above long SMA + band, sell when it is below.
+    """
+    long_sma = rolling_mean(prefix, long_term)
+    short_sma = rolling_mean(prefix, short_term)[long_term - short_term:]
+    # SMAs are aligned to candles long_term - 1 .. n - 1
+    long_sma = long_sma[warmup - long_term + 1:]
+    short_sma = short_sma[warmup - long_term + 1:]
+    upper = long_sma + long_sma * band
+    target = np.where(short_sma > upper, 1.0, np.where(short_sma < upper, 0.0, np.nan))
+    return forward_fill(target, start_holding)
+
+
+def pairs_spread_stats(close1: np.ndarray, close2: np.ndarray, window: int, warmup: int) -> tuple:
+    """
+    Spread of returns of two assets with mean and std of the last `window` spreads, for every candle
+    from `warmup` on.
+    """
+    spread = np.diff(close1) - np.diff(close2)
+    mean = rolling_mean(prefix_sums(spread), window)
+    mean_of_squares = rolling_mean(prefix_sums(spread * spread), window)
+    std = np.sqrt(np.maximum(mean_of_squares - mean * mean, 0) * window / (window - 1))
+    # spread i belongs to candle i + 1, windows are aligned to candles window .. n - 1
+    offset = warmup - window
+    return spread[warmup - 1:], mean[offset:], std[offset:]
+
+
+def ewm_spread_stats(close1: np.ndarray, close2: np.ndarray, span: int, warmup: int) -> tuple:
+    """
+    Spread of returns of two assets with exponentially weighted mean and std of spreads (EwmStats), for
+    every candle from `warmup` on. Both recurrences are linear filters over the whole series. Like Robot,
+    they start from the second candle, because its warm-up skips the first kline.
+    """
+    spread = np.diff(close1) - np.diff(close2)
+    alpha = 2 / (span + 1)
+    values = spread[1:]
+    mean = np.empty(len(values))
+    mean[0] = values[0]
+    mean[1:] = lfilter([alpha], [1, alpha - 1], values[1:], zi=[(1 - alpha) * values[0]])[0]
+    difference = values[1:] - mean[:-1]
+    variance = np.zeros(len(values))
+    variance[1:] = lfilter([(1 - alpha) * alpha], [1, alpha - 1], difference * difference)
+    # value i belongs to candle i + 2
+    offset = warmup - 2
+    return spread[warmup - 1:], mean[offset:], np.sqrt(variance[offset:])
+
+
+def spread_stats(config: dict, close1: np.ndarray, close2: np.ndarray, warmup: int) -> tuple:
+    """
+    Spread with mean and std of the pairs strategy config, rolling or exponentially weighted.
+    """
+    if config.get('spread_stats', ROLLING_SPREAD_STATS) == EWM_SPREAD_STATS:
+        return ewm_spread_stats(close1, close2, config.get('spread_span', KLINES_WARMUP_LIMIT - 1), warmup)
+    return pairs_spread_stats(close1, close2, warmup - 1, warmup)
+
+
+def pairs_holdings(spread: np.ndarray, mean: np.ndarray, std: np.ndarray, entry_treshold: float,
+                   exit_treshold: float, start_holdings: tuple) -> tuple:
+    """
+    Holdings of both assets after every candle by the PT_STRATEGY rule. Like Robot, the first entry
+    sends both legs regardless of positions, which can leave a leg short.
+    """
+    enter_long = spread > mean + std * entry_treshold
+    enter_short = ~enter_long & (spread < mean - std * entry_treshold)
+    close = ~enter_long & ~enter_short & (np.abs(spread) < std * exit_treshold)
+    target1 = np.where(enter_long, 1.0, np.where(enter_short | close, 0.0, np.nan))
+    target2 = np.where(enter_short, 1.0, np.where(enter_long | close, 0.0, np.nan))
+    holdings1 = forward_fill(target1, start_holdings[0])
+    holdings2 = forward_fill(target2, start_holdings[1])
+
+    entries = np.flatnonzero(enter_long | enter_short)
+    if len(entries):
+        first = entries[0]
+        previous1 = holdings1[first - 1] if first else start_holdings[0]
+        previous2 = holdings2[first - 1] if first else start_holdings[1]
+        # bought leg keeps what it held before, sold leg can go one unit below
+        if enter_long[first]:
+            holdings1[first:] += previous1
+            holdings2[first:] += previous2 - 1
+        else:
+            holdings1[first:] += previous1 - 1
+            holdings2[first:] += previous2
+    return holdings1, holdings2
+
+
+def holdings_fills(symbol: str, klines: np.ndarray, holdings: np.ndarray, start_holding: float,
+                   quantity: float) -> pd.DataFrame:
+    klines = klines[len(klines) - len(holdings):]
+    change = np.diff(holdings, prepend=start_holding)
+    index = np.nonzero(change)[0]
+    return pd.DataFrame({'time': klines['open_time'][index], 'symbol': symbol,
+                         'side': np.where(change[index] > 0, 'BUY', 'SELL'),
+                         'quantity': np.abs(change[index]) * quantity, 'price': klines['close'][index]},
+                        columns=FILLS_COLUMNS)
+
+
+def holdings_pnl(closes: np.ndarray, holdings: np.ndarray, start_holding: float, quantity: float) -> float:
+    """
+    Same as fills_pnl, straight from holdings after every candle and close prices starting one candle earlier.
+    """
+    change = np.diff(holdings, prepend=start_holding)
+    cash = -float(np.dot(change, closes[1:])) * quantity
+    return cash + float(holdings[-1] * closes[-1] - start_holding * closes[0]) * quantity
+
+
+def fills_pnl(fills: pd.DataFrame, start_quantity: float, first_price: float, last_price: float) -> float:
+    """
+    Change of quote value of traded asset and cash, marked to market at the last price.
+    """
+    signed = np.where(fills['side'] == 'BUY', 1.0, -1.0) * fills['quantity'].to_numpy()
+    cash = -float(np.sum(signed * fills['price'].to_numpy()))
+    end_quantity = start_quantity + float(np.sum(signed))
+    return cash + float(end_quantity * last_price - start_quantity * first_price)
+
+
+class BacktestClient:
+    """
+    Subset of binance Client used by Robot, serving klines up to the current candle and filling
+    every order at the requested price or current close price.
+    """
+
+    def __init__(self, klines: dict):
+        self._klines = klines
+        self.index = 0
+        self.fills = []
+
+    def get_historical_klines(self, symbol, interval, start_str=None, end_str=None, limit=None):
+        klines = self._klines[symbol][max(0, self.index - limit + 1):self.index + 1]
+        return [[open_time, close, close, close, close, 0.0, open_time, 0.0, 0, 0.0, 0.0, 0.0]
+                for open_time, close in zip(klines['open_time'].tolist(), klines['close'].tolist())]
+
+    def get_avg_price(self, symbol):
+        return {'price': str(self._klines[symbol]['close'][self.index])}
+
+    def get_symbol_info(self, symbol):
+        return {'symbol': symbol, 'filters': [{'filterType': 'PRICE_FILTER', 'tickSize': '0.00000001'}]}
+
+    def get_exchange_info(self):
+        return {'symbols': [self.get_symbol_info(symbol) for symbol in self._klines]}
+
+    def create_order(self, symbol, side, type, quantity, price=None, **params):
+        fill_price = price if price is not None else float(self._klines[symbol]['close'][self.index])
+        self.fills.append((int(self._klines[symbol]['open_time'][self.index]), symbol, side, float(quantity),
+                           float(fill_price)))
+        return {'symbol': symbol, 'side': side, 'type': type, 'status': Client.ORDER_STATUS_FILLED,
+                'orderId': len(self.fills)}
+
+
+def strategy_warmup(config: dict) -> int:
+    return sma_warmup_limit(config) if config['strategy'] == MEAN_STRATEGY else KLINES_WARMUP_LIMIT
+
+
+def multi_timeframe(config: dict) -> bool:
+    return config.get('long_interval', config['interval']) != config['interval'] or \
+        config.get('short_interval', config['interval']) != config['interval']
+
+
+def run_vectorized(config: dict, pairs_config: dict, klines: dict) -> pd.DataFrame:
+    warmup = strategy_warmup(config)
+    start = {symbol: 1.0 if symbol_config['position'] == 'SELL' else 0.0
+             for symbol, symbol_config in pairs_config.items()}
+    fills = []
+    if config['strategy'] == MEAN_STRATEGY:
+        if multi_timeframe(config):
+            raise ValueError("SMAs of different intervals have no vectorized backtest, use event-driven one")
+        for symbol in pairs_config:
+            holdings = sma_holdings(prefix_sums(klines[symbol]['close']), config['long_term'], config['short_term'],
+                                    config['band'], warmup, start[symbol])
+            fills.append(holdings_fills(symbol, klines[symbol], holdings, start[symbol],
+                                        pairs_config[symbol]['trade_quantity']))
+    elif config['strategy'] == PT_STRATEGY:
+        for pair in config['pairs']:
+            asset1, asset2 = pair['asset1'], pair['asset2']
+            spread, mean, std = spread_stats(config, klines[asset1]['close'], klines[asset2]['close'], warmup)
+            holdings = pairs_holdings(spread, mean, std, config['entry_treshold'], config['exit_treshold'],
+                                      (start[asset1], start[asset2]))
+            for symbol, symbol_holdings in zip((asset1, asset2), holdings):
+                fills.append(holdings_fills(symbol, klines[symbol], symbol_holdings, start[symbol],
+                                            pairs_config[symbol]['trade_quantity']))
+    else:
+        raise ValueError(f"{config['strategy']} has no vectorized backtest, use event-driven one")
+    return pd.concat(fills, ignore_index=True).sort_values(['time', 'symbol'], kind='stable', ignore_index=True)
+
+
+def run_event_driven(config: dict, pairs_config: dict, klines: dict) -> pd.DataFrame:
+    """
+    Step Robot itself through klines candle by candle, so decisions come from the live trading code.
+    """
+    warmup = strategy_warmup(config)
+    client = BacktestClient(klines)
+    config = copy.deepcopy(config)
+    if config['strategy'] == TENDENCY_STRATEGY:
+        # wait for every forecast, so results do not depend on machine speed
+        config['arima_timeout'] = None
+    robot = Robot(config, copy.deepcopy(pairs_config), client=client, disk_cache=False)
+    candles = min(len(symbol_klines) for symbol_klines in klines.values())
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        client.index = warmup - 1
+        robot._prepare()
+        for index in range(warmup, candles):
+            client.index = index
+            robot._try_trade()
+            # orders are placed on worker threads, every one is filled before the next candle
+            robot._orders.wait()
+    robot._shutdown()
+    fills = pd.DataFrame(client.fills, columns=FILLS_COLUMNS)
+    return fills.sort_values(['time', 'symbol'], kind='stable', ignore_index=True)
+
+
+def run_backtest(config: dict, pairs_config: dict, klines: dict, event_driven: bool = False) -> dict:
+    klines = align_klines(klines)
+    start = time.perf_counter()
+    if event_driven or config['strategy'] == TENDENCY_STRATEGY or multi_timeframe(config):
+        fills = run_event_driven(config, pairs_config, klines)
+    else:
+        fills = run_vectorized(config, pairs_config, klines)
+    seconds = time.perf_counter() - start
+
+    warmup = strategy_warmup(config)
+    pnl = {}
+    for symbol, symbol_config in pairs_config.items():
+        start_quantity = symbol_config['trade_quantity'] if symbol_config['position'] == 'SELL' else 0.0
+        closes = klines[symbol]['close']
+        pnl[symbol] = fills_pnl(fills[fills['symbol'] == symbol], start_quantity, closes[warmup - 1], closes[-1])
+    candles = min(len(symbol_klines) for symbol_klines in klines.values())
+    return {'fills': fills, 'pnl': pnl, 'candles': candles, 'seconds': seconds}
+
+
+def print_result(result: dict) -> None:
+    for symbol, pnl in result['pnl'].items():
+        fills = result['fills'][result['fills']['symbol'] == symbol]
+        print(f"{symbol}: {len(fills)} fills, PnL {pnl:.2f}")
+    print(f"Total PnL: {sum(result['pnl'].values()):.2f}")
+    print(f"{result['candles']} candles in {result['seconds']:.3f} s "
+          f"({result['candles'] / max(result['seconds'], 1e-9):.0f} candles/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Backtest strategy from config.json on historical klines.')
+    parser.add_argument('data', nargs='+', help='SYMBOL=file with klines (Binance CSV dump or kline cache .bin)')
+    parser.add_argument('--event', action='store_true', help='step Robot decision methods instead of vectorized')
+    parser.add_argument('--fills', help='save fills to this CSV file')
+    args = parser.parse_args()
+
+    with open(CONFIG_FILE_NAME, 'r') as config_file:
+        config = json.load(config_file)
+    with open(PAIRS_FILE_NAME, 'r') as pairs_file:
+        pairs_config = json.load(pairs_file)
+
+    files = dict(item.split('=', 1) for item in args.data)
+    klines = {symbol: load_klines(file_name) for symbol, file_name in files.items()}
+    pairs_config = {symbol: symbol_config for symbol, symbol_config in pairs_config.items() if symbol in klines}
+
+    result = run_backtest(config, pairs_config, klines, event_driven=args.event)
+    print_result(result)
+    if args.fills:
+        result['fills'].to_csv(args.fills, index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,296 @@
+import argparse
+import contextlib
+import copy
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from backtest import load_klines, strategy_warmup
+from fake_exchange import FakeExchange, FILL_ALWAYS, FILL_CROSS
+from klines import KLINE_DTYPE, KlineBuffer
+from order_executor import OrderExecutor
+from robot import Robot, KLINES_COLUMNS, MEAN_STRATEGY, PT_STRATEGY, TENDENCY_STRATEGY
+
+INTERVAL_MS = 60000
+ROBOT_TICKS = 200
+REGRESSION_TOLERANCE = 0.2  # 20 percent
+GRAPH_KLINES = 31 * 24 * 60  # a month of 1m klines
+GRAPH_ORDERS = 10000  # per symbol
+
+BENCH_PAIRS = [{'asset1': 'BTCBUSD', 'asset2': 'ETHBUSD'}, {'asset1': 'LTCBUSD', 'asset2': 'BNBBUSD'}]
+BENCH_CONFIGS = {
+    MEAN_STRATEGY: {'long_term': 60, 'short_term': 15, 'band': 0.001},
+    PT_STRATEGY: {'entry_treshold': 1.5, 'exit_treshold': 0.2, 'pairs': BENCH_PAIRS},
+    # wait for every forecast, so each tick does the same work on any machine
+    TENDENCY_STRATEGY: {'arima_timeout': None},
+}
+# result fields compared with a baseline, True when higher is better
+COMPARED_FIELDS = {'ticks_per_s': True, 'peak_kib': False, 'startup_s': False, 'rss_mib': False}
+# modules a robot should import only when its strategy or tool needs them
+HEAVY_MODULES = ('pandas', 'matplotlib', 'statsmodels', 'pmdarima')
+
+# run by a fresh interpreter, prints import and construction time, peak RSS and loaded heavy modules
+STARTUP_SCRIPT = '''
+import json
+import sys
+import time
+
+start = time.perf_counter()
+from robot import Robot
+imported = time.perf_counter()
+
+import numpy as np
+from fake_exchange import FakeExchange
+from klines import KLINE_DTYPE
+
+config, pairs_config, heavy_modules = (json.loads(arg) for arg in sys.argv[1:4])
+klines = {symbol: np.zeros(1, dtype=KLINE_DTYPE) for symbol in pairs_config}
+constructing = time.perf_counter()
+robot = Robot(config, pairs_config, client=FakeExchange(klines), disk_cache=False)
+constructed = time.perf_counter()
+robot._shutdown()
+# peak RSS of this process only, ru_maxrss would report the benchmark that started it when that is bigger
+with open('/proc/self/status') as status_file:
+    peak_kib = next(int(line.split()[1]) for line in status_file if line.startswith('VmHWM:'))
+print(json.dumps({'import_s': imported - start, 'init_s': constructed - constructing,
+                  'rss_mib': peak_kib / 1024,
+                  'heavy': [name for name in heavy_modules if name in sys.modules]}))
+'''
+
+
+def make_klines(count: int, start: int = 0) -> list:
+    """
+    Synthetic klines in REST list layout with a random walk close price.
+    """
+    closes = 100 + np.cumsum(np.random.default_rng(start).normal(0, 0.1, count))
+    return [[(start + i) * INTERVAL_MS, '0', '0', '0', f'{close:.2f}', '0', (start + i + 1) * INTERVAL_MS - 1,
+             '0', 0, '0', '0', '0'] for i, close in enumerate(closes)]
+
+
+def klines_to_df(klines: list) -> pd.DataFrame:
+    klines = np.array(klines)
+    df = pd.DataFrame(klines.reshape(-1, 12), dtype=float, columns=KLINES_COLUMNS)
+    df['Open Time'] = pd.to_datetime(df['Open Time'], unit='ms')
+    return df[['Open Time', 'Close']]
+
+
+def measure(tick, ticks: list) -> tuple:
+    """
+    Run tick for every item and return mean seconds and mean allocated bytes per tick.
+    """
+    tracemalloc.start()
+    allocated = 0
+    start = time.perf_counter()
+    for item in ticks:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        tick(item)
+        allocated += tracemalloc.get_traced_memory()[1] - before
+    elapsed = time.perf_counter() - start
+    tracemalloc.stop()
+    return elapsed / len(ticks), allocated / len(ticks)
+
+
+def bench_kline_ingest(window: int, ticks: int = 200) -> None:
+    history = make_klines(window)
+    new_klines = make_klines(ticks, start=window)
+
+    state = {'df': klines_to_df(history)}
+
+    def concat_tick(kline):
+        df = state['df'].iloc[1:]
+        state['df'] = pd.concat([df, klines_to_df([kline])], ignore_index=True)
+
+    buffer = KlineBuffer(window)
+    buffer.extend(history)
+
+    def buffer_tick(kline):
+        buffer.extend([kline])
+
+    for name, tick in (('pd.concat', concat_tick), ('KlineBuffer', buffer_tick)):
+        seconds, allocated = measure(tick, new_klines)
+        print(f"{window=:>7} {name:<12} {seconds * 1e6:>10.1f} us/tick {allocated / 1024:>10.1f} KiB/tick")
+
+
+def bench_order_graphs(symbols: list, klines_count: int = GRAPH_KLINES, orders_count: int = GRAPH_ORDERS) -> None:
+    from util import render_order_graphs
+
+    klines = make_recorded_klines(symbols, klines_count)
+    graphs = []
+    for seed, symbol in enumerate(symbols):
+        rng = np.random.default_rng(seed)
+        index = np.sort(rng.integers(0, klines_count, orders_count))
+        orders = {'time': klines[symbol]['open_time'][index], 'price': klines[symbol]['close'][index],
+                  'side': rng.choice(['BUY', 'SELL'], orders_count),
+                  'executed': rng.choice([0.0, 1.0], orders_count, p=[0.2, 0.8])}
+        graphs.append((symbol, orders, klines[symbol]))
+    with tempfile.TemporaryDirectory() as output_dir:
+        start = time.perf_counter()
+        render_order_graphs(graphs, output_dir)
+        seconds = time.perf_counter() - start
+    print(f"{len(symbols)} order graphs of {klines_count} klines and {orders_count} orders in {seconds:.2f} s")
+
+
+def make_recorded_klines(symbols: list, count: int) -> dict:
+    """
+    Synthetic recorded klines for the fake exchange, a different random walk for every symbol.
+    """
+    klines = {}
+    for seed, symbol in enumerate(symbols):
+        symbol_klines = np.empty(count, dtype=KLINE_DTYPE)
+        symbol_klines['open_time'] = np.arange(count) * INTERVAL_MS
+        symbol_klines['close'] = np.round(100 + np.cumsum(np.random.default_rng(seed).normal(0, 0.3, count)), 2)
+        klines[symbol] = symbol_klines
+    return klines
+
+
+def bench_config(strategy: str) -> dict:
+    return {'api_key': '', 'api_secret': '', 'timeout': 60, 'interval': '1m', 'strategy': strategy,
+            'metrics': True, **copy.deepcopy(BENCH_CONFIGS[strategy])}
+
+
+def bench_pairs_config(symbols) -> dict:
+    return {symbol: {'trade_quantity': 1, 'position': 'BUY', 'order_type': 'LIMIT', 'time_in_force': 'FOK'}
+            for symbol in symbols}
+
+
+def bench_startup(strategy: str, symbols: list) -> dict:
+    """
+    Import and construction time of Robot and peak RSS in a fresh interpreter, like a newly started worker.
+    """
+    output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT, json.dumps(bench_config(strategy)),
+                             json.dumps(bench_pairs_config(symbols)), json.dumps(HEAVY_MODULES)],
+                            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True,
+                            check=True).stdout
+    result = json.loads(output.splitlines()[-1])
+    result['startup_s'] = result['import_s'] + result['init_s']
+    print(f"{strategy:<15} import {result['import_s'] * 1000:>8.1f} ms   init {result['init_s'] * 1000:>8.1f} ms   "
+          f"{result['rss_mib']:>7.1f} MiB peak RSS   heavy modules: {', '.join(result['heavy']) or '-'}")
+    return result
+
+
+def run_robot(strategy: str, klines: dict, ticks: int, latency: float, fill_rule: str,
+              trace_memory: bool = False) -> dict:
+    """
+    Run Robot against the fake exchange for ticks candles after warm-up, every order is filled or given
+    up before the next candle.
+    """
+    config = bench_config(strategy)
+    pairs_config = bench_pairs_config(klines)
+    warmup = strategy_warmup(config)
+    exchange = FakeExchange(klines, latency=latency, fill_rule=fill_rule)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        robot = Robot(config, pairs_config, client=exchange, disk_cache=False)
+        # orders that are not filled are retried right away instead of after ORDER_RETRY_WAIT_TIME_S
+        robot._orders.shutdown()
+        robot._orders = OrderExecutor(exchange, robot._get_symbol_avg_price, retry_wait=0, metrics=robot._metrics,
+                                      on_fill=robot._on_order_fill)
+        exchange.index = warmup - 1
+        robot._prepare()
+        robot._load_portfolio()
+        if trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        for _ in range(ticks):
+            exchange.step()
+            robot._try_trade()
+            robot._orders.wait()
+        seconds = time.perf_counter() - start
+        peak = 0
+        if trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        robot._shutdown()
+    return {'seconds': seconds, 'peak': peak, 'fills': len(exchange.fills), 'stages': robot._metrics.summary()}
+
+
+def bench_robot(strategy: str, klines: dict, ticks: int, latency: float, fill_rule: str) -> dict:
+    """
+    Ticks per second and per-stage timing of a plain run, peak memory of the robot process from a second
+    run under tracemalloc, which slows it down too much to be timed.
+    """
+    timed = run_robot(strategy, klines, ticks, latency, fill_rule)
+    traced = run_robot(strategy, klines, ticks, latency, fill_rule, trace_memory=True)
+    result = {'ticks_per_s': ticks / timed['seconds'], 'peak_kib': traced['peak'] / 1024, 'fills': timed['fills'],
+              'stages_ms': {stage: seconds / count * 1000 for stage, (count, seconds) in timed['stages'].items()}}
+    print(f"{strategy:<15} {result['ticks_per_s']:>9.1f} ticks/s {result['peak_kib']:>10.1f} KiB peak "
+          f"{result['fills']:>5} fills")
+    for stage, ms in sorted(result['stages_ms'].items()):
+        print(f"    {stage:<10} {ms:>10.3f} ms")
+    return result
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Regressions of results against a baseline: strategies more than tolerance slower or bigger.
+    """
+    regressions = []
+    for strategy, result in results.items():
+        base = baseline.get(strategy, {})
+        for field, higher_is_better in COMPARED_FIELDS.items():
+            if field not in result or field not in base:
+                continue
+            if higher_is_better and result[field] < base[field] * (1 - tolerance) or \
+                    not higher_is_better and result[field] > base[field] * (1 + tolerance):
+                regressions.append(f"{strategy} {field} {base[field]:.3f} -> {result[field]:.3f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark kline ingestion and Robot against a fake exchange.')
+    parser.add_argument('data', nargs='*', help='SYMBOL=file with recorded klines, synthetic when not given')
+    parser.add_argument('--ticks', type=int, default=ROBOT_TICKS, help='candles traded per strategy')
+    parser.add_argument('--strategies', nargs='+', default=[MEAN_STRATEGY, PT_STRATEGY, TENDENCY_STRATEGY],
+                        choices=list(BENCH_CONFIGS))
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds every fake exchange call takes')
+    parser.add_argument('--fill-rule', default=FILL_ALWAYS, choices=[FILL_ALWAYS, FILL_CROSS])
+    parser.add_argument('--skip-klines', action='store_true', help='skip kline ingestion benchmark')
+    parser.add_argument('--skip-startup', action='store_true', help='skip import and construction benchmark')
+    parser.add_argument('--skip-graphs', action='store_true', help='skip order graph rendering benchmark')
+    parser.add_argument('--save', help='save results to this JSON file')
+    parser.add_argument('--baseline', help='JSON file saved by an earlier run, regressions exit with code 1')
+    parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE)
+    args = parser.parse_args()
+
+    if not args.skip_klines:
+        for window in (1000, 100000):
+            bench_kline_ingest(window)
+
+    if not args.skip_graphs:
+        bench_order_graphs([symbol for pair in BENCH_PAIRS for symbol in pair.values()])
+
+    if args.data:
+        files = dict(item.split('=', 1) for item in args.data)
+        klines = {symbol: load_klines(file_name) for symbol, file_name in files.items()}
+    else:
+        symbols = [symbol for pair in BENCH_PAIRS for symbol in pair.values()]
+        count = max(strategy_warmup(bench_config(strategy)) for strategy in args.strategies) + args.ticks
+        klines = make_recorded_klines(symbols, count)
+    results = {strategy: {} for strategy in args.strategies}
+    if not args.skip_startup:
+        for strategy in args.strategies:
+            results[strategy].update(bench_startup(strategy, list(klines)))
+    for strategy in args.strategies:
+        results[strategy].update(bench_robot(strategy, klines, args.ticks, args.latency, args.fill_rule))
+
+    if args.save:
+        with open(args.save, 'w') as save_file:
+            json.dump(results, save_file, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r') as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
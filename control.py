@@ -0,0 +1,108 @@
+import json
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from binance import exceptions
+
+CONTROL_HOST = '127.0.0.1'  # local only, endpoint has no authentication
+CONTROL_PORT = 8790
+
+
+class ControlServer:
+    """
+    Local HTTP endpoint with menu functions of a headless robot, every answer is JSON.
+
+    GET  /balances
+    GET  /portfolio
+    GET  /positions
+    GET  /orders?symbol=BTCBUSD&limit=10
+    GET  /pnl?symbol=BTCBUSD
+    GET  /order?symbol=BTCBUSD&order_id=1
+    GET  /symbol_info?symbol=BTCBUSD
+    POST /cancel?symbol=BTCBUSD&order_id=1
+    POST /market_order?symbol=BTCBUSD&side=BUY&quantity=0.01
+    POST /stop
+    GET  /metrics (Prometheus text)
+    GET  /trace
+    """
+
+    def __init__(self, robot, stop_event: threading.Event, port: int = CONTROL_PORT):
+        self._robot = robot
+        self._stop_event = stop_event
+        self._server = ThreadingHTTPServer((CONTROL_HOST, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='control', daemon=True)
+        self._get_routes = {
+            '/balances': lambda params: robot._get_balance_values(),
+            '/portfolio': lambda params: robot._get_portfolio_history(),
+            '/positions': lambda params: robot._get_positions(),
+            '/orders': lambda params: robot._get_symbol_orders(params['symbol'], int(params.get('limit', 10))),
+            '/pnl': lambda params: robot._get_symbol_pnl(params['symbol']),
+            '/order': lambda params: robot._get_symbol_order(params['symbol'], params['order_id']),
+            '/symbol_info': lambda params: robot._get_symbol_info(params['symbol']),
+            '/metrics': lambda params: robot._metrics.render(),
+            '/trace': lambda params: robot._metrics.traces(),
+        }
+        self._post_routes = {
+            '/cancel': lambda params: robot._cancel_symbol_order(params['symbol'], params['order_id']),
+            '/market_order': lambda params: robot._make_market_order(params['symbol'], params['side'],
+                                                                     params['quantity']),
+            '/stop': lambda params: self._stop(),
+        }
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _stop(self) -> dict:
+        self._stop_event.set()
+        return {'stopping': True}
+
+    def _make_handler(self):
+        control = self
+
+        class ControlHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self._handle(control._get_routes)
+
+            def do_POST(self):
+                self._handle(control._post_routes)
+
+            def log_message(self, *args):
+                pass
+
+            def _handle(self, routes: dict) -> None:
+                url = urlparse(self.path)
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                route = routes.get(url.path)
+                if route is None:
+                    status, payload = 404, {'error': f"unknown path {url.path}"}
+                else:
+                    try:
+                        status, payload = 200, route(params)
+                    except KeyError as e:
+                        status, payload = 400, {'error': f"missing parameter {e}"}
+                    except (exceptions.BinanceAPIException, exceptions.BinanceOrderException) as e:
+                        status, payload = 502, {'error': e.message}
+                    except Exception as e:
+                        status, payload = 500, {'error': str(e)}
+                if isinstance(payload, str):
+                    content_type, data = 'text/plain; version=0.0.4', payload.encode()
+                else:
+                    content_type, data = 'application/json', json.dumps(payload, default=str).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return ControlHandler
@@ -0,0 +1,27 @@
+import json
+import signal
+import threading
+
+from control import ControlServer, CONTROL_PORT
+from robot import Robot, CONFIG_FILE_NAME
+
+
+def main():
+    with open(CONFIG_FILE_NAME, 'r') as config_file:
+        config = json.load(config_file)
+    robot = Robot(config)
+    stop_event = threading.Event()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signal_number, lambda *args: stop_event.set())
+
+    control = ControlServer(robot, stop_event, config.get('control_port', CONTROL_PORT))
+    control.start()
+    print(f"Robot running headless, control endpoint on http://127.0.0.1:{control.port}/")
+    try:
+        robot.run_headless(stop_event)
+    finally:
+        control.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+import json
+import os
+import threading
+import time
+
+EXCHANGE_INFO_FILE_NAME = 'exchange_info.json'
+EXCHANGE_INFO_TTL_S = 24 * 60 * 60  # symbol filters rarely change
+EXCHANGE_INFO_MISS_TTL_S = 10 * 60  # unknown symbol reloads exchange info at most this often
+PRICE_SNAPSHOT_TTL_S = 5
+
+
+class ExchangeInfo:
+    """
+    Info and filters of every symbol, loaded with one exchange info request and persisted to disk.
+
+    File is reused until it is older than ttl. Symbol missing from it triggers one reload, e.g. for
+    a symbol listed after the file was saved, and a symbol still missing after it is remembered and
+    not reloaded again for miss ttl.
+    """
+
+    def __init__(self, client, file_name: str = EXCHANGE_INFO_FILE_NAME, ttl: float = EXCHANGE_INFO_TTL_S,
+                 miss_ttl: float = EXCHANGE_INFO_MISS_TTL_S):
+        self._client = client
+        # None keeps info only in memory
+        self._file_name = file_name
+        self._ttl = ttl
+        self._miss_ttl = miss_ttl
+        self._symbols = None
+        # monotonic time a symbol was found missing from freshly downloaded info
+        self._missing = {}
+        self._lock = threading.Lock()
+
+    def symbol_info(self, symbol: str) -> dict:
+        with self._lock:
+            if self._symbols is None:
+                self._symbols = self._load()
+            if symbol not in self._symbols:
+                missing_time = self._missing.get(symbol)
+                if missing_time is None or time.monotonic() - missing_time >= self._miss_ttl:
+                    self._symbols = self._download()
+                    self._missing = {}
+                    if symbol not in self._symbols:
+                        self._missing[symbol] = time.monotonic()
+            if symbol not in self._symbols:
+                raise ValueError(f"Symbol {symbol} is not listed in exchange info")
+            return self._symbols[symbol]
+
+    def symbol_filter(self, symbol: str, filter_type: str) -> dict:
+        for symbol_filter in self.symbol_info(symbol)['filters']:
+            if symbol_filter['filterType'] == filter_type:
+                return symbol_filter
+        raise ValueError(f"Symbol {symbol} has no {filter_type} filter")
+
+    def tick_size(self, symbol: str) -> float:
+        return float(self.symbol_filter(symbol, 'PRICE_FILTER')['tickSize'])
+
+    def _load(self) -> dict:
+        if self._file_name and os.path.exists(self._file_name):
+            with open(self._file_name, 'r') as info_file:
+                data = json.load(info_file)
+            if time.time() - data['time'] < self._ttl:
+                return data['symbols']
+        return self._download()
+
+    def _download(self) -> dict:
+        symbols = {info['symbol']: info for info in self._client.get_exchange_info()['symbols']}
+        if self._file_name:
+            temp_file_name = f"{self._file_name}.{os.getpid()}.tmp"
+            with open(temp_file_name, 'w') as info_file:
+                json.dump({'time': time.time(), 'symbols': symbols}, info_file)
+            os.replace(temp_file_name, self._file_name)
+        return symbols
+
+
+class PriceSnapshot:
+    """
+    Latest prices of all symbols from one request, reused for ttl seconds.
+    """
+
+    def __init__(self, client, ttl: float = PRICE_SNAPSHOT_TTL_S):
+        self._client = client
+        self._ttl = ttl
+        self._prices = {}
+        self._time = None
+        self._lock = threading.Lock()
+
+    def prices(self) -> dict:
+        with self._lock:
+            if self._time is None or time.monotonic() - self._time >= self._ttl:
+                self._prices = {ticker['symbol']: float(ticker['price']) for ticker in self._client.get_all_tickers()}
+                self._time = time.monotonic()
+            return self._prices
+
+    def price(self, symbol: str) -> float:
+        return self.prices().get(symbol)
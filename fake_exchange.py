@@ -0,0 +1,201 @@
+import json
+import random
+import threading
+import time
+
+from binance import Client, exceptions
+from binance.helpers import interval_to_milliseconds
+
+from order_executor import ORDER_DOES_NOT_EXIST_CODE
+
+QUOTE_ASSETS = ('BUSD', 'USDT')
+DEFAULT_QUOTE_BALANCE = 10000.0
+
+# every order is filled at its price or at the current close
+FILL_ALWAYS = 'ALWAYS'
+# LIMIT order is filled only when current close reaches its price, GTC order rests until it does
+FILL_CROSS = 'CROSS'
+
+
+class FakeExchange:
+    """
+    Local stand-in for the part of binance Client used by Robot, driven by recorded klines
+    (KLINE_DTYPE arrays keyed by symbol). The exchange is at candle `index`, moved with step, and serves
+    only klines up to it. Every call sleeps for its latency, given in seconds for all methods or per
+    method name. Orders are filled by fill_rule; fill_ratio below 1 rejects orders at random, with a
+    fixed seed so runs repeat exactly.
+    """
+
+    def __init__(self, klines: dict, latency=0.0, fill_rule: str = FILL_ALWAYS, fill_ratio: float = 1.0,
+                 seed: int = 0, balances: dict = None):
+        self._klines = klines
+        self._latency = latency
+        self._fill_rule = fill_rule
+        self._fill_ratio = fill_ratio
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.index = 0
+        # every order by order id, in placing order
+        self.orders = {}
+        # (open time, symbol, side, quantity, price) of every fill
+        self.fills = []
+        # every fill in get_my_trades layout
+        self.trades = []
+        self.balances = dict(balances) if balances is not None else {quote: DEFAULT_QUOTE_BALANCE
+                                                                     for quote in QUOTE_ASSETS}
+        self.calls = {}
+
+    def step(self, count: int = 1) -> None:
+        """
+        Move to a later candle, resting GTC orders reached by its close are filled.
+        """
+        with self._lock:
+            self.index += count
+            for order in self.orders.values():
+                if order['status'] == Client.ORDER_STATUS_NEW and self._reached(order):
+                    self._fill(order, float(order['price']))
+
+    # MARKET DATA
+    def get_historical_klines(self, symbol, interval, start_str=None, end_str=None, limit=None):
+        self._call('get_historical_klines')
+        interval_ms = interval_to_milliseconds(interval)
+        klines = self._klines[symbol][:self.index + 1]
+        if start_str is not None:
+            klines = klines[klines['open_time'] >= int(start_str)]
+        if end_str is not None:
+            klines = klines[klines['open_time'] <= int(end_str)]
+        if limit is not None:
+            klines = klines[-limit:]
+        return [[open_time, close, close, close, close, '0', open_time + interval_ms - 1, '0', 0, '0', '0', '0']
+                for open_time, close in zip(klines['open_time'].tolist(), map(str, klines['close'].tolist()))]
+
+    def get_avg_price(self, symbol):
+        self._call('get_avg_price')
+        return {'mins': 5, 'price': str(self._close(symbol))}
+
+    def get_ticker(self, symbol=None):
+        self._call('get_ticker')
+        if symbol is not None:
+            return self._ticker(symbol)
+        return [self._ticker(symbol) for symbol in self._klines]
+
+    def get_all_tickers(self):
+        self._call('get_all_tickers')
+        return [{'symbol': symbol, 'price': str(self._close(symbol))} for symbol in self._klines]
+
+    # EXCHANGE INFO
+    def get_symbol_info(self, symbol):
+        self._call('get_symbol_info')
+        return self._symbol_info(symbol)
+
+    def get_exchange_info(self):
+        self._call('get_exchange_info')
+        return {'rateLimits': [], 'symbols': [self._symbol_info(symbol) for symbol in self._klines]}
+
+    # ACCOUNT
+    def get_account(self):
+        self._call('get_account')
+        with self._lock:
+            return {'balances': [{'asset': asset, 'free': f'{free:.8f}', 'locked': '0.00000000'}
+                                 for asset, free in self.balances.items()]}
+
+    def create_order(self, symbol, side, type, quantity, price=None, timeInForce=None, newClientOrderId=None,
+                     **params):
+        self._call('create_order')
+        with self._lock:
+            order_id = len(self.orders) + 1
+            order = {'symbol': symbol, 'orderId': order_id, 'clientOrderId': newClientOrderId or str(order_id),
+                     'price': str(price or 0), 'origQty': str(quantity), 'executedQty': '0',
+                     'cummulativeQuoteQty': '0',
+                     'status': Client.ORDER_STATUS_NEW, 'timeInForce': timeInForce, 'type': type, 'side': side,
+                     'time': self._open_time(symbol)}
+            self.orders[order_id] = order
+            if self._fill_ratio < 1 and self._random.random() >= self._fill_ratio:
+                order['status'] = Client.ORDER_STATUS_EXPIRED
+            elif type == Client.ORDER_TYPE_MARKET or price is None or self._fill_rule == FILL_ALWAYS:
+                self._fill(order, float(price) if price is not None else self._close(symbol))
+            elif self._reached(order):
+                self._fill(order, float(price))
+            elif timeInForce != Client.TIME_IN_FORCE_GTC:
+                order['status'] = Client.ORDER_STATUS_EXPIRED
+            return dict(order)
+
+    def get_order(self, symbol, orderId=None, origClientOrderId=None):
+        self._call('get_order')
+        with self._lock:
+            return dict(self._find(symbol, orderId, origClientOrderId))
+
+    def cancel_order(self, symbol, orderId=None, origClientOrderId=None):
+        self._call('cancel_order')
+        with self._lock:
+            order = self._find(symbol, orderId, origClientOrderId)
+            if order['status'] == Client.ORDER_STATUS_NEW:
+                order['status'] = Client.ORDER_STATUS_CANCELED
+            return dict(order)
+
+    def get_all_orders(self, symbol, orderId=None, limit=500, **params):
+        self._call('get_all_orders')
+        with self._lock:
+            orders = [dict(order) for order in self.orders.values()
+                      if order['symbol'] == symbol and (orderId is None or order['orderId'] >= orderId)]
+        return orders[:limit] if orderId is not None else orders[-limit:]
+
+    def get_my_trades(self, symbol, fromId=None, limit=500, **params):
+        self._call('get_my_trades')
+        with self._lock:
+            trades = [dict(trade) for trade in self.trades
+                      if trade['symbol'] == symbol and (fromId is None or trade['id'] >= fromId)]
+        return trades[:limit] if fromId is not None else trades[-limit:]
+
+    # HELPERS
+    def _call(self, method: str) -> None:
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        latency = self._latency.get(method, 0.0) if isinstance(self._latency, dict) else self._latency
+        if latency:
+            time.sleep(latency)
+
+    def _close(self, symbol: str) -> float:
+        return float(self._klines[symbol]['close'][self.index])
+
+    def _open_time(self, symbol: str) -> int:
+        return int(self._klines[symbol]['open_time'][self.index])
+
+    def _ticker(self, symbol: str) -> dict:
+        close = str(self._close(symbol))
+        return {'symbol': symbol, 'lastPrice': close, 'bidPrice': close, 'askPrice': close}
+
+    def _symbol_info(self, symbol: str) -> dict:
+        return {'symbol': symbol, 'filters': [{'filterType': 'PRICE_FILTER', 'tickSize': '0.00000001'}]}
+
+    def _reached(self, order: dict) -> bool:
+        close = self._close(order['symbol'])
+        price = float(order['price'])
+        return close <= price if order['side'] == Client.SIDE_BUY else close >= price
+
+    def _find(self, symbol: str, order_id, client_order_id: str) -> dict:
+        for order in self.orders.values():
+            if order['symbol'] == symbol and (str(order['orderId']) == str(order_id)
+                                              or order['clientOrderId'] == client_order_id):
+                return order
+        raise exceptions.BinanceAPIException(
+            None, 400, json.dumps({'code': ORDER_DOES_NOT_EXIST_CODE, 'msg': 'Order does not exist.'}))
+
+    def _fill(self, order: dict, price: float) -> None:
+        symbol = order['symbol']
+        quantity = float(order['origQty'])
+        order['status'] = Client.ORDER_STATUS_FILLED
+        order['executedQty'] = order['origQty']
+        order['cummulativeQuoteQty'] = str(quantity * price)
+        order['price'] = str(price)
+        self.fills.append((self._open_time(symbol), symbol, order['side'], quantity, price))
+        quote = next((quote for quote in QUOTE_ASSETS if symbol.endswith(quote)), None)
+        self.trades.append({'symbol': symbol, 'id': len(self.trades) + 1, 'orderId': order['orderId'],
+                            'price': str(price), 'qty': order['origQty'], 'quoteQty': str(quantity * price),
+                            'commission': '0', 'commissionAsset': quote or symbol,
+                            'time': self._open_time(symbol), 'isBuyer': order['side'] == Client.SIDE_BUY})
+        if quote is not None:
+            base = symbol[:-len(quote)]
+            sign = 1 if order['side'] == Client.SIDE_BUY else -1
+            self.balances[base] = self.balances.get(base, 0.0) + sign * quantity
+            self.balances[quote] = self.balances.get(quote, 0.0) - sign * quantity * price
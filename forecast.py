@@ -1,3 +1,7 @@
+from collections import deque
+
+import numpy as np
+
 from statsmodels.tsa.arima.model import ARIMA
 from pmdarima import auto_arima
 
@@ -5,20 +9,10 @@ ARIMA_MAX_P_ORDER = 4
 ARIMA_MAX_D_ORDER = 2
 ARIMA_MAX_Q_ORDER = 4
 
-
-def model_predict_arima(symbol: str, df):
-    # print(f'Starting forecasting for {symbol}')
-
-    df.set_index('Open Time', inplace=True)
-    df = list(df['Close'])
-
-    order = best_params_arima(df)
-
-    model = ARIMA(df, order=order)
-    model_fit = model.fit()
-    output = model_fit.forecast(steps=1)
-    yhat = output[0]
-    return yhat
+ARIMA_RESELECT_EVERY = 96  # updates between order selections, a day of 15m klines
+ARIMA_ERROR_WINDOW = 20  # recent one step forecast errors used to judge fit quality
+ARIMA_MAX_ERROR_RATIO = 2.0  # reselect order when recent error is this many times in-sample error
+ARIMA_TIMEOUT_S = 20  # how long a trading cycle waits for forecasts of all symbols
 
 
 def best_params_arima(df):
@@ -30,3 +24,86 @@ def best_params_arima(df):
                              error_action='ignore')
 
     return arima_model.order
+
+
+class ArimaForecaster:
+    """
+    One step ARIMA forecaster of a single symbol that keeps selected order and fitted model between ticks.
+
+    New prices are added to the fitted model with a state space filter update instead of a refit, and a
+    replaced newest price filters the window again with the same parameters. Order is selected and model
+    fitted again every `reselect_every` updates or when recent forecast errors degrade.
+    """
+
+    def __init__(self, reselect_every: int = ARIMA_RESELECT_EVERY):
+        self._reselect_every = reselect_every
+        self._order = None
+        self._results = None
+        self._forecast = None
+        # number of prices seen, compared with total of kline buffer to find new ones
+        self._total = 0
+        # newest price the model was given, a different one at its place in the window was replaced
+        self._last_price = None
+        self._updates = 0
+        self._fit_error = 0.0
+        self._errors = deque(maxlen=ARIMA_ERROR_WINDOW)
+
+    @property
+    def order(self) -> tuple:
+        return self._order
+
+    def forecast(self, prices: np.ndarray, total: int) -> float:
+        """
+        Forecast the next price.
+
+        Args:
+        prices: Window of prices ordered from oldest to newest.
+        total: Number of prices ever added to the window, including ones already dropped from it.
+
+        Returns:
+        Forecasted next price.
+        """
+        new_count = total - self._total
+        # newest price the model was last given can be replaced in the window, e.g. a candle that was
+        # still open when it was added and closed at another price
+        replaced = (self._results is not None and new_count < len(prices)
+                    and float(prices[-new_count - 1]) != self._last_price)
+        if (self._results is None or new_count >= len(prices) or self._updates >= self._reselect_every
+                or self._degraded()):
+            self._fit(prices)
+        elif replaced:
+            if new_count > 0:
+                self._errors.append(abs(prices[-new_count] - self._forecast))
+            # filter the corrected window again with the fitted parameters, no refit
+            self._results = self._results.apply(np.asarray(prices, dtype=float))
+            self._updates += 1
+        elif new_count > 0:
+            new_prices = np.asarray(prices[-new_count:], dtype=float)
+            self._errors.append(abs(new_prices[0] - self._forecast))
+            self._results = self._results.extend(new_prices)
+            self._updates += 1
+        self._total = total
+        self._last_price = float(prices[-1])
+        self._forecast = float(self._results.forecast(steps=1)[0])
+        return self._forecast
+
+    def _fit(self, prices: np.ndarray) -> None:
+        prices = list(prices)
+        self._order = best_params_arima(prices)
+        self._results = ARIMA(prices, order=self._order).fit()
+        # first residuals of differenced model are not meaningful
+        self._fit_error = float(np.mean(np.abs(self._results.resid[self._order[1]:])))
+        self._errors.clear()
+        self._updates = 0
+
+    def _degraded(self) -> bool:
+        return (len(self._errors) == self._errors.maxlen
+                and np.mean(self._errors) > self._fit_error * ARIMA_MAX_ERROR_RATIO)
+
+
+def forecast_task(forecaster: ArimaForecaster, prices: np.ndarray, total: int) -> tuple:
+    """
+    Update forecaster in a worker process and send it back together with its forecast.
+    """
+    forecast = forecaster.forecast(prices, total)
+    return forecaster, forecast
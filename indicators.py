@@ -0,0 +1,217 @@
+import numpy as np
+
+# Running sums are rebuilt from the buffer every this many window lengths to stop float drift
+RESYNC_WINDOWS = 1000
+
+
+class RollingSma:
+    """
+    Long and short simple moving averages over the newest prices.
+
+    Prices are kept in a preallocated ring buffer of long term size and both averages are
+    maintained with running sums, so pushing a new price costs the same for any window length.
+    """
+
+    def __init__(self, long_term: int, short_term: int):
+        if short_term > long_term:
+            raise ValueError("Short term should not be higher than long term!")
+        self._long_term = long_term
+        self._short_term = short_term
+        self._prices = np.zeros(long_term, dtype=np.float64)
+        # index where the next price is written, oldest price when buffer is full
+        self._head = 0
+        self._count = 0
+        self._long_sum = 0.0
+        self._short_sum = 0.0
+        self._pushes_until_resync = long_term * RESYNC_WINDOWS
+
+    @property
+    def ready(self) -> bool:
+        return self._count == self._long_term
+
+    @property
+    def long_sma(self) -> float:
+        return self._long_sum / self._count
+
+    @property
+    def short_sma(self) -> float:
+        return self._short_sum / min(self._count, self._short_term)
+
+    def push(self, price: float) -> None:
+        price = float(price)
+        if self._count >= self._short_term:
+            # price falling out of the short window
+            self._short_sum -= self._prices[(self._head - self._short_term) % self._long_term]
+        if self._count == self._long_term:
+            self._long_sum -= self._prices[self._head]
+        else:
+            self._count += 1
+        self._prices[self._head] = price
+        self._long_sum += price
+        self._short_sum += price
+        self._head = (self._head + 1) % self._long_term
+
+        self._pushes_until_resync -= 1
+        if self._pushes_until_resync == 0:
+            self._resync()
+
+    def replace_newest(self, price: float) -> None:
+        """
+        Overwrite the newest price, e.g. when a candle that was still open gets its final close price.
+        """
+        price = float(price)
+        newest = (self._head - 1) % self._long_term
+        delta = price - self._prices[newest]
+        self._prices[newest] = price
+        self._long_sum += delta
+        self._short_sum += delta
+
+    def prices(self) -> np.ndarray:
+        """
+        Return a copy of buffered prices ordered from oldest to newest.
+        """
+        if self._count < self._long_term:
+            return self._prices[:self._count].copy()
+        return np.roll(self._prices, -self._head)
+
+    def _resync(self) -> None:
+        prices = self.prices()
+        self._long_sum = float(prices.sum())
+        self._short_sum = float(prices[-self._short_term:].sum())
+        self._pushes_until_resync = self._long_term * RESYNC_WINDOWS
+
+
+class RollingStats:
+    """
+    Mean and sample standard deviation of the newest `window` values, kept with running sums.
+    """
+
+    def __init__(self, window: int):
+        self._window = window
+        self._values = np.zeros(window, dtype=np.float64)
+        self._head = 0
+        self._count = 0
+        self._sum = 0.0
+        self._sum_of_squares = 0.0
+        self._pushes_until_resync = window * RESYNC_WINDOWS
+
+    @property
+    def mean(self) -> float:
+        return self._sum / self._count
+
+    @property
+    def std(self) -> float:
+        if self._count < 2:
+            return 0.0
+        variance = (self._sum_of_squares - self._sum * self._sum / self._count) / (self._count - 1)
+        return float(np.sqrt(max(variance, 0.0)))
+
+    def push(self, value: float) -> None:
+        value = float(value)
+        if self._count == self._window:
+            oldest = self._values[self._head]
+            self._sum -= oldest
+            self._sum_of_squares -= oldest * oldest
+        else:
+            self._count += 1
+        self._values[self._head] = value
+        self._sum += value
+        self._sum_of_squares += value * value
+        self._head = (self._head + 1) % self._window
+
+        self._pushes_until_resync -= 1
+        if self._pushes_until_resync == 0:
+            values = self._values if self._count == self._window else self._values[:self._count]
+            self._sum = float(values.sum())
+            self._sum_of_squares = float(np.dot(values, values))
+            self._pushes_until_resync = self._window * RESYNC_WINDOWS
+
+    def replace_newest(self, value: float) -> None:
+        value = float(value)
+        newest = (self._head - 1) % self._window
+        old = self._values[newest]
+        self._values[newest] = value
+        self._sum += value - old
+        self._sum_of_squares += value * value - old * old
+
+
+class EwmStats:
+    """
+    Exponentially weighted mean and standard deviation with the same span meaning as pandas ewm.
+    """
+
+    def __init__(self, span: int):
+        self._alpha = 2 / (span + 1)
+        self._mean = None
+        self._variance = 0.0
+        # state before the newest value, so it can be replaced
+        self._previous = (None, 0.0)
+
+    @property
+    def mean(self) -> float:
+        return self._mean
+
+    @property
+    def std(self) -> float:
+        return float(np.sqrt(self._variance))
+
+    def push(self, value: float) -> None:
+        self._previous = (self._mean, self._variance)
+        if self._mean is None:
+            self._mean = float(value)
+            return
+        difference = value - self._mean
+        increment = self._alpha * difference
+        self._mean += increment
+        self._variance = (1 - self._alpha) * (self._variance + difference * increment)
+
+    def replace_newest(self, value: float) -> None:
+        self._mean, self._variance = self._previous
+        self.push(value)
+
+
+class PairSpread:
+    """
+    Spread of returns of two assets aligned on open time, with streaming mean and std of spreads.
+
+    Only candles that both assets have closed are used. Updating the newest candle again replaces its
+    spread instead of adding a new one.
+    """
+
+    def __init__(self, stats):
+        self._stats = stats
+        self._distance = None
+        # (open time, close of asset1, close of asset2) of the newest and the candle before it
+        self._newest = None
+        self._previous = None
+
+    @property
+    def open_time(self) -> int:
+        return self._newest[0] if self._newest else None
+
+    @property
+    def distance(self) -> float:
+        return self._distance
+
+    @property
+    def mean(self) -> float:
+        return self._stats.mean
+
+    @property
+    def std(self) -> float:
+        return self._stats.std
+
+    def update(self, open_time: int, close1: float, close2: float) -> None:
+        if self._newest and open_time < self._newest[0]:
+            return
+        same_candle = self._newest is not None and open_time == self._newest[0]
+        if not same_candle:
+            self._previous = self._newest
+        self._newest = (open_time, close1, close2)
+        if self._previous is None:
+            return
+        self._distance = (close1 - self._previous[1]) - (close2 - self._previous[2])
+        if same_candle:
+            self._stats.replace_newest(self._distance)
+        else:
+            self._stats.push(self._distance)
@@ -0,0 +1,123 @@
+import os
+import time
+
+import numpy as np
+
+from binance.helpers import interval_to_milliseconds
+
+from klines import KLINE_DTYPE, klines_to_array
+
+KLINE_CACHE_DIR = 'kline_cache'
+KLINE_CACHE_MAX_KLINES = 1000000  # per symbol, ~16 MB
+MONTH_MS = 31 * 24 * 60 * 60 * 1000  # upper bound used for 1M interval
+
+
+class KlineCache:
+    """
+    On-disk cache of kline open times and close prices keyed by symbol and interval.
+
+    Each symbol is a file of contiguous KLINE_DTYPE records ordered by open time, so it can be
+    memory-mapped read-only by other robot processes. Only klines missing from the cache are
+    requested from exchange. One process should own writing a given symbol and interval.
+    """
+
+    def __init__(self, client, interval: str, cache_dir: str = KLINE_CACHE_DIR):
+        self._client = client
+        self._interval = interval
+        self._interval_ms = interval_to_milliseconds(interval) or MONTH_MS
+        self._cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def load(self, symbol: str) -> np.ndarray:
+        """
+        Return cached klines of symbol as a read-only memory map, empty array if nothing is cached.
+        """
+        path = self._path(symbol)
+        count = os.path.getsize(path) // KLINE_DTYPE.itemsize if os.path.exists(path) else 0
+        if not count:
+            return np.empty(0, dtype=KLINE_DTYPE)
+        return np.memmap(path, dtype=KLINE_DTYPE, mode='r', shape=(count,))
+
+    def latest(self, symbol: str, limit: int) -> np.ndarray:
+        """
+        Return the newest `limit` klines of symbol, requesting from exchange only klines after the cached ones.
+        If cache is too old to be continued within `limit` klines, it is started again from fresh klines.
+        """
+        cached = self.load(symbol)
+        now_ms = int(time.time() * 1000)
+        if len(cached) >= limit and cached['open_time'][-1] >= now_ms - limit * self._interval_ms:
+            # last cached kline is requested again, it could have been still open when saved
+            fresh = self._client.get_historical_klines(symbol, self._interval,
+                                                       start_str=str(int(cached['open_time'][-1])))
+            klines = self._merge(cached, klines_to_array(fresh))
+        else:
+            fresh = self._client.get_historical_klines(symbol, self._interval, limit=limit)
+            klines = klines_to_array(fresh)
+        self._save(symbol, klines)
+        return np.array(klines[-limit:])
+
+    def range(self, symbol: str, start_ms: int, end_ms: int) -> np.ndarray:
+        """
+        Return klines of symbol opened between start and end, requesting only parts not in cache.
+        """
+        klines = self.load(symbol)
+        if not len(klines):
+            fresh = self._client.get_historical_klines(symbol, self._interval, start_str=str(start_ms),
+                                                       end_str=str(end_ms))
+            klines = klines_to_array(fresh)
+        else:
+            first = int(klines['open_time'][0])
+            last = int(klines['open_time'][-1])
+            if start_ms < first:
+                head = self._client.get_historical_klines(symbol, self._interval, start_str=str(start_ms),
+                                                          end_str=str(first - 1))
+                klines = self._merge(klines, klines_to_array(head))
+            if end_ms > last:
+                tail = self._client.get_historical_klines(symbol, self._interval, start_str=str(last),
+                                                          end_str=str(end_ms))
+                klines = self._merge(klines, klines_to_array(tail))
+        if len(klines):
+            self._save(symbol, klines)
+        in_range = (klines['open_time'] >= start_ms) & (klines['open_time'] <= end_ms)
+        return np.array(klines[in_range])
+
+    def append(self, symbol: str, klines: list) -> None:
+        """
+        Add newest klines to the end of cache file in place. Kline with the same open time as the last
+        cached one overwrites it. Klines that would leave a gap are not written, next `latest` call fills it.
+        """
+        path = self._path(symbol)
+        if not os.path.exists(path):
+            return
+        fresh = klines_to_array(klines)
+        record_size = KLINE_DTYPE.itemsize
+        with open(path, 'r+b') as cache_file:
+            size = cache_file.seek(0, os.SEEK_END)
+            if size < record_size:
+                return
+            cache_file.seek(size - record_size)
+            last = int(np.frombuffer(cache_file.read(record_size), dtype=KLINE_DTYPE)['open_time'][0])
+            fresh = fresh[fresh['open_time'] >= last]
+            if not len(fresh) or fresh['open_time'][0] > last + self._interval_ms:
+                return
+            cache_file.seek(size - record_size if fresh['open_time'][0] == last else size)
+            cache_file.write(fresh.tobytes())
+
+    def _merge(self, cached: np.ndarray, fresh: np.ndarray) -> np.ndarray:
+        # fresh klines replace cached ones with the same open time
+        if not len(fresh):
+            return cached
+        older = cached[cached['open_time'] < fresh['open_time'][0]]
+        newer = cached[cached['open_time'] > fresh['open_time'][-1]]
+        return np.concatenate([older, fresh, newer])[-KLINE_CACHE_MAX_KLINES:]
+
+    def _save(self, symbol: str, klines: np.ndarray) -> None:
+        # written to a temporary file and renamed, so readers never see a partly written cache
+        path = self._path(symbol)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as cache_file:
+            cache_file.write(np.ascontiguousarray(klines).tobytes())
+        os.replace(temp_path, path)
+
+    def _path(self, symbol: str) -> str:
+        return os.path.join(self._cache_dir, f"{symbol}_{self._interval}.bin")
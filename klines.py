@@ -0,0 +1,179 @@
+from datetime import datetime, timezone
+
+import numpy as np
+
+from binance.helpers import interval_to_milliseconds
+
+OPEN_TIME_INDEX = 0
+CLOSE_PRICE_INDEX = 4
+CLOSE_TIME_INDEX = 6
+WEEK_OFFSET_MS = 4 * 24 * 60 * 60 * 1000  # weekly klines open on Monday, epoch was Thursday
+
+# record layout shared by kline buffer consumers and the on-disk kline cache
+KLINE_DTYPE = np.dtype([('open_time', np.int64), ('close', np.float64)])
+
+
+def klines_to_array(klines: list) -> np.ndarray:
+    """
+    Convert klines in REST list layout to an array of open time and close price records.
+    """
+    array = np.empty(len(klines), dtype=KLINE_DTYPE)
+    array['open_time'] = [kline[OPEN_TIME_INDEX] for kline in klines]
+    array['close'] = [float(kline[CLOSE_PRICE_INDEX]) for kline in klines]
+    return array
+
+
+def next_candle_open(time_ms: int, interval: str) -> int:
+    """
+    Open time of the first candle of interval opening after time_ms, which is close of the current one.
+    """
+    if interval == '1M':
+        now = datetime.fromtimestamp(time_ms / 1000, tz=timezone.utc)
+        year, month = (now.year + 1, 1) if now.month == 12 else (now.year, now.month + 1)
+        return int(datetime(year, month, 1, tzinfo=timezone.utc).timestamp()) * 1000
+    interval_ms = interval_to_milliseconds(interval)
+    offset = WEEK_OFFSET_MS if interval.endswith('w') else 0
+    return ((time_ms - offset) // interval_ms + 1) * interval_ms + offset
+
+
+def interval_ratio(base_interval: str, interval: str) -> int:
+    """
+    How many base interval candles make one candle of interval.
+    """
+    base_ms = interval_to_milliseconds(base_interval)
+    interval_ms = interval_to_milliseconds(interval)
+    if not base_ms or not interval_ms or interval_ms % base_ms:
+        raise ValueError(f"{interval} candles can not be built from {base_interval} candles")
+    return interval_ms // base_ms
+
+
+class KlineResampler:
+    """
+    Builds closed candles of a higher interval from klines of a base interval, one kline at a time.
+
+    Only close prices are tracked, and the close of a higher candle is the close of its last base kline,
+    so the higher candle is complete as soon as that kline arrives and no base klines are stored.
+    """
+
+    def __init__(self, base_interval: str, interval: str):
+        interval_ratio(base_interval, interval)
+        self._base_ms = interval_to_milliseconds(base_interval)
+        self._interval = interval
+        self._interval_ms = interval_to_milliseconds(interval)
+        self._open_time = None  # newest base kline
+        self._end = None  # open time of the higher candle after the current one
+        self._close = None
+        self._closed = False  # current higher candle was already returned
+
+    def push(self, open_time: int, close: float) -> list:
+        """
+        Add a base kline newer than the previous one, or with the same open time to replace it.
+
+        Returns:
+        (open time, close, replace) of every higher candle closed by the kline, replace is True when
+        close of an already returned candle changed.
+        """
+        candles = []
+        if open_time == self._open_time:
+            self._close = close
+            if self._closed:
+                candles.append((self._end - self._interval_ms, close, True))
+            return candles
+        end = next_candle_open(open_time, self._interval)
+        if end != self._end:
+            if self._end is not None and not self._closed:
+                # last base kline of previous candle was missing, it closes with the newest one it got
+                candles.append((self._end - self._interval_ms, self._close, False))
+            self._end = end
+            self._closed = False
+        self._open_time = open_time
+        self._close = close
+        if open_time + self._base_ms >= end:
+            self._closed = True
+            candles.append((end - self._interval_ms, close, False))
+        return candles
+
+
+class KlineBuffer:
+    """
+    Fixed capacity columnar store of kline open times and close prices.
+
+    Every value is written twice, at its slot and at slot + capacity, so the newest `capacity`
+    values are always one contiguous slice. Adding a candle is an in-place write and reading the
+    window returns NumPy views without copying. Views are only valid until the next write.
+    """
+
+    def __init__(self, capacity: int):
+        self._capacity = capacity
+        # open times are kept as milliseconds like exchange returns them
+        self._open_time = np.zeros(2 * capacity, dtype=np.int64)
+        self._close = np.zeros(2 * capacity, dtype=np.float64)
+        # slot of the oldest value
+        self._start = 0
+        self._count = 0
+        # number of klines ever appended, lets consumers tell how many are new since they last looked
+        self._total = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    @property
+    def total(self) -> int:
+        return self._total
+
+    @property
+    def open_time(self) -> np.ndarray:
+        return self._open_time[self._start:self._start + self._count]
+
+    @property
+    def close(self) -> np.ndarray:
+        return self._close[self._start:self._start + self._count]
+
+    @property
+    def last_open_time(self) -> int:
+        return int(self._open_time[self._start + self._count - 1]) if self._count else None
+
+    def append(self, open_time: int, close: float) -> None:
+        if self._count < self._capacity:
+            slot = self._count
+            self._count += 1
+        else:
+            # overwrite the oldest value and move window by one
+            slot = self._start
+            self._start = (self._start + 1) % self._capacity
+        self._open_time[slot] = self._open_time[slot + self._capacity] = open_time
+        self._close[slot] = self._close[slot + self._capacity] = close
+        self._total += 1
+
+    def replace_last(self, close: float) -> None:
+        slot = (self._start + self._count - 1) % self._capacity
+        self._close[slot] = self._close[slot + self._capacity] = close
+
+    def extend(self, klines: list) -> None:
+        """
+        Append klines in REST list layout, reading only open time and close price.
+        """
+        if len(klines) < self._capacity:
+            for kline in klines:
+                self.append(kline[OPEN_TIME_INDEX], float(kline[CLOSE_PRICE_INDEX]))
+            return
+        self.extend_array(klines_to_array(klines[-self._capacity:]))
+
+    def extend_array(self, klines: np.ndarray) -> None:
+        """
+        Append klines given as KLINE_DTYPE records.
+        """
+        if len(klines) < self._capacity:
+            for open_time, close in zip(klines['open_time'].tolist(), klines['close'].tolist()):
+                self.append(open_time, close)
+            return
+        self._total += len(klines)
+        klines = klines[-self._capacity:]
+        self._open_time[:self._capacity] = self._open_time[self._capacity:] = klines['open_time']
+        self._close[:self._capacity] = self._close[self._capacity:] = klines['close']
+        self._start = 0
+        self._count = self._capacity
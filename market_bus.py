@@ -0,0 +1,388 @@
+import json
+import signal
+import sys
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from klines import KLINE_DTYPE, KlineBuffer, klines_to_array, next_candle_open
+
+MARKET_BUS_NAME = 'robot_bus'
+MARKET_BUS_CAPACITY = 1000  # klines per symbol, at least the longest warm-up of robots reading the bus
+MARKET_BUS_POLL_S = 0.05  # how often readers look for new klines
+MARKET_BUS_ATTACH_TIMEOUT_S = 120  # reader waits this long for feeder to publish enough klines
+MARKET_BUS_CLOSE_DELAY_S = 1  # feeder waits this long after candle close for exchange to publish it
+MARKET_BUS_FETCH_MAX_WORKERS = 8
+MARKET_BUS_READ_TIMEOUT_S = 1  # a write taking longer than this was left unfinished by a killed feeder
+
+# int64 header slots in front of the kline arrays
+SEQ_SLOT, START_SLOT, COUNT_SLOT, TOTAL_SLOT, CAPACITY_SLOT = range(5)
+HEADER_SLOTS = 8
+
+
+def segment_name(bus: str, interval: str, symbol: str) -> str:
+    return f"{bus}_{interval}_{symbol}"
+
+
+def segment_size(capacity: int) -> int:
+    # header, then open times and close prices, both written twice like in KlineBuffer
+    return (HEADER_SLOTS + 4 * capacity) * 8
+
+
+def bus_kline(open_time: int, close: float) -> list:
+    """
+    Kline in REST list layout with only the fields robot reads.
+    """
+    return [open_time, close, close, close, close]
+
+
+def _header_slot(slot: int) -> property:
+    return property(lambda self: int(self._header[slot]),
+                    lambda self, value: self._header.__setitem__(slot, value))
+
+
+class SharedKlineBuffer(KlineBuffer):
+    """
+    KlineBuffer whose arrays and window state live in a shared memory segment.
+
+    One feeder writes, any number of processes read. Writes are wrapped in a sequence counter that is odd
+    while a write is in progress (seqlock): a reader notes the counter, reads views of the window without
+    copying and accepts the result only if the counter is even and did not change meanwhile.
+    """
+
+    _start = _header_slot(START_SLOT)
+    _count = _header_slot(COUNT_SLOT)
+    _total = _header_slot(TOTAL_SLOT)
+    seq = _header_slot(SEQ_SLOT)
+
+    def __init__(self, buffer, capacity: int):
+        self._capacity = capacity
+        self._header = np.frombuffer(buffer, dtype=np.int64, count=HEADER_SLOTS)
+        self._open_time = np.frombuffer(buffer, dtype=np.int64, count=2 * capacity, offset=HEADER_SLOTS * 8)
+        self._close = np.frombuffer(buffer, dtype=np.float64, count=2 * capacity,
+                                    offset=(HEADER_SLOTS + 2 * capacity) * 8)
+
+    def publish(self, klines: np.ndarray) -> int:
+        """
+        Write KLINE_DTYPE klines newer than or equal to the newest one, kline with the same open time
+        replaces it. Returns number of klines written.
+        """
+        last = self.last_open_time
+        if last is not None:
+            klines = klines[klines['open_time'] >= last]
+        if not len(klines):
+            return 0
+        self.seq += 1
+        try:
+            if last is not None and int(klines['open_time'][0]) == last:
+                self.replace_last(float(klines['close'][0]))
+                klines = klines[1:]
+            self.extend_array(klines)
+        finally:
+            self.seq += 1
+        return len(klines)
+
+    def read(self, reader: Callable[[np.ndarray, np.ndarray], object]):
+        """
+        Call reader with views of window open times and close prices until no write overlapped it and
+        return its result. Views must not be kept after reader returns. Raises TimeoutError when no
+        consistent read is possible within MARKET_BUS_READ_TIMEOUT_S.
+        """
+        deadline = None
+        while True:
+            seq = self.seq
+            if not seq & 1:
+                result = reader(self.open_time, self.close)
+                if self.seq == seq:
+                    return result
+            if deadline is None:
+                deadline = time.monotonic() + MARKET_BUS_READ_TIMEOUT_S
+            elif time.monotonic() > deadline:
+                raise TimeoutError(f"market bus write is not finishing (sequence {seq}), feeder may have died "
+                                   f"while publishing")
+            time.sleep(0)
+
+    def latest(self, limit: int) -> np.ndarray:
+        def copy(open_time: np.ndarray, close: np.ndarray) -> np.ndarray:
+            count = min(limit, len(open_time))
+            klines = np.empty(count, dtype=KLINE_DTYPE)
+            klines['open_time'] = open_time[len(open_time) - count:]
+            klines['close'] = close[len(close) - count:]
+            return klines
+        return self.read(copy)
+
+    def since(self, open_time_ms: int) -> np.ndarray:
+        """
+        Klines opened after open_time_ms, all kept ones if it is None.
+        """
+        def copy(open_time: np.ndarray, close: np.ndarray) -> np.ndarray:
+            first = np.searchsorted(open_time, open_time_ms, side='right') if open_time_ms is not None else 0
+            klines = np.empty(len(open_time) - first, dtype=KLINE_DTYPE)
+            klines['open_time'] = open_time[first:]
+            klines['close'] = close[first:]
+            return klines
+        return self.read(copy)
+
+
+def open_segment(name: str, create: bool = False, size: int = 0) -> shared_memory.SharedMemory:
+    """
+    Open a segment without leaving it to resource tracker, which would unlink it when the first process
+    using it exits. Feeder unlinks its segments on stop, and a crashed feeder reuses them on restart.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name, create, size, track=False)
+    segment = shared_memory.SharedMemory(name, create, size)
+    resource_tracker.unregister(segment._name, 'shared_memory')
+    return segment
+
+
+def unlink_segment(segment: shared_memory.SharedMemory) -> None:
+    segment.close()
+    if sys.version_info < (3, 13):
+        # unlink unregisters the segment, it is registered again so tracker bookkeeping stays balanced
+        resource_tracker.register(segment._name, 'shared_memory')
+    segment.unlink()
+
+
+def create_segment(name: str, capacity: int) -> tuple:
+    """
+    Create or reuse the segment of a feeder, e.g. after feeder restart, so attached readers keep it.
+    Returns (segment, buffer).
+    """
+    try:
+        segment = open_segment(name, create=True, size=segment_size(capacity))
+    except FileExistsError:
+        segment = open_segment(name)
+        if segment.size < segment_size(capacity):
+            unlink_segment(segment)
+            segment = open_segment(name, create=True, size=segment_size(capacity))
+    buffer = SharedKlineBuffer(segment.buf, capacity)
+    if buffer._header[CAPACITY_SLOT] != capacity:
+        buffer._header[:] = 0
+        buffer._header[CAPACITY_SLOT] = capacity
+    elif buffer.seq & 1:
+        # previous feeder was killed while publishing, window may be torn; empty it until backfill and
+        # make the sequence even again, changed so that readers retry
+        buffer._start = buffer._count = buffer._total = 0
+        buffer.seq += 1
+    return segment, buffer
+
+
+def attach_segment(name: str, timeout: float) -> tuple:
+    """
+    Map a feeder segment read-only, waiting for feeder to create it. Returns (segment, buffer).
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            segment = open_segment(name)
+            capacity = int(np.frombuffer(segment.buf, dtype=np.int64, count=HEADER_SLOTS)[CAPACITY_SLOT])
+            if capacity:
+                return segment, SharedKlineBuffer(segment.buf.toreadonly(), capacity)
+            segment.close()
+        except FileNotFoundError:
+            pass
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"market bus segment {name} is not published")
+        time.sleep(MARKET_BUS_POLL_S)
+
+
+class MarketBusReader:
+    """
+    Read-only klines of symbols published by a feeder process on this host.
+    """
+
+    def __init__(self, symbols: List[str], interval: str, bus: str = MARKET_BUS_NAME,
+                 timeout: float = MARKET_BUS_ATTACH_TIMEOUT_S):
+        self._segments = {}
+        self.buffers = {}
+        for symbol in symbols:
+            self._segments[symbol], self.buffers[symbol] = attach_segment(segment_name(bus, interval, symbol), timeout)
+
+    def wait_for(self, limit: int, timeout: float = MARKET_BUS_ATTACH_TIMEOUT_S) -> None:
+        """
+        Wait until every symbol has at least limit klines, feeder backfills them on start.
+        """
+        deadline = time.monotonic() + timeout
+        for symbol, buffer in self.buffers.items():
+            if limit > buffer.capacity:
+                raise ValueError(f"market bus keeps {buffer.capacity} klines of {symbol}, {limit} are needed")
+            while len(buffer) < limit:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"market bus has only {len(buffer)} klines of {symbol}")
+                time.sleep(MARKET_BUS_POLL_S)
+
+    def latest(self, symbol: str, limit: int) -> np.ndarray:
+        return self.buffers[symbol].latest(limit)
+
+    def since(self, symbol: str, open_time_ms: int) -> np.ndarray:
+        return self.buffers[symbol].since(open_time_ms)
+
+    def close(self) -> None:
+        self.buffers = {}
+        for segment in self._segments.values():
+            try:
+                segment.close()
+            except BufferError:
+                # views are still referenced somewhere, mapping goes away with the process
+                pass
+        self._segments = {}
+
+
+class MarketBusStream:
+    """
+    Hands klines published on the bus to on_kline(symbol, kline) from a polling thread, like MarketStream
+    does for websocket klines. Only klines opened after open_times (newest kline of every symbol the
+    consumer already has) are passed.
+    """
+
+    def __init__(self, reader: MarketBusReader, on_kline: Callable[[str, list], None], open_times: Dict[str, int]):
+        self._reader = reader
+        self._on_kline = on_kline
+        self._open_times = dict(open_times)
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._poll, name='market-bus', daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self._thread.join()
+
+    def _poll(self) -> None:
+        while not self._stop_event.wait(MARKET_BUS_POLL_S):
+            for symbol, buffer in self._reader.buffers.items():
+                # header is read without seqlock, a torn value only costs one consistent read
+                if buffer.last_open_time == self._open_times[symbol]:
+                    continue
+                try:
+                    klines = buffer.since(self._open_times[symbol])
+                except TimeoutError as e:
+                    # restarted feeder repairs the segment, polling goes on meanwhile
+                    print(f"Failed to read bus klines of {symbol}: {e}")
+                    continue
+                for open_time, close in zip(klines['open_time'].tolist(), klines['close'].tolist()):
+                    try:
+                        self._on_kline(symbol, bus_kline(open_time, close))
+                    except Exception as e:
+                        print(f"Failed to handle bus kline of {symbol}: {e}")
+                    self._open_times[symbol] = open_time
+
+
+class MarketFeeder:
+    """
+    Owns the exchange connection for klines of one interval on this host and publishes closed klines of
+    symbols into shared memory ring buffers read by any number of robot processes. Weight of kline
+    requests and memory of kline history grow with symbols, not with robots.
+
+    History is backfilled through kline cache on start, then every closed candle is fetched right after
+    it closes, or taken from websocket stream when stream is on.
+    """
+
+    def __init__(self, client, symbols: List[str], interval: str, bus: str = MARKET_BUS_NAME,
+                 capacity: int = MARKET_BUS_CAPACITY, stream: bool = False, stream_url: str = None,
+                 disk_cache: bool = True):
+        self._client = client
+        self._symbols = list(symbols)
+        self._interval = interval
+        self._capacity = capacity
+        self._stream = stream
+        self._stream_url = stream_url
+        self._kline_cache = None
+        if disk_cache:
+            from kline_cache import KlineCache
+            self._kline_cache = KlineCache(client, interval)
+        self._segments = {}
+        self._buffers = {}
+        for symbol in self._symbols:
+            self._segments[symbol], self._buffers[symbol] = create_segment(segment_name(bus, interval, symbol),
+                                                                           capacity)
+        self._fetch_executor = ThreadPoolExecutor(max_workers=min(MARKET_BUS_FETCH_MAX_WORKERS, len(self._symbols)),
+                                                  thread_name_prefix='feeder')
+
+    def run(self, stop_event: threading.Event) -> None:
+        """
+        Publish klines until stop_event is set, segments are removed afterwards.
+        """
+        try:
+            self.backfill()
+            if self._stream:
+                from market_stream import MarketStream
+                # candles closed while websocket was down are fetched again, bus skips published ones
+                market_stream = MarketStream(self._symbols, self._interval, self._on_stream_kline,
+                                             lambda *args: None, self._stream_url, on_reconnect=self.backfill)
+                market_stream.start()
+                stop_event.wait()
+                market_stream.stop()
+            else:
+                while not stop_event.wait(self._seconds_to_candle_close()):
+                    self.publish_closed(2)
+        finally:
+            self.close()
+
+    def backfill(self) -> None:
+        self.publish_closed(self._capacity)
+
+    def publish_closed(self, limit: int) -> None:
+        """
+        Fetch the newest limit klines of every symbol concurrently and publish the closed ones.
+        """
+        now_ms = int(time.time() * 1000)
+        futures = {symbol: self._fetch_executor.submit(self._fetch, symbol, limit) for symbol in self._symbols}
+        for symbol, future in futures.items():
+            try:
+                klines = future.result()
+            except Exception as e:
+                print(f"Failed to fetch {symbol} klines: {e}")
+                continue
+            if len(klines) and next_candle_open(int(klines['open_time'][-1]), self._interval) > now_ms:
+                klines = klines[:-1]
+            self._buffers[symbol].publish(klines)
+
+    def close(self) -> None:
+        self._fetch_executor.shutdown(wait=False)
+        self._buffers = {}
+        for segment in self._segments.values():
+            unlink_segment(segment)
+        self._segments = {}
+
+    def _fetch(self, symbol: str, limit: int) -> np.ndarray:
+        if self._kline_cache and limit > 2:
+            return self._kline_cache.latest(symbol, limit)
+        return klines_to_array(self._client.get_historical_klines(symbol, self._interval, limit=limit))
+
+    def _on_stream_kline(self, symbol: str, kline: list) -> None:
+        self._buffers[symbol].publish(klines_to_array([kline]))
+
+    def _seconds_to_candle_close(self) -> float:
+        now_ms = time.time() * 1000
+        return (next_candle_open(int(now_ms), self._interval) - now_ms) / 1000 + MARKET_BUS_CLOSE_DELAY_S
+
+
+def main():
+    """
+    python market_bus.py BTCBUSD,ETHBUSD [interval]
+    Feeds klines of symbols with credentials and options of config.json until SIGINT or SIGTERM.
+    """
+    from robot import make_client, CONFIG_FILE_NAME
+    with open(CONFIG_FILE_NAME, 'r') as config_file:
+        config = json.load(config_file)
+    symbols = sys.argv[1].split(',')
+    interval = sys.argv[2] if len(sys.argv) > 2 else config['interval']
+    stop_event = threading.Event()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signal_number, lambda *args: stop_event.set())
+    feeder = MarketFeeder(make_client(config), symbols, interval, config.get('market_bus', MARKET_BUS_NAME),
+                          stream=config.get('stream', False), stream_url=config.get('stream_url'))
+    print(f"Feeding {interval} klines of {', '.join(symbols)}")
+    feeder.run(stop_event)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+import asyncio
+import json
+import queue
+import threading
+
+from typing import Callable, List, Optional
+
+import websockets
+
+from binance import BinanceSocketManager
+
+STREAM_RECV_TIMEOUT_S = 1  # how often listener checks if it should stop
+STREAM_RECONNECT_WAIT_S = 1
+STREAM_MAX_RECONNECT_WAIT_S = 60
+STREAM_RECONNECTED = object()  # queued in front of messages of a new connection
+
+
+def kline_from_message(kline: dict) -> list:
+    """
+    Convert kline stream payload to the same list layout that REST klines use.
+    """
+    return [kline['t'], kline['o'], kline['h'], kline['l'], kline['c'], kline['v'], kline['T'],
+            kline['q'], kline['n'], kline['V'], kline['Q'], kline['B']]
+
+
+class MarketStream:
+    """
+    Listens to closed kline and book ticker streams of given symbols over one combined websocket.
+
+    Network is handled on its own thread and messages are handed to callbacks on a dispatcher thread,
+    so a slow callback (e.g. placing an order) never stalls the websocket connection. After a reconnect
+    on_reconnect is called before any message of the new connection, so candles closed while
+    disconnected can be backfilled in order.
+    """
+
+    def __init__(self, symbols: List[str], interval: str,
+                 on_kline: Callable[[str, list], None],
+                 on_book_ticker: Callable[[str, float, float], None],
+                 stream_url: Optional[str] = None,
+                 on_reconnect: Optional[Callable[[], None]] = None):
+        streams = []
+        for symbol in symbols:
+            streams.append(f"{symbol.lower()}@kline_{interval}")
+            streams.append(f"{symbol.lower()}@bookTicker")
+        base_url = stream_url or BinanceSocketManager.STREAM_TESTNET_URL
+        self._url = f"{base_url.rstrip('/')}/stream?streams={'/'.join(streams)}"
+        self._on_kline = on_kline
+        self._on_book_ticker = on_book_ticker
+        self._on_reconnect = on_reconnect
+        self._messages = queue.Queue()
+        self._stop_event = threading.Event()
+        self._listener = threading.Thread(target=self._listen, name='stream-listener', daemon=True)
+        self._dispatcher = threading.Thread(target=self._dispatch, name='stream-dispatcher', daemon=True)
+
+    def start(self) -> None:
+        self._listener.start()
+        self._dispatcher.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self._messages.put(None)
+        self._listener.join()
+        self._dispatcher.join()
+
+    def _listen(self) -> None:
+        asyncio.run(self._listen_async())
+
+    async def _listen_async(self) -> None:
+        reconnect_wait = STREAM_RECONNECT_WAIT_S
+        connected = False
+        while not self._stop_event.is_set():
+            try:
+                async with websockets.connect(self._url) as socket:
+                    reconnect_wait = STREAM_RECONNECT_WAIT_S
+                    if connected:
+                        self._messages.put(STREAM_RECONNECTED)
+                    connected = True
+                    while not self._stop_event.is_set():
+                        try:
+                            message = await asyncio.wait_for(socket.recv(), STREAM_RECV_TIMEOUT_S)
+                        except asyncio.TimeoutError:
+                            continue
+                        self._messages.put(message)
+            except (OSError, websockets.exceptions.WebSocketException) as e:
+                print(f"Market stream disconnected: {e}")
+                await asyncio.sleep(reconnect_wait)
+                reconnect_wait = min(reconnect_wait * 2, STREAM_MAX_RECONNECT_WAIT_S)
+
+    def _dispatch(self) -> None:
+        while True:
+            message = self._messages.get()
+            if message is None:
+                break
+            if message is STREAM_RECONNECTED:
+                if self._on_reconnect:
+                    try:
+                        self._on_reconnect()
+                    except Exception as e:
+                        print(f"Failed to backfill after reconnect: {e}")
+                continue
+            data = json.loads(message).get('data', {})
+            try:
+                if data.get('e') == 'kline':
+                    # only closed candles are passed to strategy
+                    if data['k']['x']:
+                        self._on_kline(data['s'], kline_from_message(data['k']))
+                elif 'b' in data and 'a' in data:
+                    self._on_book_ticker(data['s'], float(data['b']), float(data['a']))
+            except Exception as e:
+                print(f"Failed to handle stream message {data}: {e}")
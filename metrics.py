@@ -0,0 +1,176 @@
+import bisect
+import collections
+import json
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# histogram bucket upper bounds in seconds
+LATENCY_BUCKETS_S = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+METRICS_TRACE_TICKS = 100  # ticks kept in memory for trace dump
+METRICS_NAME = 'robot_stage_latency_seconds'
+
+# stages robot records
+FETCH_STAGE = 'fetch'  # klines request of a symbol
+PRICE_STAGE = 'price'  # average price request of a symbol
+INDICATOR_STAGE = 'indicator'  # updating SMA, spread or ARIMA forecast
+DECISION_STAGE = 'decision'  # strategy deciding and submitting orders
+ORDER_STAGE = 'order'  # one order request round trip
+FILL_STAGE = 'fill'  # order submitted until filled, retries included
+TICK_STAGE = 'tick'  # whole strategy evaluation
+
+
+class LatencyHistogram:
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS_S):
+        self.buckets = buckets
+        # last count is for values above every bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+
+class _Timer:
+    __slots__ = ('_metrics', '_stage', '_symbol', '_start')
+
+    def __init__(self, metrics, stage: str, symbol: str):
+        self._metrics = metrics
+        self._stage = stage
+        self._symbol = symbol
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self._metrics.observe(self._stage, self._symbol, time.perf_counter() - self._start, self._start)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+NULL_TIMER = _NullTimer()
+
+
+class Metrics:
+    """
+    Latency histograms per stage and symbol, rendered in Prometheus text format, and a trace of
+    recent ticks. When disabled, timer returns a shared no-op context manager, so instrumented code
+    pays only for one attribute check and an empty with block.
+    """
+
+    def __init__(self, enabled: bool = False, trace_file: str = None):
+        self.enabled = enabled
+        self._histograms = {}
+        self._lock = threading.Lock()
+        # events of the current tick and of recent ticks
+        self._tick = None
+        self._traces = collections.deque(maxlen=METRICS_TRACE_TICKS)
+        self._trace_file = trace_file
+
+    def timer(self, stage: str, symbol: str = ''):
+        if not self.enabled:
+            return NULL_TIMER
+        return _Timer(self, stage, symbol)
+
+    def observe(self, stage: str, symbol: str, seconds: float, start: float = None) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._histograms.get((stage, symbol))
+            if histogram is None:
+                histogram = self._histograms[(stage, symbol)] = LatencyHistogram()
+            histogram.observe(seconds)
+            if self._tick is not None:
+                offset = (start if start is not None else time.perf_counter() - seconds) - self._tick['start']
+                self._tick['events'].append((stage, symbol, round(offset * 1000, 3), round(seconds * 1000, 3)))
+
+    def begin_tick(self) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._tick = {'time': time.time(), 'start': time.perf_counter(), 'events': []}
+
+    def end_tick(self) -> None:
+        if not self.enabled or self._tick is None:
+            return
+        with self._lock:
+            tick, self._tick = self._tick, None
+            trace = {'time': tick['time'], 'events': tick['events']}
+            self._traces.append(trace)
+        if self._trace_file:
+            with open(self._trace_file, 'a') as trace_file:
+                trace_file.write(json.dumps(trace) + '\n')
+
+    def traces(self) -> list:
+        """
+        Recent ticks, each with (stage, symbol, ms from tick start, duration ms) events.
+        """
+        with self._lock:
+            return list(self._traces)
+
+    def summary(self) -> dict:
+        """
+        Count and total seconds of every stage, summed over symbols.
+        """
+        stages = {}
+        with self._lock:
+            for (stage, _), histogram in self._histograms.items():
+                count, seconds = stages.get(stage, (0, 0.0))
+                stages[stage] = (count + histogram.count, seconds + histogram.sum)
+        return stages
+
+    def render(self) -> str:
+        lines = [f"# HELP {METRICS_NAME} Latency of robot stages.", f"# TYPE {METRICS_NAME} histogram"]
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            for (stage, symbol), histogram in histograms:
+                labels = f'stage="{stage}",symbol="{symbol}"'
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{METRICS_NAME}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'{METRICS_NAME}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                lines.append(f'{METRICS_NAME}_sum{{{labels}}} {histogram.sum}')
+                lines.append(f'{METRICS_NAME}_count{{{labels}}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+def serve_metrics(metrics: Metrics, port: int) -> ThreadingHTTPServer:
+    """
+    Serve /metrics (Prometheus text) and /trace (JSON) on localhost from a background thread.
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/metrics':
+                content_type, data = 'text/plain; version=0.0.4', metrics.render().encode()
+            elif self.path == '/trace':
+                content_type, data = 'application/json', json.dumps(metrics.traces()).encode()
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
@@ -0,0 +1,297 @@
+import threading
+import time
+import uuid
+
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+from binance import Client, exceptions
+from requests.exceptions import RequestException
+
+from metrics import Metrics, FILL_STAGE, ORDER_STAGE
+
+ORDER_RETRY_WAIT_TIME_S = 10  # 10 seconds
+ORDER_MAX_RETRIES = 3  # LIMIT order max retries
+ORDER_MAX_WORKERS = 8  # max orders sent at the same time
+
+ORDER_DOES_NOT_EXIST_CODE = -2013
+OPEN_ORDER_STATUSES = (Client.ORDER_STATUS_NEW, Client.ORDER_STATUS_PARTIALLY_FILLED)
+
+# pair leg that did not fill: reverse what the other leg filled
+PAIR_UNWIND = 'UNWIND'
+# pair leg that did not fill: place its rest as MARKET order
+PAIR_REHEDGE = 'REHEDGE'
+
+
+class Order:
+    """
+    One order the strategy wants filled. Each attempt is sent with its own client order id,
+    so an attempt whose response was lost can still be looked up on exchange.
+    """
+
+    def __init__(self, symbol: str, side: str, quantity: float, order_type: str, time_in_force: str, price: float,
+                 on_done=None, max_attempts: int = None):
+        self.symbol = symbol
+        self.side = side
+        self.quantity = quantity
+        self.order_type = order_type
+        self.time_in_force = time_in_force
+        self.price = price
+        self.attempts = 0
+        self.client_order_id = None
+        self.response = None
+        # quantity filled over all attempts, quantity is what is left
+        self.executed = 0.0
+        # monotonic time when fill was confirmed
+        self.filled_at = None
+        self.on_done = on_done
+        self.submitted_at = time.perf_counter()
+        # executor max_retries when None
+        self.max_attempts = max_attempts
+        # resolves to the response of the filling attempt, None if order was given up
+        self.future = Future()
+        self.id = uuid.uuid4().hex[:24]
+
+    def next_client_order_id(self) -> str:
+        self.attempts += 1
+        self.client_order_id = f"{self.id}_{self.attempts}"
+        return self.client_order_id
+
+
+class OrderExecutor:
+    """
+    Sends orders on a thread pool and tracks them until they are filled or given up, so the strategy
+    loop never waits for exchange. Attempt that is not filled is retried after retry_wait on a timer,
+    LIMIT retries are repriced with reprice(symbol) instead of the original price. Resting (GTC) order
+    still open after retry_wait is cancelled and retried the same way. on_fill(order, quantity, response)
+    is called for every attempt that executed something.
+    """
+
+    def __init__(self, client, reprice, max_workers: int = ORDER_MAX_WORKERS,
+                 retry_wait: float = ORDER_RETRY_WAIT_TIME_S, max_retries: int = ORDER_MAX_RETRIES,
+                 metrics: Metrics = None, on_fill=None):
+        self._client = client
+        self._on_fill = on_fill
+        self._metrics = metrics or Metrics()
+        self._reprice = reprice
+        self._retry_wait = retry_wait
+        self._max_retries = max_retries
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='orders')
+        self._lock = threading.Lock()
+        # unfinished orders by order id
+        self._orders = {}
+        self._timers = set()
+        self._closed = False
+
+    def submit(self, symbol: str, side: str, quantity: float, order_type: str, time_in_force: str = None,
+               price: float = None, on_done=None, max_attempts: int = None) -> Future:
+        """
+        Start placing an order and return its future right away. on_done(order) is called once order is
+        filled or given up, before order stops being pending.
+        """
+        order = Order(symbol, side, quantity, order_type, time_in_force, price, on_done, max_attempts)
+        with self._lock:
+            self._orders[order.id] = order
+        self._executor.submit(self._attempt, order)
+        return order.future
+
+    def submit_pair(self, legs: list, on_done, failure: str = PAIR_UNWIND) -> None:
+        """
+        Send every leg of a pair at the same time, legs are (symbol, side, quantity, order_type,
+        time_in_force, price) tuples. Legs are not retried: when one is not filled, exposure left by the
+        other one is closed right away with MARKET orders according to failure. on_done(hedged, skew_ms) is called at the end,
+        hedged is True only if all legs ended filled and skew_ms is time between their fill confirmations.
+        """
+        done = []
+
+        def on_leg_done(order: Order) -> None:
+            with self._lock:
+                done.append(order)
+                if len(done) < len(legs):
+                    return
+            orders = sorted(done, key=lambda leg_order: symbols.index(leg_order.symbol))
+            self._finish_pair(orders, on_done, failure)
+
+        symbols = [leg[0] for leg in legs]
+        for leg in legs:
+            self.submit(*leg, on_done=on_leg_done, max_attempts=1)
+
+    def pending(self, symbol: str) -> bool:
+        with self._lock:
+            return any(order.symbol == symbol for order in self._orders.values())
+
+    def wait(self, timeout: float = None) -> None:
+        """
+        Wait until there is no pending order, including orders submitted while waiting.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                futures = [order.future for order in self._orders.values()]
+            if not futures:
+                return
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return
+            wait(futures, timeout=remaining)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._closed = True
+            for timer in self._timers:
+                timer.cancel()
+            orders = list(self._orders.values())
+            self._orders.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        for order in orders:
+            if not order.future.done():
+                order.future.set_result(None)
+
+    def _attempt(self, order: Order) -> None:
+        try:
+            if order.attempts and order.order_type == Client.ORDER_TYPE_LIMIT:
+                order.price = self._reprice(order.symbol)
+            order.next_client_order_id()
+            print(f"Trading {order.symbol} for {order.side} and {order.price}")
+            try:
+                with self._metrics.timer(ORDER_STAGE, order.symbol):
+                    response = self._client.create_order(
+                        symbol=order.symbol,
+                        side=order.side,
+                        type=order.order_type,
+                        quantity=order.quantity,
+                        price=order.price,
+                        timeInForce=order.time_in_force,
+                        newClientOrderId=order.client_order_id,
+                    )
+            except RequestException as e:
+                # order may have been placed anyway, look it up by client order id later
+                print(f"{order.symbol} order request failed: {e}")
+                self._schedule(self._check, order)
+                return
+            self._handle(order, response)
+        except (exceptions.BinanceAPIException, exceptions.BinanceOrderException) as e:
+            print(e.message)
+            self._retry(order)
+        except Exception as e:
+            self._finish(order, None, e)
+
+    def _check(self, order: Order) -> None:
+        try:
+            try:
+                response = self._client.get_order(symbol=order.symbol, origClientOrderId=order.client_order_id)
+            except exceptions.BinanceAPIException as e:
+                if e.code != ORDER_DOES_NOT_EXIST_CODE:
+                    raise
+                self._retry(order)
+                return
+            if response['status'] in OPEN_ORDER_STATUSES:
+                self._client.cancel_order(symbol=order.symbol, origClientOrderId=order.client_order_id)
+                response = self._client.get_order(symbol=order.symbol, origClientOrderId=order.client_order_id)
+            self._handle(order, response, check=False)
+        except (exceptions.BinanceAPIException, exceptions.BinanceOrderException, RequestException) as e:
+            print(f"{order.symbol} order check failed: {e}")
+            self._retry(order)
+        except Exception as e:
+            self._finish(order, None, e)
+
+    def _handle(self, order: Order, response: dict, check: bool = True) -> None:
+        print(f"{response['side']} {response['type']} {response['symbol']} {response['status']}")
+        if response['status'] == Client.ORDER_STATUS_FILLED:
+            self._fill(order, order.quantity, response)
+            order.executed = round(order.executed + order.quantity, 8)
+            order.quantity = 0.0
+            order.filled_at = time.monotonic()
+            self._finish(order, response)
+            return
+        if check and response['status'] in OPEN_ORDER_STATUSES:
+            self._schedule(self._check, order)
+            return
+        # partly filled attempt leaves only the rest to be retried
+        executed = float(response.get('executedQty', 0))
+        if executed:
+            self._fill(order, executed, response)
+            order.executed = round(order.executed + executed, 8)
+            order.quantity = round(order.quantity - executed, 8)
+        self._retry(order)
+
+    def _fill(self, order: Order, quantity: float, response: dict) -> None:
+        if self._on_fill:
+            try:
+                self._on_fill(order, quantity, response)
+            except Exception as e:
+                print(f"{order.symbol} fill callback failed: {e}")
+
+    def _retry(self, order: Order) -> None:
+        if order.attempts < (order.max_attempts or self._max_retries):
+            self._schedule(self._attempt, order)
+        else:
+            self._finish(order, None)
+
+    def _schedule(self, task, order: Order) -> None:
+        with self._lock:
+            if self._closed:
+                return
+            timer = threading.Timer(self._retry_wait, self._run_scheduled, args=(task, order))
+            timer.daemon = True
+            self._timers.add(timer)
+        timer.start()
+
+    def _run_scheduled(self, task, order: Order) -> None:
+        with self._lock:
+            self._timers.discard(threading.current_thread())
+            if not self._closed:
+                self._executor.submit(task, order)
+
+    def _finish(self, order: Order, response: dict, error: Exception = None) -> None:
+        order.response = response
+        if response is not None:
+            self._metrics.observe(FILL_STAGE, order.symbol, time.perf_counter() - order.submitted_at)
+        if order.on_done:
+            try:
+                order.on_done(order)
+            except Exception as e:
+                print(f"{order.symbol} order callback failed: {e}")
+        with self._lock:
+            self._orders.pop(order.id, None)
+        if order.future.done():
+            return
+        if error is not None:
+            order.future.set_exception(error)
+        else:
+            order.future.set_result(response)
+
+    def _finish_pair(self, orders: list, on_done, failure: str) -> None:
+        filled = [order for order in orders if order.response is not None]
+        if len(filled) == len(orders):
+            skew_ms = (max(order.filled_at for order in orders) - min(order.filled_at for order in orders)) * 1000
+            print(f"Pair {'-'.join(order.symbol for order in orders)} filled, leg skew {skew_ms:.1f} ms")
+            on_done(True, skew_ms)
+            return
+
+        if failure == PAIR_REHEDGE and filled:
+            hedges = [(order.symbol, order.side, order.quantity) for order in orders if order.response is None]
+        else:
+            opposite = {Client.SIDE_BUY: Client.SIDE_SELL, Client.SIDE_SELL: Client.SIDE_BUY}
+            hedges = [(order.symbol, opposite[order.side], order.executed) for order in orders if order.executed]
+        if not hedges:
+            on_done(False, None)
+            return
+        print(f"Pair leg was not filled, {failure.lower()} with {hedges}")
+
+        done = []
+
+        def on_hedge_done(hedge: Order) -> None:
+            with self._lock:
+                done.append(hedge)
+                if len(done) < len(hedges):
+                    return
+            if any(hedge_order.response is None for hedge_order in done):
+                print(f"Pair {'-'.join(order.symbol for order in orders)} is left unhedged!")
+            if failure == PAIR_REHEDGE and filled and all(hedge_order.response is not None for hedge_order in done):
+                fill_times = [order.filled_at for order in filled] + [hedge_order.filled_at for hedge_order in done]
+                on_done(True, (max(fill_times) - min(fill_times)) * 1000)
+            else:
+                on_done(False, None)
+
+        for symbol, side, quantity in hedges:
+            self.submit(symbol, side, quantity, Client.ORDER_TYPE_MARKET, on_done=on_hedge_done)
@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+ORDER_LEDGER_DIR = 'order_ledger'
+ORDER_LEDGER_SYNC_TTL_S = 10  # queries within this time after a sync do not request exchange
+ORDER_LEDGER_PAGE_LIMIT = 1000  # orders or trades per request, exchange maximum
+ORDER_FINAL_STATUSES = ('FILLED', 'CANCELED', 'EXPIRED', 'REJECTED')
+MAX_TIME_MS = 2 ** 63 - 1
+
+LEDGER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    symbol TEXT NOT NULL,
+    order_id INTEGER NOT NULL,
+    time INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (symbol, order_id)
+);
+CREATE INDEX IF NOT EXISTS orders_symbol_time ON orders (symbol, time);
+CREATE TABLE IF NOT EXISTS trades (
+    symbol TEXT NOT NULL,
+    trade_id INTEGER NOT NULL,
+    order_id INTEGER NOT NULL,
+    time INTEGER NOT NULL,
+    price REAL NOT NULL,
+    qty REAL NOT NULL,
+    quote_qty REAL NOT NULL,
+    commission REAL NOT NULL,
+    commission_asset TEXT NOT NULL,
+    is_buyer INTEGER NOT NULL,
+    PRIMARY KEY (symbol, trade_id)
+);
+CREATE INDEX IF NOT EXISTS trades_symbol_time ON trades (symbol, time);
+"""
+
+
+def ledger_file_name(api_key: str, ledger_dir: str = ORDER_LEDGER_DIR) -> str:
+    """
+    Ledger file of an account, named by a hash of its API key so accounts never share history.
+    """
+    os.makedirs(ledger_dir, exist_ok=True)
+    return os.path.join(ledger_dir, f"{hashlib.sha256(api_key.encode()).hexdigest()[:16]}.db")
+
+
+def time_range(start_ms: int = None, end_ms: int = None) -> tuple:
+    return start_ms or 0, end_ms if end_ms is not None else MAX_TIME_MS
+
+
+class OrderLedger:
+    """
+    Local SQLite copy of order and trade history of an account, indexed by symbol and time.
+
+    Sync requests only what is new since the last one: orders from the oldest order that was still open
+    (orderId cursor) and trades after the newest stored one (fromId cursor). Listings, PnL and graph
+    queries are answered from the ledger. Several processes of the same account can share the file.
+    """
+
+    def __init__(self, client, file_name: str = None, ttl: float = ORDER_LEDGER_SYNC_TTL_S):
+        self._client = client
+        self._ttl = ttl
+        # None keeps ledger only in memory
+        self._connection = sqlite3.connect(file_name or ':memory:', timeout=30, check_same_thread=False)
+        self._lock = threading.Lock()
+        # monotonic time of the last sync of every symbol
+        self._synced = {}
+        with self._lock, self._connection:
+            if file_name:
+                self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.executescript(LEDGER_SCHEMA)
+
+    def sync(self, symbol: str, force: bool = False) -> None:
+        """
+        Bring orders and trades of symbol up to date, unless it was synced within ttl.
+        """
+        synced = self._synced.get(symbol)
+        if not force and synced is not None and time.monotonic() - synced < self._ttl:
+            return
+        self._sync_orders(symbol)
+        self._sync_trades(symbol)
+        self._synced[symbol] = time.monotonic()
+
+    def orders(self, symbol: str, limit: int = None, start_ms: int = None, end_ms: int = None) -> list:
+        """
+        Orders of symbol in get_all_orders layout, oldest first, the newest `limit` of them if given.
+        """
+        query = ('SELECT data FROM orders WHERE symbol = ? AND time >= ? AND time <= ? '
+                 'ORDER BY time DESC, order_id DESC')
+        params = [symbol, *time_range(start_ms, end_ms)]
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+        with self._lock:
+            rows = self._connection.execute(query, params).fetchall()
+        return [json.loads(data) for data, in reversed(rows)]
+
+    def pnl(self, symbol: str, price: float = None, start_ms: int = None, end_ms: int = None) -> dict:
+        """
+        Bought and sold quantity, quote cash flow and commissions of symbol trades. With the current
+        price, pnl is the cash flow plus the value of the net quantity.
+        """
+        params = (symbol, *time_range(start_ms, end_ms))
+        with self._lock:
+            trades, bought, sold, cash = self._connection.execute(
+                'SELECT COUNT(*), TOTAL(CASE WHEN is_buyer THEN qty END), '
+                'TOTAL(CASE WHEN is_buyer THEN 0 ELSE qty END), '
+                'TOTAL(CASE WHEN is_buyer THEN -quote_qty ELSE quote_qty END) '
+                'FROM trades WHERE symbol = ? AND time >= ? AND time <= ?',
+                params).fetchone()
+            commissions = dict(self._connection.execute(
+                'SELECT commission_asset, TOTAL(commission) FROM trades '
+                'WHERE symbol = ? AND time >= ? AND time <= ? GROUP BY commission_asset',
+                params).fetchall())
+        result = {'symbol': symbol, 'trades': trades, 'bought': bought, 'sold': sold,
+                  'position': round(bought - sold, 8), 'cash': cash, 'commissions': commissions}
+        if price is not None:
+            result['price'] = price
+            result['pnl'] = cash + (bought - sold) * price
+        return result
+
+    def _sync_orders(self, symbol: str) -> None:
+        with self._lock:
+            open_id, last_id = self._connection.execute(
+                f"SELECT MIN(CASE WHEN status NOT IN ({', '.join('?' * len(ORDER_FINAL_STATUSES))}) "
+                f"THEN order_id END), MAX(order_id) FROM orders WHERE symbol = ?",
+                (*ORDER_FINAL_STATUSES, symbol)).fetchone()
+        # open orders can still change, so they are requested again until they are final
+        cursor = open_id if open_id is not None else (last_id + 1 if last_id is not None else 0)
+        while True:
+            orders = self._client.get_all_orders(symbol=symbol, orderId=cursor, limit=ORDER_LEDGER_PAGE_LIMIT)
+            with self._lock, self._connection:
+                self._connection.executemany(
+                    'INSERT OR REPLACE INTO orders (symbol, order_id, time, status, data) VALUES (?, ?, ?, ?, ?)',
+                    [(symbol, order['orderId'], order['time'], order['status'], json.dumps(order)) for order in orders])
+            if len(orders) < ORDER_LEDGER_PAGE_LIMIT:
+                return
+            cursor = max(order['orderId'] for order in orders) + 1
+
+    def _sync_trades(self, symbol: str) -> None:
+        with self._lock:
+            last_id, = self._connection.execute('SELECT MAX(trade_id) FROM trades WHERE symbol = ?',
+                                                (symbol,)).fetchone()
+        cursor = last_id + 1 if last_id is not None else 0
+        while True:
+            trades = self._client.get_my_trades(symbol=symbol, fromId=cursor, limit=ORDER_LEDGER_PAGE_LIMIT)
+            with self._lock, self._connection:
+                self._connection.executemany(
+                    'INSERT OR REPLACE INTO trades (symbol, trade_id, order_id, time, price, qty, quote_qty, '
+                    'commission, commission_asset, is_buyer) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    [(symbol, trade['id'], trade['orderId'], trade['time'], float(trade['price']), float(trade['qty']),
+                      float(trade['quoteQty']), float(trade['commission']), trade['commissionAsset'],
+                      int(trade['isBuyer'])) for trade in trades])
+            if len(trades) < ORDER_LEDGER_PAGE_LIMIT:
+                return
+            cursor = max(trade['id'] for trade in trades) + 1
@@ -0,0 +1,208 @@
+import collections
+import threading
+
+import numpy as np
+
+PORTFOLIO_QUOTE = 'BUSD'
+# quotes an asset without a market in PORTFOLIO_QUOTE is routed through, in order of preference
+PORTFOLIO_INTERMEDIATES = ('USDT', 'BTC', 'BNB', 'ETH')
+# valued 1:1 with PORTFOLIO_QUOTE when there is no market between them
+PORTFOLIO_PEGGED_ASSETS = ('USDT',)
+PORTFOLIO_HISTORY = 10000  # marks kept in memory
+
+
+class Portfolio:
+    """
+    Account balances valued in one quote asset from a bulk price snapshot.
+
+    Every asset gets a route of at most two markets to the quote, e.g. XRP -> XRPBTC -> BTCBUSD, found
+    once when the symbols or assets change. Valuation then multiplies quantity and leg price arrays of
+    all assets at once. Prices of traded symbols and own fills can be applied between snapshots, so
+    mark appends a mark-to-market value to history every tick without any request.
+    """
+
+    def __init__(self, quote: str = PORTFOLIO_QUOTE, intermediates: tuple = PORTFOLIO_INTERMEDIATES,
+                 history: int = PORTFOLIO_HISTORY):
+        self.quote = quote
+        self._intermediates = [asset for asset in intermediates if asset != quote]
+        self._lock = threading.Lock()
+        self._symbols = {}
+        # prices of symbols in index order, then a constant 1 and a missing price
+        self._prices = np.array([1.0, np.nan])
+        self._assets = []
+        self._quantities = np.zeros(0)
+        # quantities when balances were first loaded, for comparison with current ones
+        self._start = None
+        self._legs = np.zeros((0, 2), dtype=np.int64)
+        self._inverse = np.zeros((0, 2), dtype=bool)
+        self._routes_stale = False
+        # value at the first mark, PnL stays relative to it after that mark rolls out of history
+        self._first_mark = None
+        # (time ms, value, change since the first mark) of every mark
+        self._history = collections.deque(maxlen=history)
+
+    @property
+    def loaded(self) -> bool:
+        return self._start is not None
+
+    def set_prices(self, prices: dict) -> None:
+        """
+        Replace prices with a snapshot of symbol prices, e.g. from get_all_tickers.
+        """
+        with self._lock:
+            if prices.keys() != self._symbols.keys():
+                self._symbols = {symbol: index for index, symbol in enumerate(prices)}
+                self._routes_stale = True
+            # indexes may come from an earlier snapshot or _add_symbol, so values follow them rather than dict order
+            self._prices = np.fromiter((*(prices[symbol] for symbol in self._symbols), 1.0, np.nan), dtype=np.float64,
+                                       count=len(prices) + 2)
+
+    def update_prices(self, prices: dict) -> None:
+        """
+        Overwrite prices of some symbols, e.g. latest closes of traded symbols.
+        """
+        with self._lock:
+            for symbol, price in prices.items():
+                index = self._symbols.get(symbol)
+                if index is None:
+                    self._add_symbol(symbol, price)
+                else:
+                    self._prices[index] = price
+
+    def set_balances(self, balances: list) -> None:
+        """
+        Replace quantities with account balances in get_account layout, free and locked together.
+        """
+        with self._lock:
+            self._assets = [balance['asset'] for balance in balances]
+            self._quantities = np.array([float(balance['free']) + float(balance.get('locked', 0))
+                                         for balance in balances], dtype=np.float64)
+            if self._start is None:
+                self._start = dict(zip(self._assets, self._quantities.tolist()))
+            self._routes_stale = True
+
+    def apply_fill(self, symbol: str, side: str, quantity: float, quote_quantity: float = None) -> None:
+        """
+        Move quantities of both assets of symbol by an own fill. Without quote quantity, the fill is
+        taken at the current symbol price.
+        """
+        with self._lock:
+            assets = self._split(symbol)
+            if assets is None or not quantity or not self.loaded:
+                return
+            index = self._symbols.get(symbol)
+            if quote_quantity:
+                if index is None:
+                    self._add_symbol(symbol, quote_quantity / quantity)
+                else:
+                    self._prices[index] = quote_quantity / quantity
+            elif index is not None:
+                quote_quantity = quantity * self._prices[index]
+            else:
+                return
+            sign = 1 if side == 'BUY' else -1
+            for asset, change in zip(assets, (sign * quantity, -sign * quote_quantity)):
+                if asset not in self._assets:
+                    self._assets.append(asset)
+                    self._quantities = np.append(self._quantities, 0.0)
+                    self._routes_stale = True
+                self._quantities[self._assets.index(asset)] += change
+
+    def valuation(self) -> dict:
+        """
+        Value of every asset and their total. Assets without a route to quote are listed in missing
+        and left out of total.
+        """
+        with self._lock:
+            values = self._quantities * self._rates()
+            assets = list(self._assets)
+        known = ~np.isnan(values)
+        return {'values': dict(zip(np.array(assets)[known].tolist(), values[known].tolist())),
+                'missing': np.array(assets)[~known].tolist(),
+                'total': float(values[known].sum())}
+
+    def value_of(self, amounts: dict) -> float:
+        """
+        Total value of asset amounts at current prices, assets without a route count as zero.
+        """
+        with self._lock:
+            legs, inverse = self._routes(list(amounts))
+            values = np.fromiter(amounts.values(), dtype=np.float64, count=len(amounts)) * self._rates(legs, inverse)
+        return float(np.nansum(values))
+
+    def start_value(self) -> float:
+        """
+        Value of balances from the first load at current prices, what holding them would be worth now.
+        """
+        return self.value_of(self._start) if self.loaded else 0.0
+
+    def mark(self, time_ms: int) -> tuple:
+        """
+        Append current total value to history. Does nothing until balances are loaded.
+        """
+        if not self.loaded:
+            return None
+        total = self.valuation()['total']
+        with self._lock:
+            if self._first_mark is None:
+                self._first_mark = total
+            mark = (int(time_ms), total, total - self._first_mark)
+            self._history.append(mark)
+        return mark
+
+    def history(self) -> list:
+        with self._lock:
+            return list(self._history)
+
+    def _add_symbol(self, symbol: str, price: float) -> None:
+        self._symbols[symbol] = len(self._symbols)
+        self._prices = np.insert(self._prices, len(self._symbols) - 1, price)
+        self._routes_stale = True
+
+    def _split(self, symbol: str) -> tuple:
+        for quote in (self.quote, *self._intermediates):
+            if symbol.endswith(quote) and len(symbol) > len(quote):
+                return symbol[:-len(quote)], quote
+        return None
+
+    def _rates(self, legs: np.ndarray = None, inverse: np.ndarray = None) -> np.ndarray:
+        if legs is None:
+            if self._routes_stale:
+                self._legs, self._inverse = self._routes(self._assets)
+                self._routes_stale = False
+            legs, inverse = self._legs, self._inverse
+        prices = self._prices[legs]
+        return np.where(inverse, 1 / prices, prices).prod(axis=1)
+
+    def _routes(self, assets: list) -> tuple:
+        """
+        Price indexes of both legs of every asset route and whether each price is inverted. Unused
+        legs point at the constant 1, assets without a route at the missing price.
+        """
+        one, missing = len(self._symbols), len(self._symbols) + 1
+        legs = np.full((len(assets), 2), one, dtype=np.int64)
+        inverse = np.zeros((len(assets), 2), dtype=bool)
+        for row, asset in enumerate(assets):
+            if asset == self.quote:
+                continue
+            direct = self._leg(asset, self.quote)
+            if direct is not None:
+                legs[row, 0], inverse[row, 0] = direct
+                continue
+            for intermediate in self._intermediates:
+                first = self._leg(asset, intermediate) if asset != intermediate else (one, False)
+                second = self._leg(intermediate, self.quote)
+                if first is not None and second is not None:
+                    (legs[row, 0], inverse[row, 0]), (legs[row, 1], inverse[row, 1]) = first, second
+                    break
+            else:
+                if asset not in PORTFOLIO_PEGGED_ASSETS:
+                    legs[row, 0] = missing
+        return legs, inverse
+
+    def _leg(self, base: str, quote: str) -> tuple:
+        if base + quote in self._symbols:
+            return self._symbols[base + quote], False
+        if quote + base in self._symbols:
+            return self._symbols[quote + base], True
+        return None
@@ -0,0 +1,259 @@
+import threading
+import time
+
+from concurrent.futures import Future
+
+# limits used until exchange info rate limits are known, (kind, interval) -> limit
+DEFAULT_RATE_LIMITS = {
+    ('weight', '1m'): 1200,
+    ('orders', '10s'): 50,
+    ('orders', '1d'): 160000,
+}
+USED_WEIGHT_HEADER = 'x-mbx-used-weight-'
+ORDER_COUNT_HEADER = 'x-mbx-order-count-'
+RATE_LIMIT_STATUSES = (418, 429)  # 429 too many requests, 418 IP banned after ignoring 429
+DEFAULT_RETRY_AFTER_S = 60
+
+# lower value goes first
+ORDER_PRIORITY = 0  # placing, checking and cancelling orders
+MARKET_DATA_PRIORITY = 1  # klines and prices trading decisions need
+INFO_PRIORITY = 2  # account, order history and exchange info
+# share of each weight limit a priority may use, rest is kept for higher priorities
+PRIORITY_LIMIT_SHARE = {ORDER_PRIORITY: 1.0, MARKET_DATA_PRIORITY: 0.9, INFO_PRIORITY: 0.6}
+
+INTERVAL_UNITS_S = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+RATE_LIMIT_INTERVALS = {'SECOND': 's', 'MINUTE': 'm', 'HOUR': 'h', 'DAY': 'd'}
+
+
+def interval_to_seconds(interval: str) -> int:
+    return int(interval[:-1]) * INTERVAL_UNITS_S[interval[-1].lower()]
+
+
+def kline_request_weight(limit: int = None) -> int:
+    limit = limit or 500
+    if limit <= 100:
+        return 1
+    if limit <= 500:
+        return 2
+    if limit <= 1000:
+        return 5
+    return 10
+
+
+# weight and priority of each client method robot uses, weight can depend on call keyword arguments
+CLIENT_METHODS = {
+    'create_order': (lambda **kwargs: 1, ORDER_PRIORITY),
+    'cancel_order': (lambda **kwargs: 1, ORDER_PRIORITY),
+    'get_order': (lambda **kwargs: 4, ORDER_PRIORITY),
+    'get_historical_klines': (lambda **kwargs: kline_request_weight(kwargs.get('limit')), MARKET_DATA_PRIORITY),
+    'get_klines': (lambda **kwargs: kline_request_weight(kwargs.get('limit')), MARKET_DATA_PRIORITY),
+    'get_avg_price': (lambda **kwargs: 2, MARKET_DATA_PRIORITY),
+    'get_all_tickers': (lambda **kwargs: 4, MARKET_DATA_PRIORITY),
+    'get_ticker': (lambda **kwargs: 2 if 'symbol' in kwargs else 80, INFO_PRIORITY),
+    'get_account': (lambda **kwargs: 20, INFO_PRIORITY),
+    'get_all_orders': (lambda **kwargs: 20, INFO_PRIORITY),
+    'get_my_trades': (lambda **kwargs: 20, INFO_PRIORITY),
+    'get_exchange_info': (lambda **kwargs: 20, INFO_PRIORITY),
+    'get_symbol_info': (lambda **kwargs: 20, INFO_PRIORITY),
+}
+ORDER_METHODS = {'create_order'}
+
+
+class RateLimitBucket:
+    """
+    Usage of one exchange limit in its current fixed window, e.g. request weight per minute.
+    Windows start at multiples of their length, same as exchange counters.
+    """
+
+    def __init__(self, limit: int, interval: str, now: float):
+        self.limit = limit
+        self.window = interval_to_seconds(interval)
+        self.used = 0
+        self._window_start = now - now % self.window
+
+    def refresh(self, now: float) -> None:
+        window_start = now - now % self.window
+        if window_start != self._window_start:
+            self._window_start = window_start
+            self.used = 0
+
+    def seconds_to_reset(self, now: float) -> float:
+        return max(0.0, self._window_start + self.window - now)
+
+
+class RateLimiter:
+    """
+    Client side view of exchange rate limits. Requests take weight from buckets before they are sent
+    and usage reported by X-MBX-USED-WEIGHT-* and X-MBX-ORDER-COUNT-* response headers replaces the
+    estimate. Request waits while its weight does not fit in the share of limit its priority may use,
+    or while a higher priority request is waiting. 429 and 418 responses pause all requests for
+    Retry-After seconds.
+    """
+
+    def __init__(self, limits: dict = None, clock=time.time):
+        self._clock = clock
+        now = clock()
+        self._buckets = {key: RateLimitBucket(limit, key[1], now)
+                         for key, limit in (limits or DEFAULT_RATE_LIMITS).items()}
+        self._condition = threading.Condition()
+        # waiting requests by priority
+        self._waiting = {priority: 0 for priority in PRIORITY_LIMIT_SHARE}
+        self._paused_until = 0.0
+
+    def set_limits(self, rate_limits: list) -> None:
+        """
+        Use rate limits from exchange info, keeping usage already counted.
+        """
+        with self._condition:
+            for rate_limit in rate_limits:
+                if rate_limit['rateLimitType'] not in ('REQUEST_WEIGHT', 'ORDERS'):
+                    continue
+                kind = 'weight' if rate_limit['rateLimitType'] == 'REQUEST_WEIGHT' else 'orders'
+                interval = f"{rate_limit['intervalNum']}{RATE_LIMIT_INTERVALS[rate_limit['interval']]}"
+                bucket = self._buckets.get((kind, interval))
+                if bucket is None:
+                    self._buckets[(kind, interval)] = RateLimitBucket(rate_limit['limit'], interval, self._clock())
+                else:
+                    bucket.limit = rate_limit['limit']
+            self._condition.notify_all()
+
+    def acquire(self, weight: int, priority: int, order: bool = False) -> None:
+        """
+        Block until request fits into every bucket, then count it.
+        """
+        with self._condition:
+            self._waiting[priority] += 1
+            try:
+                while True:
+                    delay = self._delay(weight, priority, order)
+                    if delay <= 0:
+                        break
+                    self._condition.wait(timeout=delay)
+            finally:
+                self._waiting[priority] -= 1
+                self._condition.notify_all()
+            for (kind, _), bucket in self._buckets.items():
+                if kind == 'weight':
+                    bucket.used += weight
+                elif order:
+                    bucket.used += 1
+
+    def usage(self) -> dict:
+        with self._condition:
+            now = self._clock()
+            for bucket in self._buckets.values():
+                bucket.refresh(now)
+            return {key: (bucket.used, bucket.limit) for key, bucket in self._buckets.items()}
+
+    def on_response(self, response, *args, **kwargs):
+        """
+        requests response hook, syncs usage with headers and pauses on rate limit responses.
+        """
+        with self._condition:
+            now = self._clock()
+            for header, value in response.headers.items():
+                header = header.lower()
+                if header.startswith(USED_WEIGHT_HEADER):
+                    key = ('weight', header[len(USED_WEIGHT_HEADER):])
+                elif header.startswith(ORDER_COUNT_HEADER):
+                    key = ('orders', header[len(ORDER_COUNT_HEADER):])
+                else:
+                    continue
+                bucket = self._buckets.get(key)
+                if bucket is not None:
+                    bucket.refresh(now)
+                    bucket.used = int(value)
+            if response.status_code in RATE_LIMIT_STATUSES:
+                retry_after = float(response.headers.get('Retry-After', DEFAULT_RETRY_AFTER_S))
+                self._paused_until = max(self._paused_until, now + retry_after)
+                print(f"Rate limit hit ({response.status_code}), pausing requests for {retry_after:.0f} s")
+            self._condition.notify_all()
+        return response
+
+    def attach(self, session) -> None:
+        session.hooks['response'].append(self.on_response)
+
+    def _delay(self, weight: int, priority: int, order: bool) -> float:
+        # seconds to wait before checking again, 0 if request can be sent now
+        now = self._clock()
+        if self._paused_until > now:
+            return self._paused_until - now
+        if any(self._waiting[higher] for higher in self._waiting if higher < priority):
+            return self._buckets_reset(now)
+        delay = 0.0
+        for (kind, _), bucket in self._buckets.items():
+            bucket.refresh(now)
+            if kind == 'weight':
+                allowed = bucket.limit * PRIORITY_LIMIT_SHARE[priority]
+                if bucket.used + weight > allowed:
+                    delay = max(delay, bucket.seconds_to_reset(now))
+            elif order and bucket.used + 1 > bucket.limit:
+                delay = max(delay, bucket.seconds_to_reset(now))
+        return delay
+
+    def _buckets_reset(self, now: float) -> float:
+        # woken earlier by notify when higher priority request is sent; refreshed windows reset in the future,
+        # so the wait is never 0, which would let the request go ahead of the waiting one
+        for bucket in self._buckets.values():
+            bucket.refresh(now)
+        return min(bucket.seconds_to_reset(now) for bucket in self._buckets.values())
+
+
+class RateLimitedClient:
+    """
+    Wraps binance Client so every request robot makes goes through rate limiter. Concurrent identical
+    calls of lower priority methods are merged into one request whose result all callers get.
+    Attributes not listed in CLIENT_METHODS are taken from wrapped client unchanged.
+    """
+
+    def __init__(self, client, limiter: RateLimiter = None):
+        self._client = client
+        self.limiter = limiter or RateLimiter()
+        self.limiter.attach(client.session)
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if name not in CLIENT_METHODS:
+            return attribute
+
+        weight, priority = CLIENT_METHODS[name]
+
+        def call(*args, **kwargs):
+            if priority == ORDER_PRIORITY:
+                self.limiter.acquire(weight(**kwargs), priority, order=name in ORDER_METHODS)
+                return attribute(*args, **kwargs)
+            result = self._merged(name, attribute, weight(**kwargs), priority, args, kwargs)
+            if name == 'get_exchange_info':
+                self.limiter.set_limits(result.get('rateLimits', []))
+            return result
+
+        return call
+
+    def _merged(self, name: str, method, weight: int, priority: int, args: tuple, kwargs: dict):
+        key = (name, args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            self.limiter.acquire(weight, priority)
+            return method(*args, **kwargs)
+        with self._lock:
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self._in_flight[key] = Future()
+        if not owner:
+            return future.result()
+        try:
+            self.limiter.acquire(weight, priority)
+            result = method(*args, **kwargs)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._in_flight[key]
@@ -1,19 +1,31 @@
 import json
+import multiprocessing
+import os
+import threading
 
-from statistics import mean
-from typing import Tuple
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError, wait
 
 from jsonschema import validate
 from jsonschema.exceptions import ValidationError
 from inputimeout import inputimeout, TimeoutOccurred
 
 from binance import Client, exceptions
-from binance.helpers import round_step_size
-
-from forecast import model_predict_arima
-from util import graph_orders
+from binance.helpers import interval_to_milliseconds, round_step_size
+from requests.exceptions import RequestException
+
+from indicators import EwmStats, PairSpread, RollingSma, RollingStats
+from exchange_info import ExchangeInfo, PriceSnapshot, EXCHANGE_INFO_FILE_NAME
+from kline_cache import KlineCache, KLINE_CACHE_DIR, MONTH_MS
+from klines import (CLOSE_TIME_INDEX, KlineBuffer, KlineResampler, interval_ratio, klines_to_array,
+                    next_candle_open)
+from metrics import (Metrics, serve_metrics, DECISION_STAGE, FETCH_STAGE, INDICATOR_STAGE, PRICE_STAGE,
+                     TICK_STAGE)
+from order_executor import Order, OrderExecutor, ORDER_MAX_WORKERS, PAIR_REHEDGE, PAIR_UNWIND
+from order_ledger import OrderLedger, ledger_file_name
+from portfolio import Portfolio
+from rate_limiter import RateLimitedClient
+from state_journal import StateJournal, STATE_SNAPSHOT_EVERY_TICKS
 import numpy as np
-import pandas as pd
 import time
 
 
@@ -26,6 +38,7 @@ def print_menu():
     5. Cancel order manually.
     6. Print symbol price filter.
     7. Make manual market order.
+    8. Print symbol PnL.
     ----------------------------------
     9. Print menu.
     0. Quit.""")
@@ -38,8 +51,19 @@ PAIRS_FILE_NAME = 'pairs.json'
 MIN_MENU_TIMEOUT_S = 60
 MAX_MENU_TIMEOUT_S = 3600  # 1 hour
 
-ORDER_RETRY_WAIT_TIME_S = 10  # 10 seconds
-ORDER_MAX_RETRIES = 3  # LIMIT order max retries
+REQUEST_TIMEOUT_S = 10  # single REST request timeout
+KLINES_FETCH_TIMEOUT_S = 30  # deadline for fetching klines of all symbols
+KLINES_FETCH_MAX_WORKERS = 8  # max concurrent kline requests
+
+KLINES_WARMUP_LIMIT = 1000  # klines kept per symbol for ARIMA and pairs strategies
+CANDLE_CLOSE_DELAY_S = 1  # headless trading waits this long after candle close for exchange to publish it
+
+# config keys that shape indicator state, snapshot made with other values is not restored
+STATE_CONFIG_KEYS = ('strategy', 'interval', 'long_term', 'short_term', 'long_interval', 'short_interval',
+                     'pairs', 'spread_stats', 'spread_span', 'arima_reselect')
+# symbol data that is only valid in the running process
+STATE_TRANSIENT_KEYS = ('tick_size', 'book', 'arima_future')
+OPPOSITE_SIDES = {'BUY': 'SELL', 'SELL': 'BUY'}
 
 MIN_SHORT_TERM_SMA = 5
 MIN_LONG_TERM_SMA = 15  #
@@ -54,6 +78,8 @@ MENU_START_INDEX = 0
 MENU_END_INDEX = 9
 MENU_TRADE_INDEX = -1
 
+KLINE_INTERVALS = ["1m", "3m", "5m", "15m", "30m", "1h", "2h", "4h", "8h", "12h", "1d", "3d", "1w", "1M"]
+
 KLINES_COLUMNS = ['Open Time', 'Open', 'High', 'Low', 'Close', 'Volume', 'Close Time',
                   'Quote Asset Volume', 'Number of Trades', 'Taker Base Volume', 'Taker Quote Volume', 'Ignore']
 
@@ -64,72 +90,188 @@ MEAN_STRATEGY = 'MEAN_SMA'
 # Pairs trading using std and hoping that spread returns to the mean
 PT_STRATEGY = 'PT_STRATEGY'
 
+# Spread mean and std over the whole kline window
+ROLLING_SPREAD_STATS = 'ROLLING'
+# Exponentially weighted spread mean and std, span is set by spread_span
+EWM_SPREAD_STATS = 'EWM'
+
+
+def make_client(config: dict) -> RateLimitedClient:
+    """
+    Testnet client from credentials and api_url of config, every request goes through client side rate limiter.
+    """
+    api_url = config.get('api_url')
+    client = Client(config['api_key'], config['api_secret'], testnet=True,
+                    requests_params={'timeout': REQUEST_TIMEOUT_S}, ping=api_url is None)
+    if api_url:
+        client.API_URL = client.API_TESTNET_URL = api_url
+    return RateLimitedClient(client)
+
+
+def sma_warmup_limit(config: dict) -> int:
+    """
+    Base interval klines needed to fill both SMAs of a MEAN_SMA config with closed candles of their
+    intervals, the newest kline may still be open.
+    """
+    limits = []
+    for term, interval in ((config['long_term'], config.get('long_interval', config['interval'])),
+                           (config['short_term'], config.get('short_interval', config['interval']))):
+        ratio = interval_ratio(config['interval'], interval)
+        limits.append(term * ratio + ratio - 1)
+    return max(limits)
+
 
 class Robot:
     MIN_PAIRS = 1
-    MAX_PAIRS = 5
-
-    def __init__(self):
-        with open(CONFIG_FILE_NAME, 'r') as config_file:
-            data = json.load(config_file)
-            validate(instance=data, schema=config_schema)
-            self._client = Client(data['api_key'], data['api_secret'], testnet=True)
-            self._strategy = data['strategy']
-            if self._strategy == MEAN_STRATEGY:
-                self._long_term = data['long_term']
-                self._short_term = data['short_term']
-                self._band = data['band']
-                if self._short_term >= self._long_term:
-                    raise ValidationError(message="Short term should be lower than long term!")
-            elif self._strategy == PT_STRATEGY:
-                self._entry_treshold_ratio = data['entry_treshold']
-                self._exit_treshold_ratio = data['exit_treshold']
-                if self._exit_treshold_ratio >= self._entry_treshold_ratio:
-                    raise ValidationError(message="Exit treshold should be lower than entry treshold!")
-                self._trading_pairs = data["pairs"]
-            self._timeout = data['timeout']
-            self._interval = data['interval']
-
-        with open(PAIRS_FILE_NAME, 'r') as pairs_file:
-            data = json.load(pairs_file)
-            validate(instance=data, schema=pairs_schema)
-            self._pairs_config = data
+    MAX_PAIRS = 50
+
+    def __init__(self, config: dict = None, pairs_config: dict = None, client: Client = None,
+                 disk_cache: bool = True, pairs_file_name: str = PAIRS_FILE_NAME, cache_dir: str = '.'):
+        """
+        Config and pairs config are read from config.json and pairs_file_name unless given, positions are
+        saved to pairs_file_name. Client can be replaced by anything implementing used part of binance
+        Client API, e.g. for backtesting, in which case disk_cache should be off so kline cache and
+        exchange info files are not touched. Kline cache and exchange info are kept in cache_dir, which
+        must not be shared with another running robot.
+        """
+        if config is None:
+            with open(CONFIG_FILE_NAME, 'r') as config_file:
+                config = json.load(config_file)
+        data = config
+        validate(instance=data, schema=config_schema)
+        self._state_key = json.dumps({key: data[key] for key in STATE_CONFIG_KEYS if key in data}, sort_keys=True)
+        self._client = client if client is not None else make_client(data)
+        self._strategy = data['strategy']
+        if self._strategy == MEAN_STRATEGY:
+            self._long_term = data['long_term']
+            self._short_term = data['short_term']
+            self._band = data['band']
+            # SMAs can use higher intervals built from klines of interval
+            self._long_interval = data.get('long_interval', data['interval'])
+            self._short_interval = data.get('short_interval', data['interval'])
+            try:
+                long_ratio = interval_ratio(data['interval'], self._long_interval)
+                short_ratio = interval_ratio(data['interval'], self._short_interval)
+            except ValueError as e:
+                raise ValidationError(message=str(e))
+            if self._short_term * short_ratio >= self._long_term * long_ratio:
+                raise ValidationError(message="Short term should be lower than long term!")
+            self._warmup_limit = sma_warmup_limit(data)
+        elif self._strategy == PT_STRATEGY:
+            self._entry_treshold_ratio = data['entry_treshold']
+            self._exit_treshold_ratio = data['exit_treshold']
+            if self._exit_treshold_ratio >= self._entry_treshold_ratio:
+                raise ValidationError(message="Exit treshold should be lower than entry treshold!")
+            self._trading_pairs = data["pairs"]
+            self._spread_stats = data.get('spread_stats', ROLLING_SPREAD_STATS)
+            self._spread_span = data.get('spread_span', KLINES_WARMUP_LIMIT - 1)
+            self._pair_leg_failure = data.get('pair_leg_failure', PAIR_UNWIND)
+        elif self._strategy == TENDENCY_STRATEGY:
+            # ARIMA pulls in statsmodels and pmdarima, so it is imported only by robots using it
+            from forecast import ARIMA_RESELECT_EVERY, ARIMA_TIMEOUT_S
+            self._arima_reselect = data.get('arima_reselect', ARIMA_RESELECT_EVERY)
+            self._arima_timeout = data.get('arima_timeout', ARIMA_TIMEOUT_S)
+        self._timeout = data['timeout']
+        self._interval = data['interval']
+        # klines published by a feeder process in shared memory, they arrive like stream klines
+        self._market_bus_name = data.get('market_bus')
+        self._market_bus = None
+        self._stream = data.get('stream', False) or self._market_bus_name is not None
+        self._stream_url = data.get('stream_url')
+        self._metrics = Metrics(data.get('metrics', False), data.get('trace_file'))
+        self._metrics_port = data.get('metrics_port')
+
+        self._pairs_file_name = pairs_file_name
+        if pairs_config is None:
+            with open(pairs_file_name, 'r') as pairs_file:
+                pairs_config = json.load(pairs_file)
+        validate(instance=pairs_config, schema=pairs_schema)
+        self._pairs_config = pairs_config
 
         symbols = set()
         if self._strategy == PT_STRATEGY:
             for pair in self._trading_pairs:
                 for symbol in pair.values():
                     symbols.add(symbol)
-                pair['spread'] = pd.DataFrame
+                if self._spread_stats == EWM_SPREAD_STATS:
+                    pair['spread'] = PairSpread(EwmStats(self._spread_span))
+                else:
+                    # warm-up window without the first kline has this many returns
+                    pair['spread'] = PairSpread(RollingStats(KLINES_WARMUP_LIMIT - 1))
                 pair['mean'] = 0
                 pair['std'] = 0
                 pair['init'] = False
+                # both legs are being placed or hedged
+                pair['executing'] = False
+                # ms between fill confirmations of the last pair order
+                pair['leg_skew_ms'] = None
         # this if check is not needed anymore
         self._pairs_data = {key: {} for key in self._pairs_config}
+        self._fetch_executor = ThreadPoolExecutor(max_workers=min(KLINES_FETCH_MAX_WORKERS, len(self._pairs_data)),
+                                                  thread_name_prefix='klines')
+        # guards strategy state when market stream thread and menu both use it
+        self._lock = threading.RLock()
+        self._market_stream = None
+        # feeder keeps kline cache of the bus
+        self._kline_cache = (KlineCache(self._client, self._interval, os.path.join(cache_dir, KLINE_CACHE_DIR))
+                             if disk_cache and self._market_bus_name is None else None)
+        self._exchange_info = ExchangeInfo(self._client,
+                                           os.path.join(cache_dir, EXCHANGE_INFO_FILE_NAME) if disk_cache else None)
+        self._price_snapshot = PriceSnapshot(self._client)
+        self._order_ledger = OrderLedger(self._client, ledger_file_name(data['api_key']) if disk_cache else None)
+        self._portfolio = Portfolio()
+        # positions, fills and indicator state are journaled next to pairs file, so a crashed robot resumes
+        # without warm-up; backtests keep no state
+        self._journal = StateJournal(os.path.splitext(pairs_file_name)[0]) if disk_cache else None
+        self._ticks_since_snapshot = 0
+        # newest fill of every symbol whose position was not switched after it yet
+        self._unswitched_fills = {}
+        self._orders = OrderExecutor(self._client, self._get_symbol_avg_price,
+                                     max_workers=min(ORDER_MAX_WORKERS, len(self._pairs_data)), metrics=self._metrics,
+                                     on_fill=self._on_order_fill)
+        self._arima_executor = None
+        if self._strategy == TENDENCY_STRATEGY:
+            # spawn, because forking a process with running threads is not safe
+            self._arima_executor = ProcessPoolExecutor(max_workers=min(os.cpu_count(), len(self._pairs_data)),
+                                                       mp_context=multiprocessing.get_context('spawn'))
 
         for symbol in self._pairs_data.keys():
             self._pairs_data[symbol]['tick_size'] = self._get_ticksize(symbol)
+            # open time of the newest ingested kline
+            self._pairs_data[symbol]['open_time'] = None
+            # close price of the newest ingested kline
+            self._pairs_data[symbol]['close'] = None
+            # best bid and ask from book ticker stream
+            self._pairs_data[symbol]['book'] = None
             if self._strategy == MEAN_STRATEGY:
                 self._pairs_data[symbol]['long_sma'] = None
                 self._pairs_data[symbol]['short_sma'] = None
                 self._pairs_data[symbol]['long_band'] = None
-                self._pairs_data[symbol]['price_list'] = []
+                if self._long_interval == self._short_interval:
+                    smas = {self._long_interval: RollingSma(self._long_term, self._short_term)}
+                else:
+                    smas = {self._long_interval: RollingSma(self._long_term, self._long_term),
+                            self._short_interval: RollingSma(self._short_term, self._short_term)}
+                # SMAs by interval, each fed by a resampler of base klines
+                self._pairs_data[symbol]['sma'] = smas
+                self._pairs_data[symbol]['resamplers'] = {interval: KlineResampler(self._interval, interval)
+                                                          for interval in smas}
             elif self._strategy == TENDENCY_STRATEGY:
-                self._pairs_data[symbol]['df'] = pd.DataFrame
+                from forecast import ArimaForecaster
+                self._pairs_data[symbol]['klines'] = KlineBuffer(KLINES_WARMUP_LIMIT)
                 self._pairs_data[symbol]['arima_forecast'] = 0
+                self._pairs_data[symbol]['arima'] = ArimaForecaster(self._arima_reselect)
+                # forecast still running in ARIMA process pool
+                self._pairs_data[symbol]['arima_future'] = None
             elif self._strategy == PT_STRATEGY:
-                self._pairs_data[symbol]['df'] = pd.DataFrame
+                self._pairs_data[symbol]['klines'] = KlineBuffer(KLINES_WARMUP_LIMIT)
 
     def run(self) -> None:
-        if self._strategy == MEAN_STRATEGY:
-            self._get_historic_prices(limit=self._long_term)
-            self._calculate_sma()
-        elif self._strategy == TENDENCY_STRATEGY:
-            self._get_klines_as_df(limit=1000)
-            self._calculate_arima()
-        elif self._strategy == PT_STRATEGY:
-            self._get_klines_as_df(limit=1000)
-            self._calculate_spread()
+        if self._metrics_port:
+            serve_metrics(self._metrics, self._metrics_port)
+        self._prepare()
+        self._load_portfolio()
+        self._start_stream()
 
         print_menu()
         quit_loop = False
@@ -137,7 +279,9 @@ class Robot:
             choice = self._get_choice()
 
             if choice == 0:
-                self._save_pairs_data()
+                self._shutdown()
+                with self._lock:
+                    self._save_pairs_data()
                 quit_loop = True
             elif choice == 1:
                 self._print_balances()
@@ -153,45 +297,343 @@ class Robot:
                 self._print_symbol_info()
             elif choice == 7:
                 self._try_to_make_order()
+            elif choice == 8:
+                self._print_symbol_pnl()
             elif choice == 9:
                 print_menu()
-            elif choice == MENU_TRADE_INDEX:
+            elif choice == MENU_TRADE_INDEX and not self._stream:
                 self._try_trade()
             else:
                 pass
         pass
 
+    def run_headless(self, stop_event) -> None:
+        """
+        Trade without menu until stop_event is set. Without stream, strategy is evaluated right after
+        every candle close of interval; wait is computed from the wall clock each round, so ticks do not
+        drift. Positions are saved after every round, so a restarted robot continues from them.
+        """
+        if self._metrics_port:
+            serve_metrics(self._metrics, self._metrics_port)
+        self._prepare()
+        self._load_portfolio()
+        self._start_stream()
+        while not stop_event.wait(self._seconds_to_candle_close()):
+            if not self._stream:
+                self._trade_closed_candle()
+            with self._lock:
+                self._save_pairs_data()
+        self._shutdown()
+        with self._lock:
+            self._save_pairs_data()
+        pass
+
     # HELPER FUNC START
-    def _calculate_sma(self) -> None:
-        for symbol in self._pairs_data:
-            self._pairs_data[symbol]['long_sma'] = mean(self._pairs_data[symbol]['price_list'])
-            self._pairs_data[symbol]['short_sma'] = mean(self._pairs_data[symbol]['price_list'][0:self._short_term])
-            self._pairs_data[symbol]['long_band'] = self._pairs_data[symbol]['long_sma'] * self._band
+    def _start_stream(self) -> None:
+        if self._market_bus:
+            from market_bus import MarketBusStream
+            self._market_stream = MarketBusStream(self._market_bus, self._on_stream_kline,
+                                                  {symbol: data['open_time'] for symbol, data in self._pairs_data.items()})
+            self._market_stream.start()
+        elif self._stream:
+            from market_stream import MarketStream
+            self._market_stream = MarketStream(list(self._pairs_data), self._interval, self._on_stream_kline,
+                                               self._on_stream_book_ticker, self._stream_url,
+                                               on_reconnect=self._backfill_stream)
+            self._market_stream.start()
         pass
 
-    def _calculate_arima(self) -> None:
-        for symbol in self._pairs_data:
-            self._pairs_data[symbol]['arima_forecast'] = model_predict_arima(symbol, self._pairs_data[symbol]['df'])
+    def _seconds_to_candle_close(self) -> float:
+        now_ms = time.time() * 1000
+        return (next_candle_open(int(now_ms), self._interval) - now_ms) / 1000 + CANDLE_CLOSE_DELAY_S
+
+    def _trade_closed_candle(self) -> None:
+        """
+        Ingest every kline closed since the newest ingested one, in order, and evaluate strategy, same
+        as stream does. A round that woke late by more than one interval catches up all missed candles.
+        """
+        now_ms = int(time.time() * 1000)
+        open_times = [data['open_time'] for data in self._pairs_data.values() if data['open_time'] is not None]
+        interval_ms = interval_to_milliseconds(self._interval) or MONTH_MS
+        limit = min(KLINES_WARMUP_LIMIT, max(2, (now_ms - min(open_times)) // interval_ms + 1)) if open_times else 2
+        try:
+            klines = self._fetch_klines(limit)
+        except (FuturesTimeoutError, exceptions.BinanceAPIException, RequestException) as e:
+            # missed candles are caught up next round
+            print(f"Fetching klines failed, skipping this round: {e!r}")
+            return
+        with self._lock:
+            closed = {}
+            for symbol, symbol_klines in klines.items():
+                open_time = self._pairs_data[symbol]['open_time']
+                closed[symbol] = [kline for kline in symbol_klines if kline[CLOSE_TIME_INDEX] < now_ms
+                                  and (open_time is None or kline[0] >= open_time)]
+            self._catch_up(closed)
+        self._evaluate()
         pass
 
-    def _calculate_spread(self) -> None:
-        for pair in self._trading_pairs:
-            # setting open time as index is importante!
-            asset1_data = self._pairs_data[pair['asset1']]['df'].set_index('Open Time')
-            asset2_data = self._pairs_data[pair['asset2']]['df'].set_index('Open Time')
+    def _prepare(self) -> None:
+        warmup_limit = self._warmup_limit if self._strategy == MEAN_STRATEGY else KLINES_WARMUP_LIMIT
+        if not self._recover_state(warmup_limit):
+            self._warm_up(limit=warmup_limit)
+        if self._strategy == MEAN_STRATEGY:
+            self._calculate_sma()
+        elif self._strategy == TENDENCY_STRATEGY:
+            # first order selection can take long, so there is no deadline
+            self._calculate_arima(wait_all=True)
+        elif self._strategy == PT_STRATEGY:
+            self._calculate_spread()
+        self._save_state()
+        pass
+
+    def _recover_state(self, warmup_limit: int) -> bool:
+        """
+        Restore indicators from state snapshot when it was made with the same strategy config and the
+        klines missed since then can be caught up. After a crash positions are restored from snapshot and
+        journal too; after a clean quit pairs file holds them, so edits made to it meanwhile are kept.
+        Returns True when indicators were restored and warm-up is not needed.
+        """
+        if self._journal is None:
+            return False
+        start = time.perf_counter()
+        state, records = self._journal.load()
+        if state is None and not records:
+            return False
+        if state is None or state['key'] != self._state_key or state['pairs_data'].keys() != self._pairs_data.keys():
+            print("State snapshot does not match config, warming up with positions of pairs file")
+            return False
+        if state['clean'] and not records:
+            print("Previous run quit cleanly, using positions of pairs file")
+        else:
+            self._replay_journal(state, records)
+        open_times = {symbol: data['open_time'] for symbol, data in state['pairs_data'].items()}
+        interval_ms = interval_to_milliseconds(self._interval) or MONTH_MS
+        if any(open_time is None or (time.time() * 1000 - open_time) // interval_ms >= warmup_limit
+               for open_time in open_times.values()):
+            print("State snapshot is older than warm-up, warming up")
+            return False
+        klines = self._fetch_klines_since(open_times)
+        if any(not symbol_klines or symbol_klines[0][0] != open_times[symbol]
+               for symbol, symbol_klines in klines.items()):
+            print("Klines since state snapshot are not available, warming up")
+            return False
+        for symbol, data in state['pairs_data'].items():
+            self._pairs_data[symbol].update(data)
+        if self._strategy == PT_STRATEGY:
+            for pair, pair_state in zip(self._trading_pairs, state['trading_pairs']):
+                pair.update(pair_state)
+        self._catch_up(klines)
+        print(f"Recovered state with {sum(len(symbol_klines) for symbol_klines in klines.values())} klines "
+              f"in {(time.perf_counter() - start) * 1000:.1f} ms")
+        return True
+
+    def _replay_journal(self, state: dict, records: list) -> None:
+        """
+        Apply positions and pair init of crashed run's snapshot and newer journal records. Symbol whose
+        newest record is a completed fill still has the position that fill was placed for, so it is
+        switched as its order callback would have done.
+        """
+        positions = dict(state['positions'])
+        pairs_init = dict(state['pairs_init'])
+        last_records = dict(state['unswitched_fills'])
+        for record in records:
+            if record['type'] == 'position':
+                positions[record['symbol']] = record['position']
+                last_records[record['symbol']] = record
+            elif record['type'] == 'fill':
+                last_records[record['symbol']] = record
+            elif record['type'] == 'pair':
+                pairs_init[f"{record['asset1']}-{record['asset2']}"] = record['init']
+        for symbol, record in last_records.items():
+            if record['type'] == 'fill' and not record['remaining'] and positions.get(symbol) == record['side']:
+                print(f"{symbol} order {record['client_order_id']} was filled before crash, switching position")
+                positions[symbol] = OPPOSITE_SIDES[record['side']]
+        for symbol, position in positions.items():
+            if symbol in self._pairs_config:
+                self._pairs_config[symbol]['position'] = position
+        if self._strategy == PT_STRATEGY:
+            for pair in self._trading_pairs:
+                pair['init'] = pairs_init.get(f"{pair['asset1']}-{pair['asset2']}", pair['init'])
+        pass
+
+    def _fetch_klines_since(self, open_times: dict) -> dict:
+        """
+        Klines of every symbol from the given open time on, from market bus or exchange.
+        """
+        if self._market_bus_name:
+            from market_bus import bus_kline
+            self._attach_market_bus(1)
+            klines = {}
+            for symbol in self._pairs_data:
+                since = self._market_bus.since(symbol, open_times[symbol] - 1)
+                klines[symbol] = [bus_kline(open_time, close)
+                                  for open_time, close in zip(since['open_time'].tolist(), since['close'].tolist())]
+            return klines
+        futures = {symbol: self._fetch_executor.submit(self._client.get_historical_klines, symbol, self._interval,
+                                                       start_str=str(open_times[symbol]))
+                   for symbol in self._pairs_data}
+        return {symbol: future.result() for symbol, future in futures.items()}
+
+    def _catch_up(self, klines: dict) -> None:
+        """
+        Ingest missed klines candle by candle, updating pair spreads after every candle as a running robot
+        would have.
+        """
+        by_open_time = {}
+        for symbol, symbol_klines in klines.items():
+            for kline in symbol_klines:
+                by_open_time.setdefault(kline[0], []).append((symbol, kline))
+        for open_time in sorted(by_open_time):
+            for symbol, kline in by_open_time[open_time]:
+                self._ingest_kline(symbol, kline)
+            if self._strategy == PT_STRATEGY:
+                self._calculate_spread()
+        pass
+
+    def _save_state(self, clean: bool = False) -> None:
+        """
+        Snapshot positions and indicators and compact the journal. State is serialized under the lock,
+        written and synced after releasing it, so order callbacks are not held up by disk. Clean snapshot
+        is taken on quit, positions of pairs file are used after it instead of replaying the journal.
+        """
+        if self._journal is None or not self._journal.opened:
+            return
+        with self._lock:
+            state = {
+                'key': self._state_key,
+                'clean': clean,
+                'positions': {symbol: config['position'] for symbol, config in self._pairs_config.items()},
+                'unswitched_fills': dict(self._unswitched_fills),
+                'pairs_data': {symbol: {key: value for key, value in data.items() if key not in STATE_TRANSIENT_KEYS}
+                               for symbol, data in self._pairs_data.items()},
+                'pairs_init': {},
+                'trading_pairs': [],
+            }
+            if self._strategy == PT_STRATEGY:
+                state['pairs_init'] = {f"{pair['asset1']}-{pair['asset2']}": pair['init']
+                                       for pair in self._trading_pairs}
+                state['trading_pairs'] = [{key: pair[key] for key in ('spread', 'mean', 'std', 'leg_skew_ms')}
+                                          for pair in self._trading_pairs]
+            seq, data = self._journal.encode(state)
+            self._ticks_since_snapshot = 0
+        self._journal.snapshot(seq, data)
+        pass
+
+    def _journal_record(self, record: dict) -> None:
+        if self._journal is not None and self._journal.opened:
+            self._journal.append(record)
+        pass
+
+    def _set_position(self, symbol: str, position: str) -> None:
+        self._pairs_config[symbol]['position'] = position
+        self._unswitched_fills.pop(symbol, None)
+        self._journal_record({'type': 'position', 'symbol': symbol, 'position': position})
+        pass
+
+    def _set_pair_init(self, pair: dict) -> None:
+        if not pair['init']:
+            pair['init'] = True
+            self._journal_record({'type': 'pair', 'asset1': pair['asset1'], 'asset2': pair['asset2'], 'init': True})
+        pass
+
+    def _calculate_sma(self, symbols: list = None) -> None:
+        for symbol in symbols or self._pairs_data:
+            long_sma = self._pairs_data[symbol]['sma'][self._long_interval].long_sma
+            self._pairs_data[symbol]['long_sma'] = long_sma
+            self._pairs_data[symbol]['short_sma'] = self._pairs_data[symbol]['sma'][self._short_interval].short_sma
+            self._pairs_data[symbol]['long_band'] = long_sma * self._band
+        pass
+
+    def _push_sma_price(self, symbol: str, open_time: int, close: float) -> None:
+        """
+        Feed a base kline to every SMA interval, an SMA changes only when its interval closes a candle.
+        Kline with the same open time as the previous one replaces it.
+        """
+        close = float(close)
+        for interval, resampler in self._pairs_data[symbol]['resamplers'].items():
+            sma = self._pairs_data[symbol]['sma'][interval]
+            for _, candle_close, replace in resampler.push(open_time, close):
+                if replace:
+                    sma.replace_newest(candle_close)
+                else:
+                    sma.push(candle_close)
+        pass
+
+    def _calculate_arima(self, wait_all: bool = False, symbols: list = None) -> None:
+        """
+        Update ARIMA forecasts of symbols (all by default) in parallel processes. Symbol whose forecast is
+        not ready within arima_timeout keeps its previous forecast, and the late result is picked up on a
+        later call.
+        """
+        from forecast import forecast_task
+        symbols = symbols or list(self._pairs_data)
+        with self._lock:
+            for symbol in symbols:
+                future = self._pairs_data[symbol]['arima_future']
+                if future is None or future.done():
+                    if future is not None:
+                        self._collect_arima(symbol)
+                    klines = self._pairs_data[symbol]['klines']
+                    self._pairs_data[symbol]['arima_future'] = self._arima_executor.submit(
+                        forecast_task, self._pairs_data[symbol]['arima'], klines.close.copy(), klines.total)
+            futures = [self._pairs_data[symbol]['arima_future'] for symbol in symbols]
+
+        # closes were copied for the tasks, so stream and order callbacks do not wait for forecasts
+        wait(futures, timeout=None if wait_all else self._arima_timeout)
+        with self._lock:
+            for symbol, future in zip(symbols, futures):
+                if not future.done():
+                    print(f"ARIMA forecast for {symbol} is late, using previous one")
+                elif self._pairs_data[symbol]['arima_future'] is future:
+                    self._collect_arima(symbol)
+        pass
 
-            # print(f'Current symbols :{pair["asset1"]} and {pair["asset2"]}')
-            asset1_returns = (asset1_data['Close'].diff().dropna()).to_frame()
-            asset2_returns = (asset2_data['Close'].diff().dropna()).to_frame()
+    def _collect_arima(self, symbol: str) -> None:
+        future = self._pairs_data[symbol]['arima_future']
+        self._pairs_data[symbol]['arima_future'] = None
+        try:
+            forecaster, forecast = future.result()
+        except Exception as e:
+            print(f"ARIMA forecast for {symbol} failed: {e}")
+            return
+        self._pairs_data[symbol]['arima'] = forecaster
+        self._pairs_data[symbol]['arima_forecast'] = forecast
+        pass
 
-            asset1_returns.columns.values[0] = 'return'
-            asset2_returns.columns.values[0] = 'return'
+    def _shutdown(self) -> None:
+        if self._market_stream:
+            self._market_stream.stop()
+        if self._market_bus:
+            self._market_bus.close()
+        self._fetch_executor.shutdown(wait=False)
+        self._orders.shutdown()
+        if self._arima_executor:
+            self._arima_executor.shutdown(wait=False, cancel_futures=True)
+        if self._journal is not None:
+            self._save_state(clean=True)
+            self._journal.close()
+        pass
 
-            spread = (asset1_returns['return'] - asset2_returns['return']).to_frame()
-            spread.columns.values[0] = 'return'
-            pair['mean'] = spread["return"].mean()
-            pair['std'] = spread["return"].std()
-            pair['spread'] = spread
+    def _calculate_spread(self) -> None:
+        for pair in self._trading_pairs:
+            asset1_klines = self._pairs_data[pair['asset1']]['klines']
+            asset2_klines = self._pairs_data[pair['asset2']]['klines']
+            spread = pair['spread']
+            if spread.open_time is None:
+                # after warm-up whole window is added, aligned on open time is importante!
+                open_times, asset1_index, asset2_index = np.intersect1d(asset1_klines.open_time,
+                                                                        asset2_klines.open_time,
+                                                                        return_indices=True)
+                for open_time, close1, close2 in zip(open_times.tolist(), asset1_klines.close[asset1_index].tolist(),
+                                                     asset2_klines.close[asset2_index].tolist()):
+                    spread.update(open_time, close1, close2)
+            elif asset1_klines.last_open_time == asset2_klines.last_open_time:
+                # only the newest candle, once both assets have it
+                spread.update(asset1_klines.last_open_time, float(asset1_klines.close[-1]),
+                              float(asset2_klines.close[-1]))
+            if spread.distance is not None:
+                pair['mean'] = spread.mean
+                pair['std'] = spread.std
         pass
 
     def _get_choice(self) -> int:
@@ -209,22 +651,160 @@ class Robot:
 
     def _try_trade(self) -> None:
         klines = 1
-        if self._strategy == MEAN_STRATEGY:
-            self._get_historic_prices(klines)
-            self._calculate_sma()
-            self._trade_sma()
-        elif self._strategy == TENDENCY_STRATEGY:
-            self._get_klines_as_df(klines)
-            self._calculate_arima()
-            self._trade_arima()
-        elif self._strategy == PT_STRATEGY:
-            self._get_klines_as_df(klines)
-            self._calculate_spread()
-            self._trade_pairs()
+        try:
+            if self._strategy == MEAN_STRATEGY:
+                self._get_historic_prices(klines)
+            else:
+                self._get_klines_as_df(klines)
+        except (FuturesTimeoutError, exceptions.BinanceAPIException, RequestException) as e:
+            print(f"Fetching klines failed, skipping this tick: {e!r}")
+            return
+        self._evaluate()
+        pass
+
+    def _evaluate(self, symbols: list = None) -> None:
+        """
+        Update indicators and trade symbols, all of them by default. Pairs strategy always evaluates
+        every pair. Called without the lock, ARIMA forecasts are waited for while it is released.
+        """
+        metrics = self._metrics
+        metrics.begin_tick()
+        with metrics.timer(TICK_STAGE):
+            if self._strategy == MEAN_STRATEGY:
+                with self._lock:
+                    with metrics.timer(INDICATOR_STAGE):
+                        self._calculate_sma(symbols)
+                    with metrics.timer(DECISION_STAGE):
+                        self._trade_sma(symbols)
+            elif self._strategy == TENDENCY_STRATEGY:
+                with metrics.timer(INDICATOR_STAGE):
+                    self._calculate_arima(symbols=symbols)
+                with self._lock, metrics.timer(DECISION_STAGE):
+                    self._trade_arima(symbols)
+            elif self._strategy == PT_STRATEGY:
+                with self._lock:
+                    with metrics.timer(INDICATOR_STAGE):
+                        self._calculate_spread()
+                    with metrics.timer(DECISION_STAGE):
+                        self._trade_pairs()
+        metrics.end_tick()
+        with self._lock:
+            self._mark_portfolio()
+            self._ticks_since_snapshot += 1
+            save_state = self._ticks_since_snapshot >= STATE_SNAPSHOT_EVERY_TICKS
+        if save_state:
+            self._save_state()
+        pass
+
+    def _on_stream_kline(self, symbol: str, kline: list) -> None:
+        with self._lock:
+            if symbol not in self._pairs_data:
+                return
+            open_time = self._pairs_data[symbol]['open_time']
+            if open_time is not None and kline[0] < open_time:
+                return
+            self._ingest_kline(symbol, kline)
+            if self._strategy != PT_STRATEGY:
+                # symbols are traded on their own, a lagging one does not hold up the others
+                symbols = [symbol]
+            # pairs are evaluated once every symbol has closed the same candle, so both legs stay aligned
+            elif all(data['open_time'] == kline[0] for data in self._pairs_data.values()):
+                symbols = None
+            else:
+                return
+        self._evaluate(symbols)
+        pass
+
+    def _backfill_stream(self) -> None:
+        """
+        Ingest candles closed while websocket was disconnected, from the newest ingested one on and in
+        open time order, so indicators do not skip them.
+        """
+        open_times = {symbol: data['open_time'] for symbol, data in self._pairs_data.items()}
+        if any(open_time is None for open_time in open_times.values()):
+            return
+        now_ms = int(time.time() * 1000)
+        try:
+            klines = self._fetch_klines_since(open_times)
+        except (exceptions.BinanceAPIException, RequestException) as e:
+            print(f"Backfill after reconnect failed: {e}")
+            return
+        closed = sorted(((kline[0], symbol, kline) for symbol, symbol_klines in klines.items()
+                         for kline in symbol_klines if kline[CLOSE_TIME_INDEX] < now_ms), key=lambda item: item[:2])
+        print(f"Backfilling {len(closed)} klines after reconnect")
+        for _, symbol, kline in closed:
+            if kline[0] == open_times[symbol]:
+                # candle ingested before disconnect, maybe while still open, was already evaluated
+                with self._lock:
+                    self._ingest_kline(symbol, kline)
+            else:
+                self._on_stream_kline(symbol, kline)
+        pass
+
+    def _on_order_fill(self, order: Order, quantity: float, response: dict) -> None:
+        # price of MARKET fills is only in quote quantity, LIMIT fills have it in the response
+        quote_quantity = float(response.get('cummulativeQuoteQty', 0)) or quantity * float(response.get('price', 0))
+        self._portfolio.apply_fill(order.symbol, order.side, quantity, quote_quantity)
+        record = {'type': 'fill', 'symbol': order.symbol, 'side': order.side, 'order_id': response.get('orderId'),
+                  'client_order_id': order.client_order_id, 'quantity': quantity,
+                  'remaining': round(order.quantity - quantity, 8)}
+        with self._lock:
+            self._unswitched_fills[order.symbol] = record
+            self._journal_record(record)
+        pass
+
+    def _load_portfolio(self) -> None:
+        """
+        Value account once before trading, so ticks can mark it to market from then on.
+        """
+        try:
+            self._get_balance_values()
+        except (exceptions.BinanceAPIException, RequestException) as e:
+            print(f"Portfolio valuation failed: {e}")
+        pass
+
+    def _mark_portfolio(self) -> None:
+        """
+        Mark portfolio to market with the newest closes of traded symbols, without any request.
+        """
+        if not self._portfolio.loaded:
+            return
+        self._portfolio.update_prices({symbol: data['close'] for symbol, data in self._pairs_data.items()
+                                       if data['close'] is not None})
+        self._portfolio.mark(max(data['open_time'] or 0 for data in self._pairs_data.values()))
+        pass
+
+    def _on_stream_book_ticker(self, symbol: str, bid: float, ask: float) -> None:
+        if symbol in self._pairs_data:
+            self._pairs_data[symbol]['book'] = (bid, ask)
+        pass
+
+    def _ingest_kline(self, symbol: str, kline: list) -> None:
+        """
+        Add a single closed kline to symbol data. Kline with the same open time as the newest one
+        (candle that was still open during warm-up) overwrites it instead of being appended.
+        """
+        close_price_index = 4
+        same_candle = self._pairs_data[symbol]['open_time'] == kline[0]
+        with self._metrics.timer(INDICATOR_STAGE, symbol):
+            if self._strategy == MEAN_STRATEGY:
+                self._push_sma_price(symbol, kline[0], kline[close_price_index])
+            elif same_candle:
+                self._pairs_data[symbol]['klines'].replace_last(float(kline[close_price_index]))
+            else:
+                self._pairs_data[symbol]['klines'].extend([kline])
+        self._pairs_data[symbol]['open_time'] = kline[0]
+        self._pairs_data[symbol]['close'] = float(kline[close_price_index])
+        if self._kline_cache:
+            self._kline_cache.append(symbol, [kline])
         pass
 
-    def _trade_sma(self) -> None:
-        for symbol, config in self._pairs_config.items():
+    def _trade_sma(self, symbols: list = None) -> None:
+        for symbol in symbols or self._pairs_config:
+            config = self._pairs_config[symbol]
+            if self._orders.pending(symbol):
+                print(f"{symbol} order is still being placed")
+                continue
             position = config['position']
             long_sma = self._pairs_data[symbol]['long_sma']
             short_sma = self._pairs_data[symbol]['short_sma']
@@ -234,89 +814,127 @@ class Robot:
                 price = self._get_symbol_avg_price(symbol)
             print(f"Trying to trade {symbol=} {position=} {price=} {long_sma=} {short_sma=} {band=}")
             if short_sma > (long_sma + band) and position == 'BUY':
-                if self._make_order(symbol, position, config['trade_quantity'], price):
-                    config['position'] = 'SELL'
+                self._make_order(symbol, position, config['trade_quantity'], price, next_position='SELL')
             elif short_sma < (long_sma + band) and position == 'SELL':
-                if self._make_order(symbol, position, config['trade_quantity'], price):
-                    config['position'] = 'BUY'
+                self._make_order(symbol, position, config['trade_quantity'], price, next_position='BUY')
         pass
 
-    def _trade_arima(self) -> None:
-        for symbol, config in self._pairs_config.items():
+    def _trade_arima(self, symbols: list = None) -> None:
+        for symbol in symbols or self._pairs_config:
+            config = self._pairs_config[symbol]
+            if self._orders.pending(symbol):
+                print(f"{symbol} order is still being placed")
+                continue
             position = config['position']
             price = None
             if config['order_type'] == "LIMIT":
                 price = self._get_symbol_avg_price(symbol)
             if self._pairs_data[symbol]['arima_forecast'] > price and position == 'BUY':
-                if self._make_order(symbol, position, config['trade_quantity'], price):
-                    config['position'] = 'SELL'
+                self._make_order(symbol, position, config['trade_quantity'], price, next_position='SELL')
             elif self._pairs_data[symbol]['arima_forecast'] < price and position == 'SELL':
-                if self._make_order(symbol, position, config['trade_quantity'], price):
-                    config['position'] = 'BUY'
+                self._make_order(symbol, position, config['trade_quantity'], price, next_position='BUY')
         pass
 
     def _trade_pairs(self) -> None:
         for pair in self._trading_pairs:
-            current_distance = pair['spread']['return'].iloc[-1]
-            # print(f"current distance is {pair['spread']['return'].iloc[-1]} mean:{pair['mean']} std:{pair['std']}")
+            current_distance = pair['spread'].distance
+            if current_distance is None:
+                continue
+            # next decision waits until both legs are filled or hedged
+            if pair['executing'] or self._orders.pending(pair['asset1']) or self._orders.pending(pair['asset2']):
+                print(f"{pair['asset1']}-{pair['asset2']} orders are still being placed")
+                continue
+            # print(f"current distance is {current_distance} mean:{pair['mean']} std:{pair['std']}")
 
             entry_threshold = pair['std'] * self._entry_treshold_ratio
             exit_threshold = pair['std'] * self._exit_treshold_ratio
+            asset1_position = self._pairs_config[pair['asset1']]['position']
+            asset2_position = self._pairs_config[pair['asset2']]['position']
 
+            # (symbol, side, position after fill) of every leg to place
+            legs = []
             # enter position
             if current_distance > pair['mean'] + entry_threshold:
                 print(f"Should buy {pair['asset1']} and sell {pair['asset2']}")
-                if not pair['init']:
-                    self._make_order(pair['asset1'], 'BUY', self._pairs_config[pair['asset1']]['trade_quantity'])
-                    self._pairs_config[pair['asset1']]['position'] = 'SELL'
-                    self._make_order(pair['asset2'], 'SELL', self._pairs_config[pair['asset2']]['trade_quantity'])
-                    self._pairs_config[pair['asset2']]['position'] = 'BUY'
-                    pair['init'] = True
-
-                if self._pairs_config[pair['asset1']]['position'] == 'BUY':
-                    self._make_order(pair['asset1'], 'BUY', self._pairs_config[pair['asset1']]['trade_quantity'])
-                    self._pairs_config[pair['asset1']]['position'] = 'SELL'
-                if self._pairs_config[pair['asset2']]['position'] == 'SELL':
-                    self._make_order(pair['asset2'], 'SELL', self._pairs_config[pair['asset2']]['trade_quantity'])
-                    self._pairs_config[pair['asset2']]['position'] = 'BUY'
+                if not pair['init'] or asset1_position == 'BUY':
+                    legs.append((pair['asset1'], 'BUY', 'SELL'))
+                if not pair['init'] or asset2_position == 'SELL':
+                    legs.append((pair['asset2'], 'SELL', 'BUY'))
+                self._set_pair_init(pair)
             # enter position
             elif current_distance < pair['mean'] - entry_threshold:
                 print(f"Should sell {pair['asset1']} and buy {pair['asset2']}")
-                if not pair['init']:
-                    self._make_order(pair['asset1'], 'SELL', self._pairs_config[pair['asset1']]['trade_quantity'])
-                    self._pairs_config[pair['asset1']]['position'] = 'BUY'
-                    self._make_order(pair['asset2'], 'BUY', self._pairs_config[pair['asset2']]['trade_quantity'])
-                    self._pairs_config[pair['asset2']]['position'] = 'SELL'
-                    pair['init'] = True
-
-                if self._pairs_config[pair['asset1']]['position'] == 'SELL':
-                    self._make_order(pair['asset1'], 'SELL', self._pairs_config[pair['asset1']]['trade_quantity'])
-                    self._pairs_config[pair['asset1']]['position'] = 'BUY'
-                if self._pairs_config[pair['asset2']]['position'] == 'BUY':
-                    self._make_order(pair['asset2'], 'BUY', self._pairs_config[pair['asset2']]['trade_quantity'])
-                    self._pairs_config[pair['asset2']]['position'] = 'SELL'
+                if not pair['init'] or asset1_position == 'SELL':
+                    legs.append((pair['asset1'], 'SELL', 'BUY'))
+                if not pair['init'] or asset2_position == 'BUY':
+                    legs.append((pair['asset2'], 'BUY', 'SELL'))
+                self._set_pair_init(pair)
             # exit position
             elif abs(current_distance) < exit_threshold:
-                
                 print("CLOSING POSITION IF ENTERED")
-                if self._pairs_config[pair['asset1']]['position'] == 'SELL':
-                    self._make_order(pair['asset1'], 'SELL', self._pairs_config[pair['asset1']]['trade_quantity'])
-                    self._pairs_config[pair['asset1']]['position'] = 'BUY'
-                if self._pairs_config[pair['asset2']]['position'] == 'SELL':
-                    self._make_order(pair['asset2'], 'SELL', self._pairs_config[pair['asset2']]['trade_quantity'])
-                    # config['position'] = 'BUY'
-                    self._pairs_config[pair['asset2']]['position'] = 'BUY'
-                pass
-            print("NOTHING")
+                if asset1_position == 'SELL':
+                    legs.append((pair['asset1'], 'SELL', 'BUY'))
+                if asset2_position == 'SELL':
+                    legs.append((pair['asset2'], 'SELL', 'BUY'))
+
+            if len(legs) == 2:
+                self._make_pair_order(pair, legs)
+            elif legs:
+                symbol, side, next_position = legs[0]
+                self._make_order(symbol, side, self._pairs_config[symbol]['trade_quantity'],
+                                 next_position=next_position)
+            else:
+                print("NOTHING")
 
         pass
 
     # HELPER FUNC END
 
     # GETTERS START
+    def _warm_up(self, limit: int) -> None:
+        """
+        Load the newest klines of each symbol from the market bus, or through kline cache, which requests
+        from the client only klines missing since the last run, and fill symbol indicators with them.
+
+        Args:
+        limit: An integer representing the number of historical klines needed by strategy.
+
+        Returns:
+        None
+        """
+        if self._market_bus_name:
+            self._attach_market_bus(limit)
+            history = {symbol: self._market_bus.latest(symbol, limit) for symbol in self._pairs_data}
+        elif self._kline_cache:
+            futures = {symbol: self._fetch_executor.submit(self._kline_cache.latest, symbol, limit)
+                       for symbol in self._pairs_data}
+            history = {symbol: future.result() for symbol, future in futures.items()}
+        else:
+            history = {symbol: klines_to_array(klines) for symbol, klines in self._fetch_klines(limit).items()}
+        for symbol, klines in history.items():
+            assert (len(klines) == limit)
+            if self._strategy == MEAN_STRATEGY:
+                for open_time, close in zip(klines['open_time'].tolist(), klines['close'].tolist()):
+                    self._push_sma_price(symbol, open_time, close)
+            else:
+                if self._strategy == PT_STRATEGY:
+                    # 2023-05-03 FIRST CLOSE PRICE IS TOO HIGH FOR BTC so just skipping first element of each symbol
+                    klines = klines[1:]
+                self._pairs_data[symbol]['klines'].extend_array(klines)
+            self._pairs_data[symbol]['open_time'] = int(klines['open_time'][-1])
+            self._pairs_data[symbol]['close'] = float(klines['close'][-1])
+        pass
+
+    def _attach_market_bus(self, limit: int) -> None:
+        if self._market_bus is None:
+            from market_bus import MarketBusReader
+            self._market_bus = MarketBusReader(list(self._pairs_data), self._interval, self._market_bus_name)
+        self._market_bus.wait_for(limit)
+        pass
+
     def _get_historic_prices(self, limit: int) -> None:
         """
-        Retrieve and store the historical close prices of each symbol from the client.
+        Retrieve the historical close prices of each symbol from the client and push them into its rolling SMAs.
 
         Args:
         limit: An integer representing the number of historical price data points to retrieve.
@@ -325,73 +943,114 @@ class Robot:
         None
         """
         close_price_index = 4
-        for symbol in self._pairs_data:
-            klines = self._client.get_historical_klines(symbol, self._interval, limit=limit)
+        for symbol, klines in self._fetch_klines(limit).items():
             assert (len(klines) == limit)
-            if self._pairs_data[symbol]['price_list']:
-                self._pairs_data[symbol]['price_list'].pop()
             for kline in klines:
-                self._pairs_data[symbol]['price_list'].insert(0, float(kline[close_price_index]))
+                self._push_sma_price(symbol, kline[0], kline[close_price_index])
+            self._pairs_data[symbol]['open_time'] = klines[-1][0]
+            self._pairs_data[symbol]['close'] = float(klines[-1][close_price_index])
         pass
 
     def _get_klines_as_df(self, limit: int) -> None:
-        for symbol in self._pairs_data:
-            klines = self._client.get_historical_klines(symbol, self._interval, limit=limit)
-            klines = np.array(klines)
-            df = pd.DataFrame(klines.reshape(-1, 12), dtype=float, columns=KLINES_COLUMNS)
-            df['Open Time'] = pd.to_datetime(df['Open Time'], unit='ms')
+        """
+        Retrieve klines of each symbol and append their open times and close prices to its kline buffer.
+        Buffer is full after warm-up, so every new kline overwrites the oldest one in place. Kline with
+        the same open time as the newest one (candle still open at the previous fetch) overwrites it.
+        """
+        close_price_index = 4
+        for symbol, klines in self._fetch_klines(limit).items():
+            open_time = self._pairs_data[symbol]['open_time']
+            if open_time is not None:
+                klines = [kline for kline in klines if kline[0] >= open_time]
+                if not klines:
+                    continue
             # TAIL - recent prices, HEAD - old prices
-            df = df[['Open Time', 'Close']]
-            if self._pairs_data[symbol]['df'].empty:
-                self._pairs_data[symbol]['df'] = df
+            if klines[0][0] == open_time:
+                self._pairs_data[symbol]['klines'].replace_last(float(klines[0][close_price_index]))
+                self._pairs_data[symbol]['klines'].extend(klines[1:])
             else:
-                # remove first element - oldest price
-                self._pairs_data[symbol]['df'] = self._pairs_data[symbol]['df'].iloc[1:]
-                # append neweset price to the end
-                self._pairs_data[symbol]['df'] = pd.concat([self._pairs_data[symbol]['df'], df],
-                                                           ignore_index=True)
-            if limit == 1000 and self._strategy == PT_STRATEGY:
-                # 2023-05-03 FIRST CLOSE PRICE IS TOO HIGH FOR BTC so just removing first element of each DF
-                self._pairs_data[symbol]['df'] = self._pairs_data[symbol]['df'].iloc[1:]
+                self._pairs_data[symbol]['klines'].extend(klines)
+            self._pairs_data[symbol]['open_time'] = klines[-1][0]
+            self._pairs_data[symbol]['close'] = float(klines[-1][close_price_index])
         pass
 
-    def _get_symbol_orders(self, symbol) -> dict:
-        return self._client.get_all_orders(symbol=symbol)
+    def _fetch_klines(self, limit: int) -> dict:
+        """
+        Fetch the newest klines of every symbol concurrently.
+
+        Args:
+        limit: An integer representing the number of klines to retrieve per symbol.
+
+        Returns:
+        A dict of klines keyed by symbol, in the same order as pairs data.
+        """
+        futures = {symbol: self._fetch_executor.submit(self._fetch_symbol_klines, symbol, limit)
+                   for symbol in self._pairs_data}
+        deadline = time.monotonic() + KLINES_FETCH_TIMEOUT_S
+        klines = {symbol: future.result(timeout=max(0.0, deadline - time.monotonic()))
+                  for symbol, future in futures.items()}
+        if self._kline_cache:
+            for symbol, symbol_klines in klines.items():
+                self._kline_cache.append(symbol, symbol_klines)
+        return klines
+
+    def _fetch_symbol_klines(self, symbol: str, limit: int) -> list:
+        with self._metrics.timer(FETCH_STAGE, symbol):
+            return self._client.get_historical_klines(symbol, self._interval, limit=limit)
+
+    def _get_symbol_orders(self, symbol: str, limit: int = None, start_ms: int = None, end_ms: int = None) -> list:
+        # served from local ledger, exchange is asked only for orders since the last sync
+        self._order_ledger.sync(symbol)
+        return self._order_ledger.orders(symbol, limit, start_ms, end_ms)
+
+    def _get_symbol_pnl(self, symbol: str) -> dict:
+        self._order_ledger.sync(symbol)
+        return self._order_ledger.pnl(symbol, self._price_snapshot.price(symbol))
 
     def _get_account_balances(self) -> list:
         return self._client.get_account()['balances']
 
     def _get_symbol_avg_price(self, symbol: str) -> float:
-        symbol_avg_price = float(self._client.get_avg_price(symbol=symbol)['price'])
+        book = self._pairs_data[symbol]['book']
+        if book:
+            # mid price from book ticker stream saves a REST request
+            symbol_avg_price = (book[0] + book[1]) / 2
+        else:
+            with self._metrics.timer(PRICE_STAGE, symbol):
+                symbol_avg_price = float(self._client.get_avg_price(symbol=symbol)['price'])
         return round_step_size(symbol_avg_price, self._pairs_data[symbol]['tick_size'])
 
     def _get_symbol_order(self, symbol: str, orderId: str) -> dict:
         return self._client.get_order(symbol=symbol, orderId=orderId)
 
     def _get_ticksize(self, symbol) -> float:
-        price_filter_index = 0
-        symbol_filters = self._client.get_symbol_info(symbol=symbol)['filters']
-        return float(symbol_filters[price_filter_index]['tickSize'])
+        return self._exchange_info.tick_size(symbol)
 
     def _get_symbol_info(self, symbol) -> dict:
-        return self._client.get_symbol_info(symbol=symbol)
-
-    def _get_asset_value(self, asset_dict) -> Tuple[float, float]:
-        default_amounts = {'BNB': 1000.0,
-                           'BTC': 1.0,
-                           'BUSD': 10000.0,
-                           'ETH': 100.0,
-                           'LTC': 500.0,
-                           'TRX': 500000.0,
-                           'USDT': 10000.0,
-                           'XRP': 50000.0}
-
-        if asset_dict['asset'] in ['BUSD', 'USDT']:
-            return float(asset_dict['free']), default_amounts[asset_dict['asset']]
-        else:
-            ticker = self._client.get_ticker(symbol=asset_dict['asset'] + "BUSD")
-            price = float(ticker['lastPrice'])
-            return float(asset_dict['free']) * price, default_amounts[asset_dict['asset']] * price
+        return self._exchange_info.symbol_info(symbol)
+
+    def _get_balance_values(self) -> dict:
+        """
+        Account balances with BUSD value of every asset and of the whole account, valued at once from one
+        price snapshot, and the value of balances the robot started with at the same prices. Assets
+        without a route to BUSD are listed in errors.
+        """
+        balances = self._get_account_balances() or []
+        self._portfolio.set_prices(self._price_snapshot.prices())
+        self._portfolio.set_balances(balances)
+        valuation = self._portfolio.valuation()
+        history = self._portfolio.history()
+        return {'balances': balances, 'values': valuation['values'],
+                'errors': {asset: f"no route to {self._portfolio.quote}" for asset in valuation['missing']},
+                'total': valuation['total'], 'total_start': self._portfolio.start_value(),
+                'pnl': history[-1][2] if history else 0.0}
+
+    def _get_portfolio_history(self) -> list:
+        return self._portfolio.history()
+
+    def _get_positions(self) -> dict:
+        with self._lock:
+            return {symbol: config['position'] for symbol, config in self._pairs_config.items()}
 
     # GETTERS END
 
@@ -399,77 +1058,88 @@ class Robot:
     def _cancel_symbol_order(self, symbol: str, orderId: str) -> dict:
         return self._client.cancel_order(symbol=symbol, orderId=orderId)
 
-    # Makes order at given price and returns result if successful or not
-    def _make_order(self, symbol: str, side: str, qty: float, price: float = None) -> bool:
-        # Retry is useful if order type is LIMIT
-        retries = 0
-        order_completed = False
-        while not order_completed and retries < ORDER_MAX_RETRIES:
-            try:
-                print(f"Trading {symbol} for {side} and {price}")
-                response = self._client.create_order(
-                    symbol=symbol,
-                    side=side,
-                    type=self._pairs_config[symbol]['order_type'],
-                    quantity=qty,
-                    price=price,
-                    timeInForce=self._pairs_config[symbol]['time_in_force'],
-                )
-                print(f"{response['side']} {response['type']} {response['symbol']} {response['status']}")
-                if response['status'] == Client.ORDER_STATUS_FILLED:
-                    order_completed = True
-                    break
-            except exceptions.BinanceOrderException as e:
-                print(e.message)
-            retries += 1
-            time.sleep(ORDER_RETRY_WAIT_TIME_S)
-        return order_completed
+    # Starts placing order at given price without waiting for it, position of symbol is switched to
+    # next_position once order is filled
+    def _make_order(self, symbol: str, side: str, qty: float, price: float = None,
+                    next_position: str = None) -> Future:
+        def switch_position(order: Order) -> None:
+            if order.response is not None:
+                with self._lock:
+                    self._set_position(symbol, next_position)
+
+        on_done = switch_position if next_position else None
+        return self._orders.submit(symbol, side, qty, self._pairs_config[symbol]['order_type'],
+                                   self._pairs_config[symbol]['time_in_force'], price, on_done=on_done)
+
+    # Starts placing both legs of a pair at once, positions are switched only if the pair ends up hedged
+    def _make_pair_order(self, pair: dict, legs: list) -> None:
+        def on_done(hedged: bool, skew_ms: float) -> None:
+            with self._lock:
+                if hedged:
+                    for symbol, _, next_position in legs:
+                        self._set_position(symbol, next_position)
+                    pair['leg_skew_ms'] = skew_ms
+                pair['executing'] = False
+
+        pair['executing'] = True
+        self._orders.submit_pair([(symbol, side, self._pairs_config[symbol]['trade_quantity'],
+                                   self._pairs_config[symbol]['order_type'],
+                                   self._pairs_config[symbol]['time_in_force'], None)
+                                  for symbol, side, _ in legs],
+                                 on_done, self._pair_leg_failure)
+        pass
+
+    def _make_market_order(self, symbol: str, side: str, qty: str) -> dict:
+        return self._client.create_order(
+            symbol=symbol,
+            side=side,
+            type=Client.ORDER_TYPE_MARKET,
+            quantity=qty,
+        )
 
     # OTHER API CALLS END
 
     # MENU OPTIONS START
     def _save_pairs_data(self) -> None:
         validate(instance=self._pairs_config, schema=pairs_schema)
-        with open(PAIRS_FILE_NAME, 'w') as pairs_file:
+        with open(self._pairs_file_name, 'w') as pairs_file:
             json.dump(self._pairs_config, pairs_file, indent=2, separators=(',', ': '))
         pass
 
     def _print_balances(self) -> None:
-        balances = self._get_account_balances()
-        asset_values = {}
-        asset_default_values = {}
-        if balances:
-            for asset in balances:
-                print(asset)
-                try:
-                    value, default_value = self._get_asset_value(asset)
-                    asset_values[asset['asset']] = value
-                    asset_default_values[asset['asset']] = default_value
-                except exceptions.BinanceAPIException as e:
-                    print(f"Error while fetching value for {asset['asset']}: {e}")
-                    continue
-
-        total_value = sum(asset_values.values())
-        print(f"Total value: {total_value} BUSD")
-        total_default_value = sum(asset_default_values.values())
-        print(f"Total default value: {total_default_value}")
-        print(f"Difference {(total_value - total_default_value):.2f} BUSD")
+        values = self._get_balance_values()
+        for asset in values['balances']:
+            print(asset)
+            if asset['asset'] in values['errors']:
+                print(f"Error while fetching value for {asset['asset']}: {values['errors'][asset['asset']]}")
+
+        print(f"Total value: {values['total']} BUSD")
+        print(f"Starting balances value: {values['total_start']} BUSD")
+        print(f"Difference {(values['total'] - values['total_start']):.2f} BUSD")
+        print(f"Mark-to-market PnL {values['pnl']:.2f} BUSD")
         pass
 
     def _print_positions(self) -> None:
-        for key, value in self._pairs_config.items():
-            print(f"{key} position: {value['position']}")
+        for key, value in self._get_positions().items():
+            print(f"{key} position: {value}")
         pass
 
     def _print_symbol_orders(self) -> None:
         symbol = input("Enter symbol: ")
         last_n_items = int(input("Enter how many last orders to print: "))
-        orders = self._get_symbol_orders(symbol=symbol)
-        if orders:
-            orders = orders[-last_n_items:]
-            for order in orders:
-                print(f"id:{order['orderId']} price:{order['price']} "
-                      f"side:{order['side']} executed:{order['executedQty']}")
+        orders = self._get_symbol_orders(symbol=symbol, limit=last_n_items)
+        for order in orders:
+            print(f"id:{order['orderId']} price:{order['price']} "
+                  f"side:{order['side']} executed:{order['executedQty']}")
+        pass
+
+    def _print_symbol_pnl(self) -> None:
+        symbol = input("Enter symbol: ")
+        pnl = self._get_symbol_pnl(symbol)
+        print(f"{symbol}: {pnl['trades']} trades, bought {pnl['bought']}, sold {pnl['sold']}, "
+              f"cash {pnl['cash']:.2f}, commissions {pnl['commissions']}")
+        if 'pnl' in pnl:
+            print(f"PnL at {pnl['price']}: {pnl['pnl']:.2f}")
         pass
 
     def _print_symbol_order(self) -> None:
@@ -491,36 +1161,41 @@ class Robot:
         symbol_info = self._get_symbol_info(symbol)
         print(f"{symbol_info['filters'][0]}")
 
-    def _graph_symbol_orders(self) -> None:
-        for symbol in self._pairs_data:
-            orders = self._get_symbol_orders(symbol=symbol)
-            orders_filtered = [
-                {'time': order['time'], 'price': float(order['price']),
-                 'side': order['side'], 'executed': float(order['executedQty'])} for order in orders]
-            orders_df = pd.DataFrame(orders_filtered, columns=['time', 'price', 'side', 'executed'])
-
-            start_str = str(orders_df['time'].iloc[0])
-            end_str = str(orders_df['time'].iloc[-1])
-
-            klines = self._client.get_historical_klines(symbol, self._interval, start_str=start_str, end_str=end_str)
-            klines = np.array(klines)
-            prices_df = pd.DataFrame(klines.reshape(-1, 12), dtype=float, columns=KLINES_COLUMNS)
-            prices_df['Open Time'] = pd.to_datetime(prices_df['Open Time'], unit='ms')
-            prices_df = prices_df[['Open Time', 'Close']]
+    def _graph_symbol_orders(self) -> list:
+        """
+        Save a graph of prices and orders of every symbol that has orders, rendered in parallel processes.
+        Returns saved file names.
+        """
+        from util import render_order_graphs
 
-            graph_orders(symbol, orders_df, prices_df)
+        orders = {}
+        for symbol in self._pairs_data:
+            symbol_orders = self._get_symbol_orders(symbol=symbol)
+            if symbol_orders:
+                orders[symbol] = {
+                    'time': np.array([order['time'] for order in symbol_orders], dtype=np.int64),
+                    'price': np.array([float(order['price']) for order in symbol_orders]),
+                    'side': np.array([order['side'] for order in symbol_orders]),
+                    'executed': np.array([float(order['executedQty']) for order in symbol_orders]),
+                }
+        futures = {symbol: self._fetch_executor.submit(self._get_klines_range, symbol, int(symbol_orders['time'][0]),
+                                                       int(symbol_orders['time'][-1]))
+                   for symbol, symbol_orders in orders.items()}
+        return render_order_graphs([(symbol, symbol_orders, futures[symbol].result())
+                                    for symbol, symbol_orders in orders.items()])
+
+    def _get_klines_range(self, symbol: str, start_ms: int, end_ms: int) -> np.ndarray:
+        if self._kline_cache:
+            return self._kline_cache.range(symbol, start_ms, end_ms)
+        return klines_to_array(self._client.get_historical_klines(symbol, self._interval, start_str=str(start_ms),
+                                                                  end_str=str(end_ms)))
 
     def _try_to_make_order(self) -> None:
         print("Will be placing market order!")
         symbol = input("Enter symbol: ")
         side = input("Enter side: ")
         qty = input("Enter quantity: ")
-        response = self._client.create_order(
-            symbol=symbol,
-            side=side,
-            type=Client.ORDER_TYPE_MARKET,
-            quantity=qty,
-        )
+        response = self._make_market_order(symbol, side, qty)
         if response['status'] == Client.ORDER_STATUS_FILLED:
             print("Order placed")
         else:
@@ -535,7 +1210,19 @@ config_schema = {
         "api_key": {"type": "string"},
         "api_secret": {"type": "string"},
         "timeout": {"type": "integer", "minimum": MIN_MENU_TIMEOUT_S, "maximum": MAX_MENU_TIMEOUT_S},
-        "interval": {"enum": ["1m", "3m", "5m", "15m", "30m", "1h", "2h", "4h", "8h", "12h", "1d", "3d", "1w", "1M"]},
+        "interval": {"enum": KLINE_INTERVALS},
+        "long_interval": {"enum": KLINE_INTERVALS},
+        "short_interval": {"enum": KLINE_INTERVALS},
+        "stream": {"type": "boolean"},
+        "arima_reselect": {"type": "integer", "minimum": 1},
+        "arima_timeout": {"type": ["number", "null"], "exclusiveMinimum": 0},
+        "stream_url": {"type": "string"},
+        "market_bus": {"type": "string", "pattern": "^[A-Za-z0-9_]+$"},
+        "api_url": {"type": "string"},
+        "control_port": {"type": "integer", "minimum": 1, "maximum": 65535},
+        "metrics": {"type": "boolean"},
+        "metrics_port": {"type": "integer", "minimum": 1, "maximum": 65535},
+        "trace_file": {"type": "string"},
         "strategy": {
             "type": "string",
             "enum": [TENDENCY_STRATEGY, MEAN_STRATEGY, PT_STRATEGY]
@@ -554,6 +1241,9 @@ config_schema = {
             "minimum": MIN_LONG_TERM_BAND,
             "maximum": MAX_LONG_TERM_BAND
         },
+        "spread_stats": {"enum": [ROLLING_SPREAD_STATS, EWM_SPREAD_STATS]},
+        "spread_span": {"type": "integer", "minimum": 2},
+        "pair_leg_failure": {"enum": [PAIR_UNWIND, PAIR_REHEDGE]},
         "entry_treshold": {
             "type": "number",
             "format": "float",
@@ -0,0 +1,250 @@
+import copy
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+
+from jsonschema import validate
+
+from market_bus import MarketFeeder, MARKET_BUS_CAPACITY, MARKET_BUS_NAME
+from robot import Robot, make_client, sma_warmup_limit, MEAN_STRATEGY, PT_STRATEGY
+
+RUNTIME_FILE_NAME = 'runtime.json'
+RUNTIME_DIR = 'runtime'  # worker positions, logs and caches
+DEFAULT_MAX_SYMBOLS_PER_WORKER = 10
+SUPERVISOR_CHECK_S = 1
+RESTART_MIN_WAIT_S = 1
+RESTART_MAX_WAIT_S = 300  # 5 minutes
+RESTART_RESET_S = 600  # worker running this long is considered healthy again
+WORKER_STOP_TIMEOUT_S = 30
+
+
+def load_json(value):
+    """
+    Strategy config and pairs can be given inline or as a JSON file name.
+    """
+    if isinstance(value, str):
+        with open(value, 'r') as json_file:
+            return json.load(json_file)
+    return value
+
+
+def shard_symbols(config: dict, pairs_config: dict, max_symbols: int) -> list:
+    """
+    Split symbols of one strategy into shards of at most max_symbols symbols.
+
+    Pairs sharing a symbol are kept in the same shard, because position of a symbol is shared by its
+    pairs. Group of connected pairs bigger than max_symbols gets a shard of its own.
+
+    Returns:
+    A list of (config, pairs config) tuples, one per shard.
+    """
+    if config['strategy'] == PT_STRATEGY:
+        parents = {symbol: symbol for symbol in pairs_config}
+
+        def find(symbol):
+            while parents[symbol] != symbol:
+                parents[symbol] = parents[parents[symbol]]
+                symbol = parents[symbol]
+            return symbol
+
+        for pair in config['pairs']:
+            parents[find(pair['asset1'])] = find(pair['asset2'])
+        groups = {}
+        for pair in config['pairs']:
+            groups.setdefault(find(pair['asset1']), []).append(pair)
+    else:
+        groups = {symbol: [] for symbol in pairs_config}
+
+    shards = []
+    current_pairs, current_symbols = [], []
+    for root, pairs in groups.items():
+        symbols = sorted({symbol for pair in pairs for symbol in pair.values()}) if pairs else [root]
+        if current_symbols and len(current_symbols) + len(symbols) > max_symbols:
+            shards.append((current_pairs, current_symbols))
+            current_pairs, current_symbols = [], []
+        current_pairs = current_pairs + pairs
+        current_symbols = current_symbols + symbols
+    if current_symbols:
+        shards.append((current_pairs, current_symbols))
+
+    result = []
+    for pairs, symbols in shards:
+        shard_config = copy.deepcopy(config)
+        if config['strategy'] == PT_STRATEGY:
+            shard_config['pairs'] = copy.deepcopy(pairs)
+        result.append((shard_config, {symbol: copy.deepcopy(pairs_config[symbol]) for symbol in symbols}))
+    return result
+
+
+def run_worker(name: str, config: dict, pairs_config: dict, pairs_file_name: str) -> None:
+    """
+    Worker process entry, trades one shard with its own robot and client until SIGTERM.
+    """
+    # supervisor decides when workers stop, a shared multiprocessing Event is not used for that
+    # because setting it hangs once a worker waiting on it was killed
+    stop_event = threading.Event()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *args: stop_event.set())
+    sys.stdout = sys.stderr = open(os.path.join(RUNTIME_DIR, f'{name}.log'), 'a', buffering=1)
+    if os.path.exists(pairs_file_name):
+        # positions saved by previous run of this worker
+        with open(pairs_file_name, 'r') as pairs_file:
+            saved = json.load(pairs_file)
+        for symbol, symbol_config in pairs_config.items():
+            if symbol in saved:
+                symbol_config['position'] = saved[symbol]['position']
+    print(f"Worker {name} started with {list(pairs_config)}")
+    # kline cache and exchange info files allow a single writer, so every worker keeps its own
+    cache_dir = os.path.join(RUNTIME_DIR, name)
+    os.makedirs(cache_dir, exist_ok=True)
+    robot = Robot(config, pairs_config, pairs_file_name=pairs_file_name, cache_dir=cache_dir)
+    robot.run_headless(stop_event)
+    print(f"Worker {name} stopped")
+
+
+def run_feeder(name: str, config: dict, symbols: list, interval: str, capacity: int) -> None:
+    """
+    Feeder process entry, publishes klines of every worker's symbols on the market bus until SIGTERM.
+    """
+    stop_event = threading.Event()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *args: stop_event.set())
+    sys.stdout = sys.stderr = open(os.path.join(RUNTIME_DIR, f'{name}.log'), 'a', buffering=1)
+    print(f"Feeder {name} started with {symbols}")
+    feeder = MarketFeeder(make_client(config), symbols, interval, config['market_bus'], capacity,
+                          config.get('stream', False), config.get('stream_url'))
+    feeder.run(stop_event)
+    print(f"Feeder {name} stopped")
+
+
+class Supervisor:
+    """
+    Runs every shard of every strategy in its own process and restarts crashed workers with
+    exponential backoff until stopped. With market_bus, one feeder process per interval fetches klines
+    for all workers, which read them from shared memory.
+    """
+
+    def __init__(self, runtime: dict):
+        validate(instance=runtime, schema=runtime_schema)
+        self._context = multiprocessing.get_context('spawn')
+        self._stop_event = threading.Event()
+        self._workers = {}
+        max_symbols = runtime.get('max_symbols_per_worker', DEFAULT_MAX_SYMBOLS_PER_WORKER)
+        # (config, symbols, capacity) of every feeder by interval
+        feeds = {}
+        shards = []
+        for strategy in runtime['strategies']:
+            config = load_json(strategy['config'])
+            pairs_config = load_json(strategy['pairs'])
+            if runtime.get('market_bus', False):
+                config = dict(config, market_bus=MARKET_BUS_NAME)
+                feed_config, symbols, capacity = feeds.get(config['interval'], (config, set(), MARKET_BUS_CAPACITY))
+                if config['strategy'] == MEAN_STRATEGY:
+                    capacity = max(capacity, sma_warmup_limit(config))
+                feeds[config['interval']] = (feed_config, symbols | set(pairs_config), capacity)
+            for index, shard in enumerate(shard_symbols(config, pairs_config, max_symbols)):
+                if 'metrics_port' in shard[0]:
+                    # every shard serves metrics on its own port
+                    shard[0]['metrics_port'] += index
+                shards.append((f"{strategy['name']}-{index}", shard))
+        # feeders start first, workers wait for their klines
+        for interval, (config, symbols, capacity) in feeds.items():
+            self._add_worker(f"feeder-{interval}", run_feeder, (config, sorted(symbols), interval, capacity))
+        for name, (shard_config, shard_pairs) in shards:
+            self._add_worker(name, run_worker,
+                             (shard_config, shard_pairs, os.path.join(RUNTIME_DIR, f'{name}_pairs.json')))
+
+    def run(self) -> None:
+        os.makedirs(RUNTIME_DIR, exist_ok=True)
+        signal.signal(signal.SIGTERM, lambda *args: self._stop_event.set())
+        print(f"Starting {len(self._workers)} workers: {', '.join(self._workers)}")
+        try:
+            while not self._stop_event.is_set():
+                self._check_workers()
+                self._stop_event.wait(SUPERVISOR_CHECK_S)
+        except KeyboardInterrupt:
+            pass
+        self.stop()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        processes = {name: worker['process'] for name, worker in self._workers.items()
+                     if worker['process'] is not None and worker['process'].is_alive()}
+        for process in processes.values():
+            process.terminate()
+        deadline = time.monotonic() + WORKER_STOP_TIMEOUT_S
+        for name, process in processes.items():
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                print(f"Worker {name} did not stop in time, killing")
+                process.kill()
+                process.join()
+        print("All workers stopped")
+
+    def _add_worker(self, name: str, target, args: tuple) -> None:
+        self._workers[name] = {
+            'target': target,
+            'args': (name, *args),
+            'process': None,
+            'restarts': 0,
+            'started': None,
+            'restart_at': 0.0,
+        }
+
+    def _check_workers(self) -> None:
+        now = time.monotonic()
+        for name, worker in self._workers.items():
+            process = worker['process']
+            if process is not None and process.is_alive():
+                if worker['restarts'] and now - worker['started'] > RESTART_RESET_S:
+                    worker['restarts'] = 0
+                continue
+            if process is not None and worker['restart_at'] <= worker['started']:
+                # crashed since last check, wait before restart
+                wait_s = min(RESTART_MAX_WAIT_S, RESTART_MIN_WAIT_S * 2 ** worker['restarts'])
+                worker['restarts'] += 1
+                worker['restart_at'] = now + wait_s
+                print(f"Worker {name} exited with code {process.exitcode}, restarting in {wait_s} s")
+            if now < worker['restart_at']:
+                continue
+            worker['process'] = self._context.Process(target=worker['target'], args=worker['args'], name=name)
+            worker['process'].start()
+            worker['started'] = now
+
+
+runtime_schema = {
+    "type": "object",
+    "required": ["strategies"],
+    "properties": {
+        "max_symbols_per_worker": {"type": "integer", "minimum": 1},
+        "market_bus": {"type": "boolean"},
+        "strategies": {
+            "type": "array",
+            "minItems": 1,
+            "items": {
+                "type": "object",
+                "required": ["name", "config", "pairs"],
+                "properties": {
+                    "name": {"type": "string", "pattern": "^[A-Za-z0-9_]+$"},
+                    "config": {"type": ["string", "object"]},
+                    "pairs": {"type": ["string", "object"]}
+                },
+                "additionalProperties": False
+            }
+        }
+    },
+    "additionalProperties": False
+}
+
+
+def main():
+    file_name = sys.argv[1] if len(sys.argv) > 1 else RUNTIME_FILE_NAME
+    Supervisor(load_json(file_name)).run()
+
+
+if __name__ == '__main__':
+    main()
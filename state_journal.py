@@ -0,0 +1,151 @@
+import json
+import os
+import pickle
+import struct
+import threading
+import zlib
+
+STATE_JOURNAL_SUFFIX = '.journal'
+STATE_SNAPSHOT_SUFFIX = '.snapshot'
+STATE_SNAPSHOT_VERSION = 1
+STATE_FSYNC_INTERVAL_S = 0.2  # journal writes are flushed to disk together at most this often
+STATE_SNAPSHOT_EVERY_TICKS = 10
+
+# payload length and CRC32 of payload in front of every journal record
+RECORD_HEADER = struct.Struct('<II')
+
+
+class StateJournal:
+    """
+    Append-only journal of robot state changes next to compacted snapshots of the whole state.
+
+    Records are JSON payloads behind a length and CRC32 header, written straight to the file so they
+    survive a crash of the process; fsync for power loss runs on a background thread, batching every
+    record written within fsync_interval. Snapshot is a pickle written atomically with the sequence
+    number of the last record it includes, after which the journal is truncated when nothing was
+    appended meanwhile. A record torn by a crash ends replay and is cut off.
+    """
+
+    def __init__(self, base_name: str, fsync_interval: float = STATE_FSYNC_INTERVAL_S):
+        self._journal_file_name = base_name + STATE_JOURNAL_SUFFIX
+        self._snapshot_file_name = base_name + STATE_SNAPSHOT_SUFFIX
+        self._fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        # serializes snapshot writes, appends are not held up by them
+        self._snapshot_lock = threading.Lock()
+        self._seq = 0
+        self._snapshot_seq = 0
+        self._fd = None
+        self._dirty = False
+        self._stop_event = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name='state-journal', daemon=True)
+
+    @property
+    def opened(self) -> bool:
+        return self._fd is not None
+
+    def load(self) -> tuple:
+        """
+        Read the snapshot and journal records written after it, then open journal for appending.
+
+        Returns:
+        (snapshot state or None, list of records newer than the snapshot)
+        """
+        state, snapshot_seq = None, 0
+        if os.path.exists(self._snapshot_file_name):
+            try:
+                with open(self._snapshot_file_name, 'rb') as snapshot_file:
+                    snapshot = pickle.load(snapshot_file)
+                if snapshot['version'] == STATE_SNAPSHOT_VERSION:
+                    state, snapshot_seq = snapshot['state'], snapshot['seq']
+            except Exception as e:
+                print(f"State snapshot {self._snapshot_file_name} is unreadable: {e}")
+        records, end = self._read_journal()
+        self._seq = max([snapshot_seq] + [record['seq'] for record in records])
+        self._snapshot_seq = snapshot_seq
+        self._fd = os.open(self._journal_file_name, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        # torn tail of a crashed write would hide every record appended after it
+        os.ftruncate(self._fd, end)
+        self._flusher.start()
+        return state, [record for record in records if record['seq'] > snapshot_seq]
+
+    def append(self, record: dict) -> None:
+        with self._lock:
+            self._seq += 1
+            payload = json.dumps({'seq': self._seq, **record}, separators=(',', ':')).encode()
+            os.write(self._fd, RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+            self._dirty = True
+
+    def encode(self, state: dict) -> tuple:
+        """
+        Serialize state that includes every record appended so far, without any disk access, so callers
+        can do it under their own lock and write it with snapshot after releasing that lock.
+
+        Returns:
+        (sequence number of the last included record, snapshot bytes)
+        """
+        with self._lock:
+            seq = self._seq
+        return seq, pickle.dumps({'version': STATE_SNAPSHOT_VERSION, 'seq': seq, 'state': state},
+                                 protocol=pickle.HIGHEST_PROTOCOL)
+
+    def snapshot(self, seq: int, data: bytes) -> None:
+        """
+        Atomically save snapshot from encode and drop journal records it includes. Snapshot older than
+        the saved one is ignored; journal is kept when records were appended since encode, replay skips
+        records the snapshot includes.
+        """
+        with self._snapshot_lock:
+            if seq < self._snapshot_seq:
+                return
+            temp_file_name = f"{self._snapshot_file_name}.tmp"
+            with open(temp_file_name, 'wb') as snapshot_file:
+                snapshot_file.write(data)
+                snapshot_file.flush()
+                os.fsync(snapshot_file.fileno())
+            os.replace(temp_file_name, self._snapshot_file_name)
+            self._snapshot_seq = seq
+            with self._lock:
+                if self._seq != seq:
+                    return
+                os.ftruncate(self._fd, 0)
+                self._dirty = True
+
+    def close(self) -> None:
+        if self._fd is None:
+            return
+        self._stop_event.set()
+        self._flusher.join()
+        with self._lock:
+            os.fsync(self._fd)
+            os.close(self._fd)
+            self._fd = None
+
+    def _read_journal(self) -> tuple:
+        """
+        Records of journal up to the first torn or corrupted one, and the file offset where it starts.
+        """
+        if not os.path.exists(self._journal_file_name):
+            return [], 0
+        with open(self._journal_file_name, 'rb') as journal_file:
+            data = journal_file.read()
+        records = []
+        offset = 0
+        while offset + RECORD_HEADER.size <= len(data):
+            length, crc = RECORD_HEADER.unpack_from(data, offset)
+            payload = data[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            records.append(json.loads(payload))
+            offset += RECORD_HEADER.size + length
+        return records, offset
+
+    def _flush_loop(self) -> None:
+        while not self._stop_event.wait(self._fsync_interval):
+            with self._lock:
+                if not self._dirty or self._fd is None:
+                    continue
+                self._dirty = False
+                fd = self._fd
+            # fsync outside the lock, appends are not held up while disk catches up
+            os.fsync(fd)
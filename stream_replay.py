@@ -0,0 +1,40 @@
+import asyncio
+import sys
+
+import websockets
+
+DEFAULT_PORT = 8765
+DEFAULT_DELAY_S = 0.0
+
+
+def load_messages(file_name: str) -> list:
+    with open(file_name, 'r') as messages_file:
+        return [line.strip() for line in messages_file if line.strip()]
+
+
+async def serve(messages: list, port: int, delay: float) -> None:
+    """
+    Replay recorded combined stream messages to every client that connects, then keep connection open.
+    """
+    async def replay(websocket, *args):
+        for message in messages:
+            await websocket.send(message)
+            await asyncio.sleep(delay)
+        await websocket.wait_closed()
+
+    async with websockets.serve(replay, 'localhost', port):
+        print(f"Replaying {len(messages)} messages on ws://localhost:{port}/")
+        await asyncio.Future()
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python stream_replay.py <messages.jsonl> [port] [delay_s]")
+        return
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_PORT
+    delay = float(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_DELAY_S
+    asyncio.run(serve(load_messages(sys.argv[1]), port, delay))
+
+
+if __name__ == '__main__':
+    main()
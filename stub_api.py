@@ -0,0 +1,193 @@
+import json
+import math
+import sys
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from binance.helpers import interval_to_milliseconds
+
+DEFAULT_PORT = 8080
+DEFAULT_WEIGHT_LIMIT = 1200  # per minute
+DEFAULT_ORDER_LIMIT = 50  # per 10 seconds
+RETRY_AFTER_S = 5
+
+# weight of each stubbed endpoint
+ENDPOINT_WEIGHTS = {
+    '/api/v3/ping': 1,
+    '/api/v3/time': 1,
+    '/api/v3/exchangeInfo': 20,
+    '/api/v3/klines': 2,
+    '/api/v3/avgPrice': 2,
+    '/api/v3/ticker/price': 4,
+    '/api/v3/order': 1,
+    '/api/v3/allOrders': 20,
+    '/api/v3/myTrades': 20,
+    '/api/v3/account': 20,
+}
+
+
+def stub_price(symbol: str, open_time: int) -> float:
+    # smooth deterministic price, different for every symbol
+    phase = sum(map(ord, symbol))
+    return round(100 + 10 * math.sin(open_time / 3600000 + phase), 2)
+
+
+class StubExchange:
+    """
+    Counts request weight and orders in fixed windows like exchange does, reporting them in
+    X-MBX-USED-WEIGHT-1M and X-MBX-ORDER-COUNT-10S headers and answering 429 over the limit.
+    """
+
+    def __init__(self, symbols: list, weight_limit: int = DEFAULT_WEIGHT_LIMIT,
+                 order_limit: int = DEFAULT_ORDER_LIMIT):
+        self.symbols = symbols
+        self.weight_limit = weight_limit
+        self.order_limit = order_limit
+        self.requests = []
+        self._used = {}
+        self._orders = []
+        self._lock = threading.Lock()
+
+    def count(self, path: str, order: bool) -> tuple:
+        """
+        Count a request and return (used weight, order count, rate limited).
+        """
+        with self._lock:
+            now = time.time()
+            minute = int(now // 60)
+            ten_seconds = int(now // 10)
+            weight = self._used.get(('weight', minute), 0) + ENDPOINT_WEIGHTS.get(path, 1)
+            orders = self._used.get(('orders', ten_seconds), 0) + int(order)
+            self._used = {('weight', minute): weight, ('orders', ten_seconds): orders}
+            self.requests.append((now, path, weight))
+            return weight, orders, weight > self.weight_limit or orders > self.order_limit
+
+    def exchange_info(self) -> dict:
+        return {
+            'rateLimits': [
+                {'rateLimitType': 'REQUEST_WEIGHT', 'interval': 'MINUTE', 'intervalNum': 1,
+                 'limit': self.weight_limit},
+                {'rateLimitType': 'ORDERS', 'interval': 'SECOND', 'intervalNum': 10, 'limit': self.order_limit},
+            ],
+            'symbols': [{'symbol': symbol, 'filters': [{'filterType': 'PRICE_FILTER', 'tickSize': '0.01'}]}
+                        for symbol in self.symbols],
+        }
+
+    def klines(self, symbol: str, interval: str, limit: int, start_time: int = None, end_time: int = None) -> list:
+        interval_ms = interval_to_milliseconds(interval)
+        last = int(time.time() * 1000) // interval_ms * interval_ms
+        if end_time is not None:
+            last = min(last, end_time // interval_ms * interval_ms)
+        if start_time is not None:
+            first = -(-start_time // interval_ms) * interval_ms
+            last = min(last, first + (limit - 1) * interval_ms)
+        else:
+            first = last - (limit - 1) * interval_ms
+        klines = []
+        for open_time in range(first, last + 1, interval_ms):
+            close = str(stub_price(symbol, open_time))
+            klines.append([open_time, close, close, close, close, '0', open_time + interval_ms - 1,
+                           '0', 0, '0', '0', '0'])
+        return klines
+
+    def order(self, params: dict) -> dict:
+        with self._lock:
+            self._orders.append(params)
+            order_id = len(self._orders)
+        return {'symbol': params['symbol'], 'orderId': order_id,
+                'clientOrderId': params.get('newClientOrderId', str(order_id)), 'side': params['side'],
+                'type': params['type'], 'status': 'FILLED', 'executedQty': params['quantity'],
+                'origQty': params['quantity'], 'price': params.get('price', '0'),
+                'transactTime': int(time.time() * 1000)}
+
+
+def make_handler(exchange: StubExchange):
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self._handle(False)
+
+        def do_POST(self):
+            self._handle(True)
+
+        def do_DELETE(self):
+            self._handle(False)
+
+        def log_message(self, *args):
+            pass
+
+        def _handle(self, order: bool) -> None:
+            url = urlparse(self.path)
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+            params = {key: values[0] for key, values in parse_qs(url.query + '&' + body).items()}
+            weight, orders, limited = exchange.count(url.path, order)
+            if limited:
+                status, payload = 429, {'code': -1003, 'msg': 'Too many requests.'}
+            else:
+                status, payload = 200, self._response(url.path, params)
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.send_header('X-MBX-USED-WEIGHT-1M', str(weight))
+            if order:
+                self.send_header('X-MBX-ORDER-COUNT-10S', str(orders))
+            if limited:
+                self.send_header('Retry-After', str(RETRY_AFTER_S))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _response(self, path: str, params: dict):
+            if path == '/api/v3/time':
+                return {'serverTime': int(time.time() * 1000)}
+            if path == '/api/v3/exchangeInfo':
+                return exchange.exchange_info()
+            if path == '/api/v3/klines':
+                return exchange.klines(params['symbol'], params['interval'], int(params.get('limit', 500)),
+                                       int(params['startTime']) if 'startTime' in params else None,
+                                       int(params['endTime']) if 'endTime' in params else None)
+            if path == '/api/v3/avgPrice':
+                return {'mins': 5, 'price': str(stub_price(params['symbol'], int(time.time() * 1000)))}
+            if path == '/api/v3/ticker/price':
+                now = int(time.time() * 1000)
+                return [{'symbol': symbol, 'price': str(stub_price(symbol, now))} for symbol in exchange.symbols]
+            if path == '/api/v3/order' and self.command == 'POST':
+                return exchange.order(params)
+            if path in ('/api/v3/allOrders', '/api/v3/myTrades'):
+                return []
+            if path == '/api/v3/account':
+                return {'balances': []}
+            return {}
+
+    return StubHandler
+
+
+def serve(symbols: list, port: int = DEFAULT_PORT, weight_limit: int = DEFAULT_WEIGHT_LIMIT) -> ThreadingHTTPServer:
+    """
+    Start stub REST API on a background thread, point client at http://localhost:{port}/api.
+    """
+    exchange = StubExchange(symbols, weight_limit)
+    server = ThreadingHTTPServer(('localhost', port), make_handler(exchange))
+    server.exchange = exchange
+    threading.Thread(target=server.serve_forever, name='stub-api', daemon=True).start()
+    return server
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python stub_api.py <SYMBOL,SYMBOL> [port] [weight_limit]")
+        return
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_PORT
+    weight_limit = int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_WEIGHT_LIMIT
+    server = serve(sys.argv[1].split(','), port, weight_limit)
+    print(f"Stub API on http://localhost:{port}/api")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+import argparse
+import itertools
+import json
+import os
+import tempfile
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from backtest import (align_klines, holdings_pnl, load_klines, multi_timeframe, pairs_holdings, prefix_sums,
+                      sma_holdings, spread_stats, strategy_warmup)
+from robot import CONFIG_FILE_NAME, PAIRS_FILE_NAME, MEAN_STRATEGY, PT_STRATEGY
+
+SWEEP_PARAMETERS = {
+    MEAN_STRATEGY: ['long_term', 'short_term', 'band'],
+    PT_STRATEGY: ['entry_treshold', 'exit_treshold'],
+}
+SWEEP_TOP_CONFIGS = 5
+
+# arrays memory-mapped by each worker process and sweep context, set by _init_worker
+_arrays = {}
+_context = {}
+
+
+def _init_worker(array_files: dict, context: dict) -> None:
+    for name, file_name in array_files.items():
+        _arrays[name] = np.load(file_name, mmap_mode='r')
+    _context.update(context)
+
+
+def _evaluate(params: dict) -> tuple:
+    """
+    PnL of every symbol (MEAN_SMA) or pair (PT_STRATEGY) for one parameter combination.
+    """
+    warmup = _context['warmup']
+    pnl = {}
+    if _context['strategy'] == MEAN_STRATEGY:
+        for symbol, (start, quantity) in _context['symbols'].items():
+            holdings = sma_holdings(_arrays[f'{symbol}_prefix'], params['long_term'], params['short_term'],
+                                    params['band'], warmup, start)
+            pnl[symbol] = holdings_pnl(_arrays[f'{symbol}_close'][warmup - 1:], holdings, start, quantity)
+    else:
+        for pair, legs in _context['pairs'].items():
+            holdings = pairs_holdings(_arrays[f'{pair}_spread'], _arrays[f'{pair}_mean'], _arrays[f'{pair}_std'],
+                                      params['entry_treshold'], params['exit_treshold'],
+                                      tuple(start for _, start, _ in legs))
+            pnl[pair] = sum(holdings_pnl(_arrays[f'{symbol}_close'][warmup - 1:], leg_holdings, start, quantity)
+                            for (symbol, start, quantity), leg_holdings in zip(legs, holdings))
+    return params, pnl
+
+
+def parameter_combinations(strategy: str, grid: dict, config: dict) -> list:
+    """
+    Every valid combination of grid values, parameters missing from grid are taken from config.
+    """
+    names = SWEEP_PARAMETERS[strategy]
+    values = [grid.get(name, [config.get(name)]) for name in names]
+    combinations = [dict(zip(names, combination)) for combination in itertools.product(*values)]
+    if strategy == MEAN_STRATEGY:
+        return [params for params in combinations if params['short_term'] < params['long_term']]
+    return [params for params in combinations if params['exit_treshold'] < params['entry_treshold']]
+
+
+def run_sweep(config: dict, pairs_config: dict, klines: dict, grid: dict, workers: int = None) -> list:
+    """
+    Evaluate every grid combination on a process pool. Close prices and everything that does not depend
+    on swept parameters (prefix sums, spread mean and std) are computed once and shared with workers
+    through memory-mapped files.
+
+    Returns:
+    A list of (params, pnl by symbol or pair) tuples.
+    """
+    strategy = config['strategy']
+    if strategy not in SWEEP_PARAMETERS:
+        raise ValueError(f"{strategy} can not be swept")
+    if strategy == MEAN_STRATEGY and multi_timeframe(config):
+        raise ValueError("SMAs of different intervals can not be swept, backtest them one by one")
+    empty = [name for name in SWEEP_PARAMETERS[strategy] if name in grid and not grid[name]]
+    if empty:
+        raise ValueError(f"Grid has no values for {', '.join(empty)}")
+    combinations = parameter_combinations(strategy, grid, config)
+    if not combinations:
+        rule = 'short_term < long_term' if strategy == MEAN_STRATEGY else 'exit_treshold < entry_treshold'
+        raise ValueError(f"Grid has no combination with {rule}")
+    klines = align_klines(klines)
+    if strategy == MEAN_STRATEGY:
+        # same first traded candle for every long term, so results are comparable
+        warmup = max(params['long_term'] for params in combinations)
+    else:
+        warmup = strategy_warmup(config)
+    start = {symbol: 1.0 if symbol_config['position'] == 'SELL' else 0.0
+             for symbol, symbol_config in pairs_config.items()}
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        arrays = {}
+        context = {'strategy': strategy, 'warmup': warmup}
+        for symbol in pairs_config:
+            arrays[f'{symbol}_close'] = klines[symbol]['close']
+        if strategy == MEAN_STRATEGY:
+            for symbol in pairs_config:
+                arrays[f'{symbol}_prefix'] = prefix_sums(klines[symbol]['close'])
+            context['symbols'] = {symbol: (start[symbol], pairs_config[symbol]['trade_quantity'])
+                                  for symbol in pairs_config}
+        else:
+            context['pairs'] = {}
+            for pair in config['pairs']:
+                asset1, asset2 = pair['asset1'], pair['asset2']
+                name = f'{asset1}-{asset2}'
+                arrays[f'{name}_spread'], arrays[f'{name}_mean'], arrays[f'{name}_std'] = \
+                    spread_stats(config, klines[asset1]['close'], klines[asset2]['close'], warmup)
+                context['pairs'][name] = [(symbol, start[symbol], pairs_config[symbol]['trade_quantity'])
+                                          for symbol in (asset1, asset2)]
+
+        array_files = {}
+        for name, array in arrays.items():
+            array_files[name] = os.path.join(temp_dir, f'{name}.npy')
+            np.save(array_files[name], np.ascontiguousarray(array))
+
+        workers = workers or os.cpu_count()
+        chunksize = max(1, len(combinations) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(array_files, context)) as executor:
+            return list(executor.map(_evaluate, combinations, chunksize=chunksize))
+
+
+def best_configs(results: list, top: int = SWEEP_TOP_CONFIGS) -> dict:
+    """
+    Best parameter combinations by PnL for every symbol or pair.
+    """
+    best = {}
+    for key in results[0][1] if results else []:
+        ranked = sorted(results, key=lambda result: result[1][key], reverse=True)[:top]
+        best[key] = [(params, pnl[key]) for params, pnl in ranked]
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sweep strategy parameters from config.json over historical klines.')
+    parser.add_argument('grid', help='JSON file with a list of values for each swept parameter')
+    parser.add_argument('data', nargs='+', help='SYMBOL=file with klines (Binance CSV dump or kline cache .bin)')
+    parser.add_argument('--workers', type=int, help='worker processes, all cores by default')
+    parser.add_argument('--top', type=int, default=SWEEP_TOP_CONFIGS, help='best configs to print per symbol')
+    args = parser.parse_args()
+
+    with open(CONFIG_FILE_NAME, 'r') as config_file:
+        config = json.load(config_file)
+    with open(PAIRS_FILE_NAME, 'r') as pairs_file:
+        pairs_config = json.load(pairs_file)
+    with open(args.grid, 'r') as grid_file:
+        grid = json.load(grid_file)
+
+    files = dict(item.split('=', 1) for item in args.data)
+    klines = {symbol: load_klines(file_name) for symbol, file_name in files.items()}
+    pairs_config = {symbol: symbol_config for symbol, symbol_config in pairs_config.items() if symbol in klines}
+
+    start = time.perf_counter()
+    results = run_sweep(config, pairs_config, klines, grid, args.workers)
+    print(f"{len(results)} combinations in {time.perf_counter() - start:.2f} s")
+    for key, configs in best_configs(results, args.top).items():
+        print(key)
+        for params, pnl in configs:
+            print(f"    PnL {pnl:.2f} {params}")
+
+
+if __name__ == '__main__':
+    main()
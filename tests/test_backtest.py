@@ -0,0 +1,36 @@
+import pytest
+
+from backtest import run_backtest
+from benchmark import bench_pairs_config, make_recorded_klines
+from sweep import run_sweep
+
+SYMBOLS = ['BTCBUSD', 'ETHBUSD']
+
+
+def pairs_config(**options) -> dict:
+    return {'api_key': '', 'api_secret': '', 'timeout': 60, 'interval': '1m', 'strategy': 'PT_STRATEGY',
+            'entry_treshold': 1.5, 'exit_treshold': 0.2, 'pairs': [{'asset1': 'BTCBUSD', 'asset2': 'ETHBUSD'}],
+            **options}
+
+
+@pytest.mark.parametrize('options', [{}, {'spread_stats': 'EWM', 'spread_span': 50},
+                                     {'spread_stats': 'EWM', 'spread_span': 5000}])
+def test_vectorized_pairs_backtest_matches_event_driven(options):
+    klines = make_recorded_klines(SYMBOLS, 2500)
+    vectorized = run_backtest(pairs_config(**options), bench_pairs_config(SYMBOLS), klines)
+    event_driven = run_backtest(pairs_config(**options), bench_pairs_config(SYMBOLS), klines, event_driven=True)
+
+    columns = ['time', 'symbol', 'side']
+    assert len(vectorized['fills']) == len(event_driven['fills']) > 0
+    assert (vectorized['fills'][columns].values == event_driven['fills'][columns].values).all()
+    assert vectorized['pnl'] == pytest.approx(event_driven['pnl'])
+
+
+def test_sweep_uses_ewm_spread_stats():
+    klines = make_recorded_klines(SYMBOLS, 2500)
+    config = pairs_config(spread_stats='EWM', spread_span=5000)
+    results = run_sweep(config, bench_pairs_config(SYMBOLS), klines,
+                        {'entry_treshold': [1.5], 'exit_treshold': [0.2]}, workers=1)
+    backtest_pnl = run_backtest(config, bench_pairs_config(SYMBOLS), klines)['pnl']
+
+    assert results[0][1]['BTCBUSD-ETHBUSD'] == pytest.approx(sum(backtest_pnl.values()))
@@ -0,0 +1,84 @@
+import asyncio
+import os
+import socket
+import threading
+import time
+
+import websockets
+
+from market_stream import MarketStream
+from stream_replay import load_messages, serve
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'stream_messages.jsonl')
+WAIT_S = 10
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(coroutine) -> None:
+    threading.Thread(target=asyncio.run, args=(coroutine,), daemon=True).start()
+
+
+def wait_until(condition) -> None:
+    deadline = time.monotonic() + WAIT_S
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+
+def test_replay_passes_closed_klines_and_book_tickers():
+    port = free_port()
+    start_server(serve(load_messages(FIXTURE), port, 0.0))
+    klines, tickers = [], []
+    stream = MarketStream(['BTCBUSD', 'ETHBUSD'], '1m', lambda symbol, kline: klines.append((symbol, kline)),
+                          lambda symbol, bid, ask: tickers.append((symbol, bid, ask)), f'ws://localhost:{port}/')
+    stream.start()
+    try:
+        wait_until(lambda: len(klines) == 10 and len(tickers) == 10)
+    finally:
+        stream.stop()
+
+    assert [symbol for symbol, _ in klines] == ['BTCBUSD', 'ETHBUSD'] * 5
+    btc = [kline for symbol, kline in klines if symbol == 'BTCBUSD']
+    assert [kline[0] for kline in btc] == [1683072000000 + minute * 60000 for minute in range(5)]
+    assert [kline[4] for kline in btc] == ['28500.00', '28502.50', '28505.00', '28507.50', '28510.00']
+    assert tickers[0] == ('BTCBUSD', 28499.99, 28500.01)
+
+
+def test_reconnect_is_reported_before_messages_of_new_connection():
+    messages = load_messages(FIXTURE)
+    connections = []
+
+    async def drop_after_first_half(websocket, *args):
+        connections.append(websocket)
+        half = messages[:len(messages) // 2] if len(connections) == 1 else messages[len(messages) // 2:]
+        for message in half:
+            await websocket.send(message)
+        if len(connections) == 1:
+            await websocket.close()
+        else:
+            await websocket.wait_closed()
+
+    async def run(port):
+        async with websockets.serve(drop_after_first_half, 'localhost', port):
+            await asyncio.Future()
+
+    port = free_port()
+    start_server(run(port))
+    events = []
+    stream = MarketStream(['BTCBUSD', 'ETHBUSD'], '1m', lambda symbol, kline: events.append(kline[0]),
+                          lambda *args: None, f'ws://localhost:{port}/',
+                          on_reconnect=lambda: events.append('reconnect'))
+    stream.start()
+    try:
+        wait_until(lambda: len(events) == 11)
+    finally:
+        stream.stop()
+
+    # first connection ends after BTCBUSD closed the third candle
+    times = [1683072000000 + minute * 60000 for minute in range(5)]
+    assert events == [times[0], times[0], times[1], times[1], times[2], 'reconnect',
+                      times[2], times[3], times[3], times[4], times[4]]
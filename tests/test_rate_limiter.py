@@ -0,0 +1,89 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from binance import exceptions
+
+from rate_limiter import RateLimitedClient, RateLimiter, INFO_PRIORITY, MARKET_DATA_PRIORITY, ORDER_PRIORITY
+from robot import make_client
+from stub_api import RETRY_AFTER_S, serve
+
+SYMBOLS = ['BTCBUSD', 'ETHBUSD']
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def stub():
+    server = serve(SYMBOLS, free_port(), weight_limit=40)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def stub_client(server, limiter: RateLimiter = None) -> RateLimitedClient:
+    config = {'api_key': 'key', 'api_secret': 'secret',
+              'api_url': f"http://localhost:{server.server_address[1]}/api"}
+    client = make_client(config)
+    if limiter is not None:
+        client = RateLimitedClient(client._client, limiter)
+    return client
+
+
+class Response:
+    def __init__(self, status_code: int, headers: dict):
+        self.status_code = status_code
+        self.headers = headers
+
+
+def test_usage_follows_weight_headers_and_exchange_limits(stub):
+    client = stub_client(stub)
+    client.get_exchange_info()
+    for _ in range(3):
+        client.get_avg_price(symbol='BTCBUSD')
+
+    used, limit = client.limiter.usage()[('weight', '1m')]
+    assert limit == 40
+    assert used == stub.exchange.requests[-1][2] == 20 + 3 * 2
+
+
+def test_rate_limit_response_pauses_requests(stub):
+    # client side limit above the stub's, so the stub answers 429
+    limiter = RateLimiter({('weight', '1m'): 10000})
+    client = stub_client(stub, limiter)
+    with pytest.raises(exceptions.BinanceAPIException):
+        for _ in range(30):
+            client.get_avg_price(symbol='BTCBUSD')
+
+    assert limiter._delay(1, ORDER_PRIORITY, False) == pytest.approx(RETRY_AFTER_S, abs=1)
+
+
+def test_waiting_higher_priority_goes_first_after_pause():
+    now = [1000.5]
+    limiter = RateLimiter(clock=lambda: now[0])
+    limiter.on_response(Response(429, {'Retry-After': '5'}))
+    sent = []
+
+    def request(priority):
+        limiter.acquire(1, priority)
+        sent.append(priority)
+
+    # lower priority starts waiting first, so it is also woken first
+    threads = [threading.Thread(target=request, args=(priority,))
+               for priority in (INFO_PRIORITY, MARKET_DATA_PRIORITY)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.1)
+    assert sent == []
+    now[0] += 6
+    limiter.set_limits([])  # wakes waiting requests
+    for thread in threads:
+        thread.join(5)
+
+    assert sent == [MARKET_DATA_PRIORITY, INFO_PRIORITY]
@@ -1,31 +1,98 @@
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
+import multiprocessing
+import os
+
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
+import numpy as np
+
+import matplotlib
+matplotlib.use('Agg')  # graphs are only saved to files, no window is needed
+import matplotlib.dates as mdates
+from matplotlib.figure import Figure
+
+GRAPH_SIZE_IN = (10, 6)
+GRAPH_DPI = 100
+GRAPH_WIDTH_PX = GRAPH_SIZE_IN[0] * GRAPH_DPI
+
+ORDER_COLORS = {'BUY': 'blue', 'SELL': 'green', 'RETRY': 'red'}
+
+
 def timestamp_to_readable(timestamp) -> datetime:
     return datetime.fromtimestamp(timestamp/1000).strftime('%Y-%m-%d %H:%M:%S')
 
-def graph_orders(symbol, orders_df, prices_df) -> None:
-    plt.figure(figsize=(10, 6))
-    plt.plot(prices_df['Open Time'], prices_df['Close'])
-    plt.xlabel('Time')
-    plt.ylabel('Price')
-    plt.xticks(rotation=90)
-
-    unique_labels = set()
-    for order in orders_df.itertuples():
-        color = 'red'
-        if order.executed > 0:
-            color = 'blue' if order.side == 'BUY' else 'green'
-        
-        label = 'RETRY' if color == 'red' else order.side
-        if label not in unique_labels:
-            unique_labels.add(label)
-        else:
-            label = None
-
-        plt.scatter(mdates.datestr2num(timestamp_to_readable(order.time)), order.price, marker='o', alpha=1.0, color=color, label=label)
-
-    plt.legend()
-    plt.savefig(f"{timestamp_to_readable(orders_df['time'].iloc[0])}_{symbol}_graph.png", bbox_inches='tight')
-    plt.close()
+
+def ms_to_datenum(times_ms: np.ndarray) -> np.ndarray:
+    """
+    Matplotlib date numbers of millisecond timestamps, converted at once without strings.
+    """
+    return mdates.date2num(np.asarray(times_ms, dtype=np.int64).astype('datetime64[ms]'))
+
+
+def thin_prices(times: np.ndarray, prices: np.ndarray, width: int = GRAPH_WIDTH_PX) -> tuple:
+    """
+    Keep only the lowest and highest price of every pixel column, in time order, for series longer than
+    two points per pixel. The plotted line looks the same, spikes included.
+    """
+    count = len(prices)
+    if count <= 2 * width:
+        return times, prices
+    bucket = -(-count // width)
+    padded = np.concatenate((prices, np.full(bucket * width - count, prices[-1])))
+    columns = padded.reshape(width, bucket)
+    offsets = np.arange(width) * bucket
+    lows = offsets + columns.argmin(axis=1)
+    highs = offsets + columns.argmax(axis=1)
+    index = np.unique(np.minimum(np.concatenate((lows, highs)), count - 1))
+    return times[index], prices[index]
+
+
+def order_categories(orders: dict) -> dict:
+    """
+    Boolean mask of every order category: executed BUY or SELL orders, and orders with nothing
+    executed that were retried.
+    """
+    executed = orders['executed'] > 0
+    return {'BUY': executed & (orders['side'] == 'BUY'),
+            'SELL': executed & (orders['side'] == 'SELL'),
+            'RETRY': ~executed}
+
+
+def graph_orders(symbol: str, orders: dict, klines: np.ndarray, output_dir: str = '.') -> str:
+    """
+    Plot close prices of klines (KLINE_DTYPE) with orders of symbol on top and save it as a PNG file.
+    Orders are a dict of 'time', 'price', 'side' and 'executed' arrays. Returns the file name.
+    """
+    figure = Figure(figsize=GRAPH_SIZE_IN, dpi=GRAPH_DPI)
+    axes = figure.subplots()
+    times, prices = thin_prices(ms_to_datenum(klines['open_time']), klines['close'])
+    axes.plot(times, prices)
+    axes.set_xlabel('Time')
+    axes.set_ylabel('Price')
+    axes.xaxis_date()
+    axes.tick_params(axis='x', labelrotation=90)
+
+    order_times = ms_to_datenum(orders['time'])
+    for label, mask in order_categories(orders).items():
+        if mask.any():
+            axes.scatter(order_times[mask], orders['price'][mask], marker='o', alpha=1.0,
+                         color=ORDER_COLORS[label], label=label)
+
+    axes.legend()
+    file_name = os.path.join(output_dir, f"{timestamp_to_readable(int(orders['time'][0]))}_{symbol}_graph.png")
+    figure.savefig(file_name, bbox_inches='tight')
+    return file_name
+
+
+def render_order_graphs(graphs: list, output_dir: str = '.', max_workers: int = None) -> list:
+    """
+    Render (symbol, orders, klines) graphs in parallel processes. Returns saved file names in the
+    same order.
+    """
+    if len(graphs) <= 1:
+        return [graph_orders(*graph, output_dir) for graph in graphs]
+    workers = min(max_workers or os.cpu_count(), len(graphs))
+    # spawn, because forking a process with running threads is not safe
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = [executor.submit(graph_orders, *graph, output_dir) for graph in graphs]
+        return [future.result() for future in futures]